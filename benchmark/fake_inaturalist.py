@@ -0,0 +1,308 @@
+"""
+Local stand-in for the iNaturalist API used to measure and regression-test harvesting offline
+
+Serves /v1/observations (id_above paging, per_page, order, order_by), /v1/projects/autocomplete
+and the photo URLs of the observations (with Range requests), with configurable latency, error
+rate, 429 responses, truncated photo transfers and photo payload size. Request counters are available in-process and on /stats.
+
+    python -m benchmark.fake_inaturalist --port 8080 --num_observations 5000 --latency 0.05
+"""
+
+from benchmark.synthetic import create_observations
+
+import argparse
+import bisect
+import io
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+MAX_PER_PAGE = 200
+PROJECT_ID = 1
+
+
+def create_photo(payload_size: int) -> bytes:
+    """Create a valid JPEG of roughly payload_size bytes. Decoders ignore the padding after
+    the end of image marker, so small images can be padded up to any size"""
+    pixels = np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG")
+    photo = buffer.getvalue()
+    return photo + b"\0" * max(0, payload_size - len(photo))
+
+
+class FakeINaturalistServer(ThreadingHTTPServer):
+    """HTTP server holding the synthetic observations and the request counters
+
+    * num_observations: number of observations in the project
+    * num_classes: number of species the observations are spread over
+    * photos_per_observation: number of photos of every observation
+    * latency: seconds to wait before answering every request
+    * error_rate: fraction of the requests answered with a 500
+    * throttle_rate: fraction of the requests answered with a 429 and a Retry-After header
+    * truncate_rate: fraction of the photo transfers cut off halfway through
+    * photo_size: size of every photo in bytes
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        num_observations: int = 1000,
+        num_classes: int = 10,
+        photos_per_observation: int = 1,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        truncate_rate: float = 0.0,
+        photo_size: int = 50_000,
+        seed: int = 42,
+    ):
+        super().__init__(address, FakeINaturalistHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.truncate_rate = truncate_rate
+        self.random = random.Random(seed)
+        self.photo = create_photo(photo_size)
+        self.observations = create_observations(
+            num_observations,
+            num_classes,
+            photos_per_observation=photos_per_observation,
+            photo_url=f"{self.url}/photos",
+            seed=seed,
+        )
+        self.observation_ids = [observation["id"] for observation in self.observations]
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self) -> str:
+        """Base url to use instead of https://api.inaturalist.org"""
+        return self.url
+
+    def record(self, endpoint: str, status: int, num_bytes: int) -> None:
+        """Count a served request"""
+        now = time.perf_counter()
+        with self.lock:
+            stats = self.stats.setdefault(
+                endpoint,
+                {"requests": 0, "bytes": 0, "status": {}, "first": now, "last": now},
+            )
+            stats["requests"] += 1
+            stats["bytes"] += num_bytes
+            stats["status"][str(status)] = stats["status"].get(str(status), 0) + 1
+            stats["last"] = now
+
+    def fail_randomly(self) -> int:
+        """Pick the error status to answer with, None to answer normally"""
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.error_rate:
+            return 500
+        if draw < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+    def truncate_randomly(self) -> bool:
+        """Pick whether to cut the next photo transfer off"""
+        with self.lock:
+            return self.random.random() < self.truncate_rate
+
+    def get_observations(self, params: dict) -> dict:
+        """Page through the observations like /v1/observations does"""
+        per_page = min(int(params.get("per_page", 30)), MAX_PER_PAGE)
+        page = int(params.get("page", 1))
+        descending = params.get("order", "desc") == "desc"
+
+        # The observations are sorted by id (ids follow the creation order), so the page is
+        # sliced out directly instead of filtering every observation on every request
+        start = 0
+        if "id_above" in params:
+            start = bisect.bisect_right(self.observation_ids, int(params["id_above"]))
+        end = len(self.observations)
+        if descending:
+            first = max(start, end - page * per_page)
+            results = self.observations[first : end - (page - 1) * per_page][::-1]
+        else:
+            results = self.observations[
+                start + (page - 1) * per_page : start + page * per_page
+            ]
+        return {
+            "total_results": end - start,
+            "page": page,
+            "per_page": per_page,
+            "results": results,
+        }
+
+    def get_projects(self, params: dict) -> dict:
+        """Every project name resolves to the single synthetic project"""
+        return {
+            "total_results": 1,
+            "results": [{"id": PROJECT_ID, "title": params.get("q", "")}],
+        }
+
+
+class FakeINaturalistHandler(BaseHTTPRequestHandler):
+    server: FakeINaturalistServer
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+    def send_body(
+        self, endpoint: str, status: int, body: bytes, content_type: str
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(endpoint, status, len(body))
+
+    def send_photo(self) -> None:
+        """Send the photo, or the part of it after the start of a Range header"""
+        photo = self.server.photo
+        start = 0
+        match = re.match(r"^bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= len(photo):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(photo)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                self.server.record("photos", 416, 0)
+                return
+
+        body = photo[start:]
+        self.send_response(206 if match else 200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        if match:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(photo)-1}/{len(photo)}"
+            )
+        self.end_headers()
+        if self.server.truncate_randomly():
+            # The client gets fewer bytes than announced, like a dropped connection
+            body = body[: len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+        self.server.record("photos", 206 if match else 200, len(body))
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/stats":
+            with self.server.lock:
+                body = json.dumps(self.server.stats).encode()
+            self.send_body("stats", 200, body, "application/json")
+            return
+
+        if url.path.startswith("/v1/observations"):
+            endpoint, handler = "observations", self.server.get_observations
+        elif url.path.startswith("/v1/projects/autocomplete"):
+            endpoint, handler = "projects", self.server.get_projects
+        elif url.path.startswith("/photos/"):
+            endpoint, handler = "photos", None
+        else:
+            self.send_body("unknown", 404, b"{}", "application/json")
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        status = self.server.fail_randomly()
+        if status is not None:
+            self.send_body(endpoint, status, b'{"error": "fake"}', "application/json")
+        elif handler is None:
+            self.send_photo()
+        else:
+            body = json.dumps(handler(params)).encode()
+            self.send_body(endpoint, 200, body, "application/json")
+
+
+def start_server(**kwargs) -> FakeINaturalistServer:
+    """Start the fake server on a background thread
+
+    Args:
+        kwargs: keyword arguments for FakeINaturalistServer
+
+    Returns:
+        the running server, call shutdown() to stop it
+    """
+    server = FakeINaturalistServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Fake iNaturalist API listening on {server.url}")
+    return server
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments configuring the fake server"""
+    parser.add_argument("--num_observations", type=int, default=1000)
+    parser.add_argument("--num_classes", type=int, default=10)
+    parser.add_argument("--photos_per_observation", type=int, default=1)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds before every response"
+    )
+    parser.add_argument(
+        "--error_rate", type=float, default=0.0, help="Fraction of 500 responses"
+    )
+    parser.add_argument(
+        "--throttle_rate", type=float, default=0.0, help="Fraction of 429 responses"
+    )
+    parser.add_argument(
+        "--truncate_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the photo transfers cut off halfway through",
+    )
+    parser.add_argument(
+        "--photo_size", type=int, default=50_000, help="Photo size in bytes"
+    )
+
+
+def server_kwargs(args: argparse.Namespace) -> dict:
+    """Get the FakeINaturalistServer keyword arguments from the parsed arguments"""
+    return {
+        "num_observations": args.num_observations,
+        "num_classes": args.num_classes,
+        "photos_per_observation": args.photos_per_observation,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "truncate_rate": args.truncate_rate,
+        "photo_size": args.photo_size,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Local stand-in for the iNaturalist API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(encoding="utf-8", level=logging.INFO)
+
+    server = FakeINaturalistServer((args.host, args.port), **server_kwargs(args))
+    logger.info(f"Fake iNaturalist API listening on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,145 @@
+"""
+Offline throughput harness for the download command
+
+Starts the local iNaturalist stand-in, runs `main.py download` against it in a subprocess and
+reports pages/sec, photos/sec, bytes/sec and the peak memory of the whole command as JSON.
+
+    python -m benchmark.harvest --num_observations 2000 --latency 0.02 --throttle_rate 0.01
+    python -m benchmark.harvest --output current.json --compare baseline.json
+"""
+
+from benchmark.fake_inaturalist import add_server_arguments, server_kwargs, start_server
+from benchmark.run import result, write_results
+from library.resource_usage import get_children_peak_rss_bytes
+
+import argparse
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rate(count: float, stats: dict) -> float:
+    """Get the rate of the input count over the time between the first and last request"""
+    duration = stats["last"] - stats["first"]
+    return count / duration if duration > 0 else 0.0
+
+
+def run_download(api_url: str, rate_limit: int, work_dir: str) -> float:
+    """Run the download command against the input api url
+
+    Returns:
+        the duration of the command in seconds
+    """
+    config_path = os.path.join(work_dir, "config.json")
+    with open(config_path, "w") as file:
+        json.dump(
+            {
+                "username": "",
+                "password": "",
+                "app_id": "",
+                "app_secret": "",
+                "project_name": "benchmark",
+            },
+            file,
+        )
+
+    env = dict(os.environ)
+    env["INATURALIST_API_URL"] = api_url
+    env["INATURALIST_RATE_LIMIT"] = str(rate_limit)
+    command = [
+        sys.executable,
+        os.path.join(REPO_DIR, "main.py"),
+        "-c",
+        config_path,
+        "-r",
+        "harvest",
+        "download",
+        "-d",
+        os.path.join(work_dir, "dataset"),
+    ]
+
+    start = time.perf_counter()
+    subprocess.run(command, cwd=REPO_DIR, env=env, check=True)
+    return time.perf_counter() - start
+
+
+def run_harvest_benchmark(args: argparse.Namespace) -> dict:
+    """Run the download command against a fresh fake server and collect the throughput"""
+    server = start_server(**server_kwargs(args))
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            duration = run_download(server.api_url, args.rate_limit, work_dir)
+            num_photos = len(
+                glob.glob(os.path.join(work_dir, "dataset", "harvest", "*", "*.jpg"))
+            )
+    finally:
+        server.shutdown()
+
+    stats = server.stats
+    pages = stats.get("observations", {"requests": 0, "first": 0, "last": 0})
+    photos = stats.get("photos", {"requests": 0, "bytes": 0, "first": 0, "last": 0})
+    total_bytes = sum(endpoint["bytes"] for endpoint in stats.values())
+    logger.info(
+        f"Download took {duration:.1f}s | {pages['requests']} page requests | {photos['requests']} photo requests | {num_photos} photos saved"
+    )
+
+    return {
+        "metadata": {
+            "time": time.time(),
+            "parameters": vars(args),
+            "server_stats": stats,
+            "photos_saved": num_photos,
+        },
+        "results": {
+            "download_sec": result(duration, "s", False),
+            "harvest_pages_per_sec": result(
+                rate(pages["requests"], pages), "pages/s", True
+            ),
+            "photos_per_sec": result(
+                rate(photos["requests"], photos), "photos/s", True
+            ),
+            "bytes_per_sec": result(total_bytes / duration, "bytes/s", True),
+            "peak_rss_bytes": result(get_children_peak_rss_bytes(), "bytes", False),
+        },
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser("Benchmark the download command offline")
+    parser.add_argument("-o", "--output", help="Path to write the results JSON to")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative regression before --compare fails",
+    )
+    parser.add_argument(
+        "--rate_limit",
+        type=int,
+        default=0,
+        help="Requests per minute the harvester is limited to, 0 disables the limit",
+    )
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(encoding="utf-8", level=logging.INFO)
+
+    compare = args.compare
+    output = args.output
+    tolerance = args.tolerance
+    del args.compare, args.output, args.tolerance
+    results = run_harvest_benchmark(args)
+    return write_results(results, output, compare, tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Import-time budget check for the CLI commands
+
+Runs every entry point in a fresh interpreter with `python -X importtime` and fails if it imports
+a module it must not load (e.g. torch for download) or takes longer than its budget to import.
+
+    python -m benchmark.import_time
+    python -m benchmark.import_time --budget_scale 2.0
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entry point name -> (python code to run, forbidden top level modules, import budget in ms)
+IMPORT_BUDGETS = {
+    "help": (
+        "import sys; sys.argv = ['main.py', '--help']; import runpy; runpy.run_path('main.py', run_name='__main__')",
+        ["torch", "torchvision", "pandas", "sklearn", "requests", "tqdm"],
+        300,
+    ),
+    "download": (
+        "import commands.download",
+        ["torch", "torchvision"],
+        1000,
+    ),
+    # predict runs the model, so it needs torch, but not the training and dataset stack
+    "predict": (
+        "import commands.predict",
+        ["pandas", "sklearn", "requests", "torchvision"],
+        3000,
+    ),
+    # view only lists image paths, building a subset must not load the training stack
+    "view": (
+        "import commands.view",
+        ["torch", "torchvision", "sklearn"],
+        1000,
+    ),
+}
+
+
+def parse_import_times(stderr: str) -> dict[str, int]:
+    """Parse the output of `python -X importtime`
+
+    Args:
+        stderr: stderr of the interpreter
+
+    Returns:
+        dict of the imported module name to its cumulative import time in microseconds
+    """
+    import_times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        import_times[module.strip()] = int(cumulative.strip())
+    return import_times
+
+
+def measure_import_times(code: str) -> dict[str, int]:
+    """Run the input code in a fresh interpreter with import timing enabled
+
+    Args:
+        code: python code to run
+
+    Returns:
+        dict of the imported module name to its cumulative import time in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+    )
+    # --help exits with 0 through SystemExit
+    if result.returncode != 0:
+        raise RuntimeError(f"Running {code} failed: {result.stderr[-2000:]}")
+    return parse_import_times(result.stderr)
+
+
+def check_import_budget(
+    name: str, code: str, forbidden: list[str], budget_ms: float
+) -> list[str]:
+    """Check a single entry point against its budget
+
+    Returns:
+        list of the budget violations, empty if the entry point is within budget
+    """
+    import_times = measure_import_times(code)
+    loaded = {module.split(".")[0] for module in import_times}
+    # Only the top level modules have a cumulative time that does not overlap another entry
+    total_ms = (
+        sum(time for module, time in import_times.items() if "." not in module) / 1000
+    )
+    logger.info(f"{name}: {len(import_times)} modules imported in {total_ms:.0f}ms")
+
+    violations = [
+        f"{name} imports {module}" for module in forbidden if module in loaded
+    ]
+    if total_ms > budget_ms:
+        violations.append(
+            f"{name} takes {total_ms:.0f}ms to import, budget is {budget_ms:.0f}ms"
+        )
+    return violations
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser("Check the import time budget of the CLI commands")
+    parser.add_argument(
+        "--budget_scale",
+        type=float,
+        default=1.0,
+        help="Multiply every time budget, for slow machines",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(encoding="utf-8", level=logging.INFO)
+
+    violations = []
+    for name, (code, forbidden, budget_ms) in IMPORT_BUDGETS.items():
+        violations += check_import_budget(
+            name, code, forbidden, budget_ms * args.budget_scale
+        )
+
+    for violation in violations:
+        logger.error(violation)
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Progressive resizing against the fixed resolution baseline
+
+Trains the same model twice with the same seed, split and number of epochs, once at a fixed
+128x128 and once with a progressive resizing schedule, and reports the training time and the
+final validation accuracy of both as JSON.
+
+    python -m benchmark.progressive --num_epochs 10
+    python -m benchmark.progressive --dataset_dir /path/to/classify --phases 64:4 96:3
+"""
+
+from benchmark.run import result, write_results
+from benchmark.synthetic import create_image_tree
+
+import argparse
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def train(
+    dataset_dir: str, output_dir: str, args: argparse.Namespace, schedule
+) -> dict:
+    """Train one model and get its training time and its final validation accuracy"""
+    from library.run_report import get_run_report
+    from model.trainer import ModelTrainer
+
+    name = "fixed" if schedule is None else "progressive"
+    report = get_run_report()
+    report.reset(run_id=name, command="benchmark")
+    trainer = ModelTrainer(
+        os.path.join(output_dir, f"model_{name}.pt"),
+        dataset_dir,
+        os.path.join(output_dir, f"prediction_{name}.json"),
+        num_epochs=args.num_epochs,
+        patience=args.patience,
+        batch_size=args.batch_size,
+        micro_batch_size=args.micro_batch_size,
+        resolution_schedule=schedule,
+    )
+    training_time = report.to_dict()["spans"]["training"]["seconds"]
+    logger.info(
+        f"{name}: training took {training_time:.2f}s | Val accuracy: {trainer.val_accuracy:.4f}"
+    )
+    return {"training_sec": training_time, "val_accuracy": trainer.val_accuracy}
+
+
+def run_progressive_benchmark(args: argparse.Namespace) -> dict:
+    """Train the fixed resolution baseline and the progressive resizing schedule"""
+    import torch
+    from model.resolution_schedule import ResolutionSchedule
+
+    schedule = ResolutionSchedule.parse(args.phases, args.num_epochs)
+    with tempfile.TemporaryDirectory() as work_dir:
+        dataset_dir = args.dataset_dir
+        if dataset_dir is None:
+            dataset_dir = os.path.join(work_dir, "dataset")
+            logger.info("Creating the synthetic image tree")
+            create_image_tree(dataset_dir, args.num_classes, args.images_per_class)
+
+        fixed = train(dataset_dir, work_dir, args, None)
+        progressive = train(dataset_dir, work_dir, args, schedule)
+
+    return {
+        "metadata": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "parameters": vars(args),
+            "schedule": schedule.to_dict(),
+        },
+        "results": {
+            "fixed_training_sec": result(fixed["training_sec"], "s", False),
+            "progressive_training_sec": result(progressive["training_sec"], "s", False),
+            "progressive_speedup": result(
+                fixed["training_sec"] / progressive["training_sec"], "x", True
+            ),
+            "fixed_val_accuracy": result(fixed["val_accuracy"], "accuracy", True),
+            "progressive_val_accuracy": result(
+                progressive["val_accuracy"], "accuracy", True
+            ),
+        },
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        "Benchmark progressive resizing against the fixed resolution baseline"
+    )
+    parser.add_argument("-o", "--output", help="Path to write the results JSON to")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative regression before --compare fails",
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        default=None,
+        help="Dataset to train on, a synthetic image tree by default",
+    )
+    parser.add_argument(
+        "--phases",
+        nargs="*",
+        metavar="SIZE:EPOCHS",
+        default=[],
+        help="Low resolution phases, the default schedule of the train command by default",
+    )
+    parser.add_argument("--num_classes", type=int, default=5)
+    parser.add_argument("--images_per_class", type=int, default=100)
+    parser.add_argument("--num_epochs", type=int, default=10)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument(
+        "--micro_batch_size",
+        type=int,
+        default=None,
+        help="Micro-batch size of both runs, low resolution epochs run fewer, larger ones",
+    )
+    parser.add_argument(
+        "--patience",
+        type=int,
+        default=5,
+        help="Early stopping patience of both runs, like the train command",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(encoding="utf-8", level=logging.INFO)
+
+    compare = args.compare
+    output = args.output
+    tolerance = args.tolerance
+    del args.compare, args.output, args.tolerance
+    results = run_progressive_benchmark(args)
+    return write_results(results, output, compare, tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
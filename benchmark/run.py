@@ -0,0 +1,273 @@
+"""
+Benchmark suite for the dataset, training and inference hot paths
+
+Runs offline on synthetic JPEG trees and synthetic observation JSON and writes the results as JSON.
+With --compare, the results are checked against a stored baseline and the run fails if a metric
+regressed by more than the tolerance.
+
+    python -m benchmark.run --output baseline.json
+    python -m benchmark.run --output current.json --compare baseline.json --tolerance 0.15
+"""
+
+from benchmark.synthetic import create_image_tree, create_observations
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def result(value: float, unit: str, higher_is_better: bool) -> dict:
+    """Create a single benchmark result"""
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def benchmark_dataset_loader(num_observations: int, num_classes: int) -> dict:
+    """Benchmark DatasetLoader.transform_json_to_dataset and save_json_dataset"""
+    from library.dataset_Loader import DatasetLoader
+
+    observations = create_observations(num_observations, num_classes)
+    dataset_loader = DatasetLoader()
+
+    start = time.perf_counter()
+    for observation in observations:
+        dataset_loader.transform_json_to_dataset(observation)
+    transform_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        dataset_loader.save_json_dataset(
+            os.path.join(output_dir, "dataset.csv"), {"dataset": observations}
+        )
+        save_time = time.perf_counter() - start
+
+    return {
+        "transform_json_to_dataset_rows_per_sec": result(
+            num_observations / transform_time, "rows/s", True
+        ),
+        "save_json_dataset_rows_per_sec": result(
+            num_observations / save_time, "rows/s", True
+        ),
+    }
+
+
+def benchmark_species_dataset(dataset_dir: str, num_samples: int) -> dict:
+    """Benchmark the SpeciesDataset directory scan and the decoding of the samples"""
+    from library.species_dataset import SpeciesDataset
+    from torchvision import transforms
+
+    transform = transforms.Compose(
+        [transforms.Resize((128, 128)), transforms.ToTensor()]
+    )
+
+    start = time.perf_counter()
+    dataset = SpeciesDataset(dataset_dir, transform=transform)
+    startup_time = time.perf_counter() - start
+
+    num_samples = min(num_samples, len(dataset))
+    start = time.perf_counter()
+    for index in range(num_samples):
+        dataset[index]
+    sample_time = time.perf_counter() - start
+
+    return {
+        "species_dataset_startup_sec": result(startup_time, "s", False),
+        "species_dataset_samples_per_sec": result(
+            num_samples / sample_time, "samples/s", True
+        ),
+    }
+
+
+def benchmark_training(dataset_dir: str, output_dir: str, num_epochs: int) -> dict:
+    """Benchmark the training step time through the training metrics of ModelTrainer,
+    then the evaluation and the plain inference throughput of the trained model"""
+    import torch
+    from torch.utils.data import DataLoader
+    from model.trainer import ModelTrainer
+
+    metrics_path = os.path.join(output_dir, "metrics.jsonl")
+    trainer = ModelTrainer(
+        os.path.join(output_dir, "model.pt"),
+        dataset_dir,
+        os.path.join(output_dir, "prediction.json"),
+        num_epochs=num_epochs,
+        patience=None,
+        metrics_path=metrics_path,
+    )
+
+    with open(metrics_path, "r") as file:
+        records = [json.loads(line) for line in file]
+    steps = [record for record in records if record["type"] == "step"]
+    # The first step pays for the allocator and thread pool warm-up
+    measured = steps[1:] if len(steps) > 1 else steps
+    step_time = sum(step["step_time"] for step in measured) / len(measured)
+    step_images = sum(step["batch_size"] for step in measured)
+    data_wait = sum(step["data_wait"] for step in measured) / len(measured)
+
+    dataset = trainer.val_loader.dataset
+    loader = DataLoader(dataset, batch_size=128, shuffle=False)
+    start = time.perf_counter()
+    trainer.evaluate_model(trainer.model, loader, trainer.criterion)
+    evaluate_time = time.perf_counter() - start
+
+    # Prediction only runs the forward pass on already decoded images
+    images = torch.stack([dataset[index][0] for index in range(len(dataset))])
+    trainer.model.eval()
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in images.split(128):
+            trainer.model(batch.to(trainer.device)).argmax(dim=1)
+    predict_time = time.perf_counter() - start
+
+    return {
+        "train_step_sec": result(step_time, "s", False),
+        "train_step_data_wait_sec": result(data_wait, "s", False),
+        "train_images_per_sec": result(
+            step_images / sum(step["step_time"] for step in measured), "images/s", True
+        ),
+        "evaluate_images_per_sec": result(
+            len(dataset) / evaluate_time, "images/s", True
+        ),
+        "predict_images_per_sec": result(len(dataset) / predict_time, "images/s", True),
+    }
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    """Run all the benchmarks on freshly generated synthetic data"""
+    import torch
+
+    results = {}
+    logger.info("Benchmarking the dataset loader")
+    results.update(benchmark_dataset_loader(args.num_observations, args.num_classes))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        dataset_dir = os.path.join(work_dir, "dataset")
+        output_dir = os.path.join(work_dir, "output")
+        os.makedirs(output_dir)
+        logger.info("Creating the synthetic image tree")
+        create_image_tree(dataset_dir, args.num_classes, args.images_per_class)
+
+        logger.info("Benchmarking the species dataset")
+        results.update(benchmark_species_dataset(dataset_dir, args.num_samples))
+
+        logger.info("Benchmarking training and inference")
+        results.update(benchmark_training(dataset_dir, output_dir, args.num_epochs))
+
+    return {
+        "metadata": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "parameters": vars(args),
+        },
+        "results": results,
+    }
+
+
+def compare_results(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Compare the current results against the baseline
+
+    Args:
+        current: results of this run
+        baseline: stored results to compare against
+        tolerance: allowed relative slowdown, 0.1 allows metrics to be 10% worse
+
+    Returns:
+        list of the regressions, empty if there are none
+    """
+    regressions = []
+    for name, base in baseline["results"].items():
+        if name not in current["results"]:
+            logger.warning(f"{name} is in the baseline but was not measured")
+            continue
+        value = current["results"][name]["value"]
+        change = (value - base["value"]) / base["value"] if base["value"] else 0.0
+        if not base["higher_is_better"]:
+            change = -change
+        status = "REGRESSION" if change < -tolerance else "ok"
+        logger.info(
+            f"{name}: {base['value']:.4g} -> {value:.4g} {base['unit']} ({change:+.1%}) {status}"
+        )
+        if change < -tolerance:
+            regressions.append(f"{name} regressed by {-change:.1%}")
+    return regressions
+
+
+def write_results(
+    results: dict, output: str = None, compare: str = None, tolerance: float = 0.1
+) -> int:
+    """Write the results to the output path (stdout if None) and compare them to the baseline
+
+    Args:
+        results: benchmark results
+        output: path to write the results JSON to
+        compare: path of the baseline results JSON
+        tolerance: allowed relative regression
+
+    Returns:
+        exit code, 1 if a metric regressed
+    """
+    results_json = json.dumps(results, indent=4)
+    if output:
+        with open(output, "w") as file:
+            file.write(results_json)
+        logger.info(f"Results saved to: {output}")
+    else:
+        print(results_json)
+
+    if not compare:
+        return 0
+
+    with open(compare, "r") as file:
+        baseline = json.load(file)
+    regressions = compare_results(results, baseline, tolerance)
+    for regression in regressions:
+        logger.error(regression)
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser("Benchmark the dataset, training and inference")
+    parser.add_argument("-o", "--output", help="Path to write the results JSON to")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative regression before --compare fails",
+    )
+    parser.add_argument("--num_classes", type=int, default=5)
+    parser.add_argument("--images_per_class", type=int, default=100)
+    parser.add_argument("--num_observations", type=int, default=2000)
+    parser.add_argument("--num_samples", type=int, default=200)
+    parser.add_argument("--num_epochs", type=int, default=2)
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        encoding="utf-8", level=logging.DEBUG if args.verbose else logging.INFO
+    )
+
+    compare = args.compare
+    output = args.output
+    tolerance = args.tolerance
+    del args.compare, args.output, args.tolerance, args.verbose
+    results = run_benchmarks(args)
+    return write_results(results, output, compare, tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Data-parallel scaling efficiency of training
+
+Trains the same model on the synthetic image tree with 1, 2, 4 and 8 gloo ranks on this machine
+and reports the global images/sec of every world size and its scaling efficiency, the speedup
+over one rank divided by the number of ranks, as JSON. The first epoch of every run is a warm up
+and is not measured.
+
+    python -m benchmark.scaling --world_sizes 1 2 4 8
+    python -m benchmark.scaling --dataset_dir /path/to/classify --num_epochs 3
+"""
+
+from benchmark.run import result, write_results
+from benchmark.synthetic import create_image_tree
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def train(
+    dataset_dir: str, output_dir: str, args: argparse.Namespace, world_size: int
+) -> float:
+    """Train one model with world_size ranks and get its global images/sec"""
+    from model.distributed import launch
+    from model.trainer import ModelTrainer
+
+    metrics_path = os.path.join(output_dir, f"metrics_{world_size}.jsonl")
+    launch(
+        ModelTrainer,
+        {
+            "model_path": os.path.join(output_dir, f"model_{world_size}.pt"),
+            "dataset_dir": dataset_dir,
+            "output_path": os.path.join(output_dir, f"prediction_{world_size}.json"),
+            "num_epochs": args.num_epochs,
+            "patience": None,
+            "batch_size": args.batch_size,
+            "metrics_path": metrics_path,
+        },
+        nproc_per_node=world_size,
+        # A new port per run, the previous one can still be in TIME_WAIT
+        master_port=args.master_port + world_size,
+    )
+
+    # Only rank 0 writes the metrics, the ranks train on shards of the same size
+    with open(metrics_path, "r") as file:
+        records = [json.loads(line) for line in file]
+    epochs = [record for record in records if record["type"] == "epoch"]
+    measured = epochs[1:] or epochs
+    num_images = sum(epoch["num_samples"] for epoch in measured) * world_size
+    seconds = sum(epoch["epoch_time"] for epoch in measured)
+    images_per_sec = num_images / seconds
+    logger.info(f"{world_size} ranks: {images_per_sec:.1f} images/sec")
+    return images_per_sec
+
+
+def run_scaling_benchmark(args: argparse.Namespace) -> dict:
+    """Train with every world size and compare the throughput to a single rank"""
+    import torch
+
+    if 1 not in args.world_sizes:
+        raise ValueError(
+            "The world sizes must include 1, the baseline of the efficiency"
+        )
+    with tempfile.TemporaryDirectory() as work_dir:
+        dataset_dir = args.dataset_dir
+        if dataset_dir is None:
+            dataset_dir = os.path.join(work_dir, "dataset")
+            logger.info("Creating the synthetic image tree")
+            create_image_tree(dataset_dir, args.num_classes, args.images_per_class)
+
+        throughput = {
+            world_size: train(dataset_dir, work_dir, args, world_size)
+            for world_size in sorted(set(args.world_sizes))
+        }
+
+    results = {}
+    for world_size, images_per_sec in throughput.items():
+        results[f"ranks_{world_size}_images_per_sec"] = result(
+            images_per_sec, "images/s", True
+        )
+        results[f"ranks_{world_size}_efficiency"] = result(
+            images_per_sec / (world_size * throughput[1]), "ratio", True
+        )
+    return {
+        "metadata": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "parameters": vars(args),
+        },
+        "results": results,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        "Benchmark the data-parallel scaling efficiency of training"
+    )
+    parser.add_argument("-o", "--output", help="Path to write the results JSON to")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative regression before --compare fails",
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        default=None,
+        help="Dataset to train on, a synthetic image tree by default",
+    )
+    parser.add_argument(
+        "--world_sizes",
+        nargs="+",
+        type=int,
+        default=[1, 2, 4, 8],
+        help="Numbers of ranks to train with on this machine",
+    )
+    parser.add_argument("--num_classes", type=int, default=5)
+    parser.add_argument("--images_per_class", type=int, default=100)
+    parser.add_argument("--num_epochs", type=int, default=3)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--master_port", type=int, default=29600)
+    args = parser.parse_args()
+    logging.basicConfig(encoding="utf-8", level=logging.INFO)
+
+    compare = args.compare
+    output = args.output
+    tolerance = args.tolerance
+    del args.compare, args.output, args.tolerance
+    results = run_scaling_benchmark(args)
+    return write_results(results, output, compare, tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Synthetic inputs for the benchmarks: JPEG dataset trees and iNaturalist observation JSON
+"""
+
+from common.constants import DATASET_NAME, TAXON_NAME, TAXON_RANK, PHOTOS
+
+import os
+import random
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+
+def species_names(num_classes: int) -> list[str]:
+    """Get num_classes distinct synthetic species names"""
+    return [f"genus{index} species{index}" for index in range(num_classes)]
+
+
+def create_image_tree(
+    dataset_dir: str,
+    num_classes: int,
+    images_per_class: int,
+    image_size: tuple[int, int] = (500, 375),
+    seed: int = 42,
+) -> str:
+    """Create a dataset directory laid out like the download command does: one directory
+    of JPEG photos per species plus the dataset csv
+
+    Args:
+        dataset_dir: directory to create the dataset in
+        num_classes: number of species
+        images_per_class: number of photos per species
+        image_size: width and height of the photos, the iNaturalist medium size by default
+        seed: seed for the image contents
+
+    Returns:
+        path of the dataset csv
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for class_index, name in enumerate(species_names(num_classes)):
+        species_dir = os.path.join(dataset_dir, name)
+        os.makedirs(species_dir, exist_ok=True)
+        for image_index in range(images_per_class):
+            observation_id = class_index * images_per_class + image_index
+            # Noise on top of a per-class colour so the photos do not compress to nothing
+            pixels = rng.integers(0, 64, (image_size[1], image_size[0], 3))
+            pixels = (pixels + class_index * 37 % 192).astype(np.uint8)
+            Image.fromarray(pixels).save(
+                os.path.join(species_dir, f"{observation_id}_0.jpg"), quality=85
+            )
+            rows.append(
+                {
+                    "id": observation_id,
+                    TAXON_NAME: name,
+                    TAXON_RANK: "species",
+                    PHOTOS: "[]",
+                }
+            )
+
+    dataset_path = os.path.join(dataset_dir, f"{DATASET_NAME}_benchmark.csv")
+    pd.DataFrame(rows).to_csv(dataset_path, index=False)
+    return dataset_path
+
+
+def create_observations(
+    num_observations: int,
+    num_classes: int,
+    photos_per_observation: int = 2,
+    id_start: int = 1,
+    photo_url: str = "https://static.inaturalist.org/photos",
+    seed: int = 42,
+) -> list[dict]:
+    """Create observations shaped like the results of the /v1/observations endpoint
+
+    Args:
+        num_observations: number of observations to create
+        num_classes: number of species the observations are spread over
+        photos_per_observation: number of photos of every observation
+        id_start: id of the first observation, ids are consecutive
+        photo_url: base url of the photos
+        seed: seed for the observation contents
+
+    Returns:
+        list of observation dicts
+    """
+    rng = random.Random(seed)
+    names = species_names(num_classes)
+    observations = []
+    for index in range(num_observations):
+        observation_id = id_start + index
+        taxon_index = rng.randrange(num_classes)
+        name = names[taxon_index]
+        # Some guesses are misspelled or missing, like the real data
+        guess = rng.choice([name, name, name.replace("s", "z", 1), name.title(), None])
+        observations.append(
+            {
+                "id": observation_id,
+                "species_guess": guess,
+                "time_observed_at": f"2024-{1 + index % 12:02d}-{1 + index % 28:02d}T12:00:00+00:00",
+                "identifications_most_agree": rng.random() > 0.2,
+                "quality_grade": rng.choice(["research", "needs_id", "casual"]),
+                "user": {
+                    "id": rng.randrange(100),
+                    "login": f"user{rng.randrange(100)}",
+                },
+                "uri": f"https://www.inaturalist.org/observations/{observation_id}",
+                "photos": [
+                    {
+                        "id": observation_id * 10 + photo,
+                        "url": f"{photo_url}/{observation_id * 10 + photo}/square.jpg",
+                    }
+                    for photo in range(photos_per_observation)
+                ],
+                "taxon": {
+                    "id": 1000 + taxon_index,
+                    "rank": rng.choice(["species"] * 9 + ["genus"]),
+                    "rank_level": 10,
+                    "name": name,
+                },
+            }
+        )
+    return observations
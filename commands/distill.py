@@ -0,0 +1,41 @@
+"""
+distill command: trains a compact student model for CPU serving against a trained teacher model
+"""
+
+import argparse
+import logging
+import os
+
+from common.constants import FEATURE_CACHE_NAME, STUDENT_NAME, DISTILLATION_NAME
+from common.config import ConfigHelper
+from model.distiller import Distiller
+
+logger = logging.getLogger(__name__)
+
+
+def run(args: argparse.Namespace, config: ConfigHelper, run_id: str) -> None:
+    """Distill the teacher checkpoint into a student on the dataset in the predict path
+
+    Args:
+        args: parsed command line arguments
+        config: loaded configuration
+        run_id: unique ID for the run
+    """
+    student_path = os.path.join(args.predict_path, f"{STUDENT_NAME}_{run_id}.pt")
+    output_path = os.path.join(args.predict_path, f"{DISTILLATION_NAME}_{run_id}.json")
+    distiller = Distiller(
+        args.teacher_path,
+        args.predict_path,
+        student_path,
+        output_path,
+        # The teacher logits share the directory of the feature cache
+        os.path.join(args.predict_path, FEATURE_CACHE_NAME),
+        num_epochs=args.num_epochs,
+        temperature=args.temperature,
+        alpha=args.alpha,
+        width=args.width,
+        patience=args.patience,
+        min_delta=args.min_delta,
+    )
+    distiller.distill()
+    logger.info(f"Student saved to: {student_path}")
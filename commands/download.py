@@ -0,0 +1,81 @@
+"""
+download command: harvests the observations of the configured projects and downloads their photos
+"""
+
+import argparse
+import logging
+import os
+
+from common.constants import (
+    DATASET_NAME,
+    SPECIES_GUESS_MAPPING_NAME,
+    PROJECT_IDS_NAME,
+    OBSERVATION_STORE_NAME,
+    RATE_LIMIT,
+)
+from common.config import ConfigHelper
+from library.base_io import BaseIO
+from library.observation_store import ObservationStore
+from library.rate_limiter import RateLimiter
+from controller.project_controller import ProjectController
+from controller.observation_controller import ObservationController
+
+logger = logging.getLogger(__name__)
+
+
+def run(args: argparse.Namespace, config: ConfigHelper, run_id: str) -> None:
+    """Download and create one dataset for all the projects in the config
+
+    Args:
+        args: parsed command line arguments
+        config: loaded configuration
+        run_id: unique ID for the run
+    """
+    # Every API request of the run, whatever the project, shares one request budget
+    rate_limiter = RateLimiter(RATE_LIMIT)
+
+    # Get the project IDs from the config names, names resolved by earlier runs are cached
+    projectController = ProjectController(
+        cache_path=os.path.join(args.dataset_path, PROJECT_IDS_NAME),
+        rate_limiter=rate_limiter,
+    )
+    project_ids = projectController.get_project_ids_by_names(config.project_names)
+    if not project_ids:
+        raise ValueError(f"None of the projects were found: {config.project_names}")
+
+    logger.debug(f"Found the following project ids {project_ids}")
+
+    run_dir = os.path.join(args.dataset_path, run_id)
+    if not BaseIO.path_exists(run_dir):
+        BaseIO.create_directory(run_dir)
+
+    file_name = f"{DATASET_NAME}_{run_id}.csv"
+    dataset_path = os.path.join(run_dir, file_name)
+    # The species guess mapping is shared by all the runs in the dataset path
+    mapping_path = os.path.join(args.dataset_path, SPECIES_GUESS_MAPPING_NAME)
+    # The observation store is shared by all the runs in the dataset path as well
+    store_path = os.path.join(args.dataset_path, OBSERVATION_STORE_NAME)
+    observationController = ObservationController(rate_limiter=rate_limiter)
+
+    # Download the dataset if it does not exist
+    if not BaseIO.is_path_file(dataset_path):
+        logger.info(f"Downloading dataset to: {dataset_path}")
+        observationController.save_observations_as_dataset(
+            # Several names can resolve to the same project
+            list(dict.fromkeys(project_ids.values())),
+            dataset_path,
+            run_id=str(args.run_id) if args.run_id else None,
+            mapping_path=mapping_path,
+            max_workers=args.max_projects,
+            store_path=store_path,
+        )
+    else:
+        logger.info(f"Dataset already exists at: {dataset_path} for run: {run_id}")
+
+    # Create the dataset
+    logger.debug(f"Creating dataset from: {dataset_path}")
+    observationController.download_dataset(dataset_path, run_dir)
+    store = ObservationStore(store_path)
+    store.add_photo_paths(run_dir)
+    store.close()
+    logger.info(f"Created the dataset at: {dataset_path}")
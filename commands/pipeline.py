@@ -0,0 +1,100 @@
+"""
+pipeline command: downloads the photos of the configured project and trains a model on them
+while they stream in, instead of running download and then train
+"""
+
+import argparse
+import logging
+import os
+
+from common.constants import (
+    DATASET_NAME,
+    MODEL_NAME,
+    OUTPUT_NAME,
+    SPECIES_GUESS_MAPPING_NAME,
+    PROJECT_IDS_NAME,
+    OBSERVATION_STORE_NAME,
+)
+from common.config import ConfigHelper
+from controller.project_controller import ProjectController
+from library.base_io import BaseIO
+from library.dataset_Loader import DatasetLoader
+from library.observation_store import ObservationStore
+from library.photo_pipeline import PhotoPipeline
+from library.streaming_dataset import StreamingDataset
+from model.streaming_trainer import StreamingTrainer
+from torchvision import transforms
+
+logger = logging.getLogger(__name__)
+
+
+def run(args: argparse.Namespace, config: ConfigHelper, run_id: str) -> None:
+    """Stream the photos of the project in the config into a training run
+
+    Args:
+        args: parsed command line arguments
+        config: loaded configuration
+        run_id: unique ID for the run
+    """
+    project_ids = ProjectController(
+        cache_path=os.path.join(args.dataset_path, PROJECT_IDS_NAME)
+    ).get_project_ids_by_names(config.project_names)
+    if not project_ids:
+        raise ValueError(f"None of the projects were found: {config.project_names}")
+    logger.debug(f"Found the following project ids {project_ids}")
+
+    run_dir = os.path.join(args.dataset_path, run_id)
+    BaseIO.create_directory(run_dir)
+    dataset_path = os.path.join(run_dir, f"{DATASET_NAME}_{run_id}.csv")
+    output_model = os.path.join(run_dir, f"{MODEL_NAME}_{run_id}.pt")
+    output_file = os.path.join(run_dir, f"{OUTPUT_NAME}_{run_id}.json")
+
+    # Same preprocessing as ModelTrainer, the images stay uint8 until they reach the model
+    transform = transforms.Compose(
+        [transforms.Resize((128, 128)), transforms.PILToTensor()]
+    )
+    # The decoded images are spilled next to the photos instead of being held in memory
+    dataset = StreamingDataset(storage_dir=run_dir)
+    pipeline = PhotoPipeline(
+        # Several names can resolve to the same project
+        list(dict.fromkeys(project_ids.values())),
+        run_dir,
+        dataset,
+        transform,
+        download_workers=args.download_workers,
+        preprocess_workers=args.preprocess_workers,
+        queue_size=args.queue_size,
+    )
+    trainer = StreamingTrainer(
+        output_model,
+        output_file,
+        dataset,
+        num_epochs=args.num_epochs,
+        min_samples=args.min_samples,
+        patience=args.patience,
+        min_delta=args.min_delta,
+    )
+
+    pipeline.start()
+    try:
+        trainer.train()
+    finally:
+        pipeline.stop()
+    try:
+        observations = pipeline.join()
+    finally:
+        dataset.close()
+    logger.info(f"Model saved to: {output_model}")
+
+    # The run directory is left as a regular dataset, so it can be trained on again
+    store_path = os.path.join(args.dataset_path, OBSERVATION_STORE_NAME)
+    DatasetLoader().save_json_dataset(
+        dataset_path,
+        {"dataset": observations},
+        mapping_path=os.path.join(args.dataset_path, SPECIES_GUESS_MAPPING_NAME),
+        store_path=store_path,
+        run_id=run_id,
+    )
+    store = ObservationStore(store_path)
+    store.add_photo_paths(run_dir)
+    store.close()
@@ -0,0 +1,64 @@
+"""
+predict command: classifies the images of a dataset
+"""
+
+import argparse
+import json
+import logging
+import os
+
+from common.constants import PREDICTIONS_NAME, PREDICTION_CACHE_NAME
+from common.config import ConfigHelper
+from library.prediction_cache import PredictionCache
+from library.run_report import count
+from model.predictor import Predictor, find_images
+
+logger = logging.getLogger(__name__)
+
+
+def run(args: argparse.Namespace, config: ConfigHelper, run_id: str) -> None:
+    """Predict the dataset in the predict path
+
+    Args:
+        args: parsed command line arguments
+        config: loaded configuration
+        run_id: unique ID for the run
+    """
+    logger.info(f"Predicting dataset: {args.predict_path}")
+    image_paths = find_images(args.predict_path)
+    if not image_paths:
+        raise ValueError(f"No images found in: {args.predict_path}")
+
+    cache = None
+    if args.cache:
+        cache = PredictionCache(
+            args.cache_path or os.path.join(args.predict_path, PREDICTION_CACHE_NAME),
+            max_entries=args.cache_size,
+        )
+    predictor = Predictor(args.model_path, batch_size=args.batch_size, cache=cache)
+    predictions = predictor.predict(image_paths, top_k=args.top_k)
+
+    cache_stats = None
+    if cache is not None:
+        cache_stats = cache.stats()
+        cache.close()
+        count("prediction_cache_hits", cache_stats["hits"])
+        count("prediction_cache_misses", cache_stats["misses"])
+        logger.info(
+            f"Prediction cache hit rate: {cache_stats['hit_rate']:.2%} | {cache_stats['hits']} hits | {cache_stats['misses']} misses"
+        )
+
+    output_path = os.path.join(args.predict_path, f"{PREDICTIONS_NAME}_{run_id}.json")
+    with open(output_path, "w") as file:
+        json.dump(
+            {
+                "model_path": args.model_path,
+                "model_hash": predictor.model_hash,
+                "num_images": len(predictions),
+                "cache": cache_stats,
+                "predictions": predictions,
+            },
+            file,
+            indent=4,
+        )
+    logger.info(f"Predicted {len(predictions)} images to: {output_path}")
@@ -0,0 +1,49 @@
+"""
+sweep command: trains many hyperparameter configurations of a dataset in parallel
+"""
+
+import argparse
+import logging
+import os
+
+from common.constants import DECODED_CACHE_NAME, SWEEP_NAME
+from common.config import ConfigHelper
+from library.base_io import BaseIO
+from model.sweep import load_search_space, grid_trials, random_trials, run_sweep
+
+logger = logging.getLogger(__name__)
+
+
+def run(args: argparse.Namespace, config: ConfigHelper, run_id: str) -> None:
+    """Run a hyperparameter sweep on the dataset in the predict path
+
+    Args:
+        args: parsed command line arguments
+        config: loaded configuration
+        run_id: unique ID for the run
+    """
+    search_space = load_search_space(args.search_space)
+    if args.strategy == "grid":
+        trials = grid_trials(search_space)
+    else:
+        trials = random_trials(search_space, args.num_trials, seed=args.seed)
+
+    sweep_dir = os.path.join(args.predict_path, f"{SWEEP_NAME}_{run_id}")
+    BaseIO.create_directory(sweep_dir)
+    results = run_sweep(
+        args.predict_path,
+        sweep_dir,
+        os.path.join(args.predict_path, DECODED_CACHE_NAME),
+        trials,
+        max_workers=args.max_workers,
+        threads_per_trial=args.threads_per_trial,
+        prune=args.prune,
+        min_trials=args.min_trials,
+        warmup_epochs=args.warmup_epochs,
+    )
+
+    # Kept out of the dataset directory, where a CSV would be read as the dataset file
+    results_path = os.path.join(sweep_dir, f"{SWEEP_NAME}_{run_id}.csv")
+    results.to_csv(results_path, index=False)
+    logger.info(f"Sweep results:\n{results.to_string(index=False)}")
+    logger.info(f"Sweep results saved to: {results_path}")
@@ -0,0 +1,85 @@
+"""
+train command: trains a model on a downloaded dataset
+"""
+
+import argparse
+import logging
+import os
+
+from common.constants import (
+    OUTPUT_NAME,
+    MODEL_NAME,
+    METRICS_NAME,
+    TRACE_NAME,
+    FEATURE_CACHE_NAME,
+)
+from common.config import ConfigHelper
+from library.observation_store import ObservationStore
+from model.trainer import ModelTrainer
+from model.resolution_schedule import ResolutionSchedule
+from model.distributed import launch
+
+logger = logging.getLogger(__name__)
+
+
+def run(args: argparse.Namespace, config: ConfigHelper, run_id: str) -> None:
+    """Train a model on the dataset in the predict path
+
+    Args:
+        args: parsed command line arguments
+        config: loaded configuration
+        run_id: unique ID for the run
+    """
+    logger.info(f"Training model on dataset: {args.predict_path}")
+
+    output_file = os.path.join(args.predict_path, f"{OUTPUT_NAME}_{run_id}.json")
+    output_model = os.path.join(args.predict_path, f"{MODEL_NAME}_{run_id}.pt")
+    metrics_file = os.path.join(args.predict_path, f"{METRICS_NAME}_{run_id}.jsonl")
+    trace_file = os.path.join(args.predict_path, f"{TRACE_NAME}_{run_id}.json")
+    logger.debug(f"Output file: {output_file} | Output model: {output_model}")
+
+    trainer_kwargs = {
+        "model_path": output_model,
+        "dataset_dir": args.predict_path,
+        "output_path": output_file,
+        "num_epochs": args.num_epochs,
+        "patience": args.patience,
+        "min_delta": args.min_delta,
+        "val_subsample": args.val_subsample,
+        "metrics_path": metrics_file if args.metrics else None,
+        "profile_steps": args.profile_steps,
+        "trace_path": trace_file,
+        "head_only": args.head_only,
+        "backbone_path": args.backbone_path,
+        "feature_cache_dir": os.path.join(args.predict_path, FEATURE_CACHE_NAME),
+        "incremental": args.incremental,
+        "base_model_path": args.base_model,
+        "replay_fraction": args.replay_fraction,
+        "batch_size": args.batch_size,
+        "micro_batch_size": args.micro_batch_size,
+        "auto_batch_size": args.auto_batch_size,
+        "memory_budget_mb": args.memory_budget_mb,
+    }
+    if args.store_path:
+        # Slice the photos of every harvested run from the store instead of scanning a run directory
+        store = ObservationStore(args.store_path)
+        photos = store.select_photos(
+            args.store_query, min_class_photos=args.min_class_photos
+        )
+        store.close()
+        trainer_kwargs["samples"] = list(zip(photos["path"], photos["taxon_name"]))
+    if args.view_path:
+        trainer_kwargs["view_path"] = args.view_path
+    if args.progressive_resizing is not None:
+        trainer_kwargs["resolution_schedule"] = ResolutionSchedule.parse(
+            args.progressive_resizing, args.num_epochs
+        )
+    launch(
+        ModelTrainer,
+        trainer_kwargs,
+        nproc_per_node=args.nproc_per_node,
+        nnodes=args.nnodes,
+        node_rank=args.node_rank,
+        master_addr=args.master_addr,
+        master_port=args.master_port,
+    )
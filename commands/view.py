@@ -0,0 +1,48 @@
+"""
+view command: builds a manifest of a class-filtered and balanced subset of a dataset, which the
+train command can use without copying any image
+"""
+
+import argparse
+import logging
+import os
+
+from common.constants import VIEW_NAME
+from common.config import ConfigHelper
+from library.dataset_view import DatasetView, read_dataset_labels, scan_dataset_dir
+from library.observation_store import ObservationStore
+
+logger = logging.getLogger(__name__)
+
+
+def run(args: argparse.Namespace, config: ConfigHelper, run_id: str) -> None:
+    """Build a view of the dataset in the predict path, or of the observation store
+
+    Args:
+        args: parsed command line arguments
+        config: loaded configuration
+        run_id: unique ID for the run
+    """
+    if args.store_path:
+        store = ObservationStore(args.store_path)
+        photos = store.select_photos(args.store_query)
+        store.close()
+        samples = list(zip(photos["path"], photos["taxon_name"]))
+    else:
+        # Only lists the images, nothing is decoded and torch is never imported
+        samples = scan_dataset_dir(
+            args.predict_path, set(read_dataset_labels(args.predict_path))
+        )
+
+    view = DatasetView.build(
+        args.predict_path,
+        samples,
+        classes=args.classes,
+        top_classes=args.top_classes,
+        min_per_class=args.min_per_class,
+        max_per_class=args.max_per_class,
+        val_fraction=args.val_fraction,
+        seed=args.seed,
+    )
+    view_path = os.path.join(args.predict_path, f"{VIEW_NAME}_{run_id}.json")
+    view.save(view_path)
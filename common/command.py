@@ -9,6 +9,10 @@ class Command(Enum):
     DOWNLOAD = "download"
     TRAIN = "train"
     PREDICT = "predict"
+    PIPELINE = "pipeline"
+    SWEEP = "sweep"
+    VIEW = "view"
+    DISTILL = "distill"
 
 
 def validate_command(command: str) -> bool:
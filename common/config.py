@@ -30,6 +30,8 @@ class ConfigHelper:
         for key in required_keys:
             if key not in config_contents:
                 raise ValueError(f"Config file is missing required key: {key}")
+        if config_contents[PROJECT_NAME] in ([], ""):
+            raise ValueError(f"Config file has no {PROJECT_NAME}")
         return (
             config_contents[USERNAME],
             config_contents[PASSWORD],
@@ -63,4 +65,12 @@ class ConfigHelper:
 
     @property
     def project_name(self) -> str:
-        return self._project_name
+        """The first configured project"""
+        return self.project_names[0]
+
+    @property
+    def project_names(self) -> list[str]:
+        """project_name in the config is a single project or a list of projects"""
+        if isinstance(self._project_name, list):
+            return self._project_name
+        return [self._project_name]
@@ -1,8 +1,9 @@
+import os
 from typing import Any, BinaryIO, Dict, Iterable, Union
 
-# iNaturalist URLs
+# iNaturalist URLs, the API can be pointed at a local stand-in (see benchmark/fake_inaturalist.py)
 BASE_URL = "https://www.inaturalist.org"
-BASE_API_URL = "https://api.inaturalist.org"
+BASE_API_URL = os.environ.get("INATURALIST_API_URL", "https://api.inaturalist.org")
 API_V1 = f"{BASE_API_URL}/v1"
 UNKNOWN = "unknown"
 
@@ -13,7 +14,16 @@ OBSERVATIONS_ENDPOINT = "observations"
 # rate limiting
 CONNECT_TIMEOUT = 5
 REQUEST_TIMEOUT = 10
-RATE_LIMIT = 60
+RATE_LIMIT = int(
+    os.environ.get("INATURALIST_RATE_LIMIT", 60)
+)  # requests per minute, 0 disables it
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+RETRY_BACKOFF_FACTOR = 0.5
+
+# Distributed training
+DISTRIBUTED_BACKEND = "gloo"
+DEFAULT_MASTER_ADDR = "127.0.0.1"
+DEFAULT_MASTER_PORT = 29500
 
 # iNaturalist Config
 USERNAME = "username"
@@ -41,7 +51,11 @@ SMALL_SUFIX = "small"
 TAXON_NAME = "taxon.name"
 TAXON_RANK = "taxon.rank"
 SPECIES_GUESSES = "species_guess"
+SPECIES_GUESS_CANONICAL = "species_guess_canonical"
+SPECIES_GUESS_COUNT = "count"
 USER_LOGIN = "user.login"
+QUALITY_GRADE = "quality_grade"
+TIME_OBSERVED_AT = "time_observed_at"
 PHOTOS = "photos"
 ENCODED_LABELS = "encoded_labels"
 
@@ -50,6 +64,7 @@ DATASET_COLUMNS = [
     "species_guess",
     "time_observed_at",
     "identifications_most_agree",
+    QUALITY_GRADE,
     "user.login",
     "uri",
     "photos",
@@ -62,4 +77,21 @@ DATASET_COLUMNS = [
 DATASET_NAME = "dataset"
 OUTPUT_NAME = "prediction"
 MODEL_NAME = "model"
+SPECIES_GUESS_MAPPING_NAME = "species_guess_mapping.csv"
+PROJECT_IDS_NAME = "project_ids.json"
+OBSERVATION_STORE_NAME = "observations.db"
+VIEW_NAME = "view"
 SPECIES_NAME = "species"
+METRICS_NAME = "metrics"
+TRACE_NAME = "trace"
+REPORT_NAME = "report"
+PREDICTIONS_NAME = "predictions"
+PREDICTION_CACHE_NAME = ".prediction_cache.db"
+STUDENT_NAME = "student"
+DISTILLATION_NAME = "distillation"
+FEATURE_CACHE_NAME = ".feature_cache"
+DECODED_CACHE_NAME = ".decoded_cache"
+SWEEP_NAME = "sweep"
+LABELS_SUFFIX = ".labels.json"
+PARTIAL_SUFFIX = ".part"
+DOWNLOAD_RETRY_NAME = "download_retry.json"
@@ -1,5 +1,7 @@
 from library.request_helper import get_local_session
 from library.dataset_Loader import DatasetLoader
+from library.rate_limiter import RateLimiter
+from library.run_report import span, count
 from common.constants import (
     API_V1,
     ResponseResult,
@@ -8,21 +10,25 @@ from common.constants import (
     ID_ORDER,
     CREATION_ORDER,
     OBSERVATIONS_ENDPOINT,
+    RATE_LIMIT,
 )
 
 import logging
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 
 class ObservationController:
-    def __init__(self):
-        self.session = get_local_session()
+    """Gets the observations of projects and saves them as datasets
+
+    * rate_limiter: request budget shared by every thread and controller using it
+    """
+
+    def __init__(self, rate_limiter: RateLimiter = None):
         self.endpoint = f"{API_V1}/{OBSERVATIONS_ENDPOINT}"
         self.dataset_loader = DatasetLoader()
-        self.rate_limit_per_minute = 60  # 60 requests per minute
-        self.delay_between_requests = 60 / self.rate_limit_per_minute
+        self.rate_limiter = rate_limiter or RateLimiter(RATE_LIMIT)
 
     def get_project_observations(
         self,
@@ -73,21 +79,22 @@ class ObservationController:
             params["id_above"] = id_above
         logging.debug(f"creating pararms {params}")
 
-        observations = self.session.send_request(
+        # Sessions are per thread, so projects can be harvested from several threads at once
+        self.rate_limiter.acquire()
+        observations = get_local_session().send_request(
             method="GET", url=self.endpoint, return_type="json", params=params
         )
 
         return observations
 
-    def save_observations_as_dataset(
-        self, project_id: str, dataset_path: str, run_id: str = None
-    ) -> None:
-        """Save the observations as a dataset to the input path
+    def get_all_project_observations(self, project_id: str) -> list[dict]:
+        """Page through all the observations of the input project
 
         Args:
             project_id: Project ID to get the observations for
-            dataset_path: Path to save the dataset
-            run_id: Unique ID for the run
+
+        Returns:
+            list of the observations
         """
         total_images = 0
         all_observations = []
@@ -103,25 +110,96 @@ class ObservationController:
                 order=ASCENDING_ORDER,
                 order_by=ID_ORDER,
             )
+            if results is None:
+                raise ValueError(
+                    f"Failed to get page {page} of the observations of project {project_id}"
+                )
             observations = results["results"]
             if not observations:
                 break
             total_images += len(observations)
             all_observations.extend(observations)
+            count("observation_pages")
             page += 1
             logger.debug(f"Foun {len(observations)} observations on page {page-1}")
 
             # Get the highest ID from the current batch to use as id_above for the next batch
             id_above = observations[-1]["id"]
 
-            time.sleep(self.delay_between_requests)
-
         logging.info(
-            f"finished getting all the observations after {page-1} pages.\n Total images found: {total_images}"
+            f"finished getting all the observations of project {project_id} after {page-1} pages.\n Total images found: {total_images}"
+        )
+        return all_observations
+
+    def get_observations_of_projects(
+        self, project_ids: list[str], max_workers: int = None
+    ) -> list[dict]:
+        """Harvest the input projects concurrently, all the requests share the rate limiter.
+        Observations that belong to several projects are only kept once. A project that fails
+        is logged and skipped, the other projects are still returned
+
+        Args:
+            project_ids: Project IDs to get the observations for
+            max_workers: Number of projects harvested at once, all of them by default
+
+        Returns:
+            list of the distinct observations
+        """
+        max_workers = max_workers or max(1, len(project_ids))
+        project_observations = []
+        with span("harvest"), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                project_id: executor.submit(
+                    self.get_all_project_observations, project_id
+                )
+                for project_id in project_ids
+            }
+            for project_id, future in futures.items():
+                try:
+                    project_observations.append(future.result())
+                except Exception as e:
+                    logger.error(f"Failed to harvest project {project_id}: {e}")
+                    count("failed_projects")
+        if project_ids and not project_observations:
+            raise ValueError(f"Failed to harvest every project: {project_ids}")
+
+        observations = {}
+        for project in project_observations:
+            for observation in project:
+                observations.setdefault(observation["id"], observation)
+        total = sum(len(project) for project in project_observations)
+        count("observations", len(observations))
+        logger.info(
+            f"Harvested {len(project_observations)}/{len(project_ids)} projects | {total} observations | {total - len(observations)} duplicates removed"
         )
+        return list(observations.values())
+
+    def save_observations_as_dataset(
+        self,
+        project_ids: list[str],
+        dataset_path: str,
+        run_id: str = None,
+        mapping_path: str = None,
+        max_workers: int = None,
+        store_path: str = None,
+    ) -> None:
+        """Save the observations of the input projects as one dataset to the input path
 
+        Args:
+            project_ids: Project IDs to get the observations for
+            dataset_path: Path to save the dataset
+            run_id: Unique ID for the run
+            mapping_path: Path of the species guess mapping table shared between runs
+            max_workers: Number of projects harvested at once
+            store_path: Path of the observation store to upsert the observations into
+        """
+        all_observations = self.get_observations_of_projects(project_ids, max_workers)
         self.dataset_loader.save_json_dataset(
-            dataset_path, {"dataset": all_observations}
+            dataset_path,
+            {"dataset": all_observations},
+            mapping_path=mapping_path,
+            store_path=store_path,
+            run_id=run_id,
         )
 
     def download_dataset(self, dataset_path: str, run_dir: str) -> None:
@@ -130,4 +208,5 @@ class ObservationController:
         Args:
             dataset_path: Path to the dataset
         """
-        self.dataset_loader.download_dataset(dataset_path, run_dir)
+        with span("photo_download"):
+            self.dataset_loader.download_dataset(dataset_path, run_dir)
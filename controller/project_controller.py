@@ -1,18 +1,61 @@
 from common.constants import API_V1, PROJECTS_ENDPOINT
 from urllib.parse import quote
+from library.base_io import BaseIO
+from library.rate_limiter import RateLimiter
 from library.request_helper import get_local_session
+from library.run_report import span
 
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class ProjectController:
-    """Custom ProjectController to use to get, create and update information about projects"""
+    """Custom ProjectController to use to get, create and update information about projects
 
-    def __init__(self):
+    * cache_path: JSON file persisting the resolved project name -> id lookups between runs
+    * rate_limiter: request budget shared with other controllers
+    """
+
+    def __init__(self, cache_path: str = None, rate_limiter: RateLimiter = None):
         self.endpoint = f"{API_V1}/{PROJECTS_ENDPOINT}"
         self.session = get_local_session()
+        self.cache_path = cache_path
+        self.rate_limiter = rate_limiter
+        self.project_ids = self.load_project_ids()
+
+    def load_project_ids(self) -> dict:
+        """Load the project name -> id lookups of previous runs"""
+        if not self.cache_path or not BaseIO.is_path_file(self.cache_path):
+            return {}
+        with open(self.cache_path, "r") as file:
+            return json.load(file)
+
+    def save_project_ids(self) -> None:
+        """Persist the project name -> id lookups"""
+        if not self.cache_path:
+            return
+        with open(self.cache_path, "w") as file:
+            json.dump(self.project_ids, file, indent=4)
+
+    def get_project_ids_by_names(self, project_names: list[str]) -> dict:
+        """Gets the ids of the input projects, projects resolved by a previous run are not
+        looked up again
+
+        Args:
+            project_names: project names for which to get the ids
+
+        Returns:
+            dict of project name -> project id, projects that were not found are left out
+        """
+        project_ids = {}
+        with span("project_lookup"):
+            for project_name in project_names:
+                project_id = self.get_project_id_by_name(project_name)
+                if project_id is not None:
+                    project_ids[project_name] = project_id
+        return project_ids
 
     def get_project_id_by_name(self, project_name: str) -> str:
         """Gets the id for the associated project by name
@@ -33,13 +76,20 @@ class ProjectController:
         Returns:
             string project_id
         """
+        if project_name in self.project_ids:
+            logger.debug(f"Using the cached id of project: {project_name}")
+            return self.project_ids[project_name]
+
         project_info = self.get_project_info_by_name(project_name)
         if (
             project_info
             and "results" in project_info
             and len(project_info["results"]) > 0
         ):
-            return project_info["results"][0]["id"]
+            project_id = project_info["results"][0]["id"]
+            self.project_ids[project_name] = project_id
+            self.save_project_ids()
+            return project_id
         else:
             logger.error(f"No project found with name: {project_name}")
             return None
@@ -66,6 +116,8 @@ class ProjectController:
         params = {"q": project_name}
         logging.debug(f"creating pararms {params}")
 
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
         project_info = self.session.send_request(
             method="GET", url=self.endpoint, return_type="json", params=params
         )
@@ -8,17 +8,20 @@ from common.constants import (
     TAXON_NAME,
     TAXON_RANK,
     SPECIES_GUESSES,
+    SPECIES_GUESS_CANONICAL,
     USER_LOGIN,
     ENCODED_LABELS,
+    DOWNLOAD_RETRY_NAME,
 )
 
 import pandas as pd
 import logging
 import os
-from library.base_io import BaseIO
+from library.species_guess_normalizer import SpeciesGuessNormalizer
+from library.observation_store import ObservationStore
+from library.run_report import span, count
 from tqdm import tqdm
-from sklearn.preprocessing import OneHotEncoder
-from library.request_helper import get_request
+from library.photo_downloader import PhotoDownloader, RetryQueue
 from numpy.typing import NDArray
 
 logger = logging.getLogger(__name__)
@@ -49,8 +52,14 @@ class DatasetLoader:
         return str(text).lower().strip()
 
     @staticmethod
-    def encode_labels(labels: NDArray) -> dict:
-        onehot_encoder = OneHotEncoder()
+    def encode_labels(labels: NDArray, keep_order: bool = False) -> dict:
+        # sklearn takes longer to import than the rest of the download command, only load it here
+        from sklearn.preprocessing import OneHotEncoder
+
+        # The class indices follow the sorted labels, unless the input order must be kept
+        onehot_encoder = OneHotEncoder(
+            categories=[list(labels)] if keep_order else "auto"
+        )
         onehot_labels = onehot_encoder.fit_transform(labels.reshape(-1, 1))
         species_to_onehot = {
             species: onehot_labels[i] for i, species in enumerate(labels)
@@ -85,63 +94,141 @@ class DatasetLoader:
         )
         return df
 
-    def save_json_dataset(self, dataset_file_name: str, json_content: dict) -> None:
+    def canonicalize_species_guesses(
+        self, df: pd.DataFrame, mapping_path: str = None
+    ) -> pd.DataFrame:
+        """Add the canonical species guess of every observation to the dataset. The guess -> canonical
+        mapping of previous runs is loaded from and saved back to mapping_path when it is passed in
+
+        Args:
+            df: dataset with the normalized species_guess column
+            mapping_path: path of the mapping table to reuse and update
+
+        Returns:
+            pd.DataFrame: dataset with the species_guess_canonical column
+        """
+        mapping = (
+            SpeciesGuessNormalizer.load_mapping(mapping_path) if mapping_path else None
+        )
+        normalizer = SpeciesGuessNormalizer(mapping=mapping)
+        normalizer.fit(df[SPECIES_GUESSES])
+        df[SPECIES_GUESS_CANONICAL] = normalizer.transform(df[SPECIES_GUESSES])
+
+        if mapping_path:
+            normalizer.save_mapping(mapping_path)
+        return df
+
+    def save_json_dataset(
+        self,
+        dataset_file_name: str,
+        json_content: dict,
+        mapping_path: str = None,
+        store_path: str = None,
+        run_id: str = None,
+    ) -> None:
         """Save the dataset to the input path as a JSON file
 
         Args:
             dataset_file_name: Path to save the dataset
             json_content: JSON string containing the 'dataset' key and value
+            mapping_path: Path of the species guess mapping table shared between runs
+            store_path: Path of the observation store to upsert every observation into
+            run_id: Unique ID for the run
         """
 
-        try:
-            json_dataset = json_content["dataset"]
-            logging.debug(f"Transforming the dataset to a DataFrame")
-            dataset = [
-                self.transform_json_to_dataset(fragment) for fragment in json_dataset
-            ]
-            df = pd.concat(dataset, ignore_index=True)
-            df = df[df[TAXON_RANK] == SPECIES_NAME]
-            logging.debug(f"Kept {len(df)} images")
-
-            # One hot encoding for the labels
-            unique_values = df[TAXON_NAME].unique()
-            logging.debug(f"Found this many labels: {unique_values.shape}")
-            encoded_labels = DatasetLoader.encode_labels(unique_values)
-            df[ENCODED_LABELS] = df[TAXON_NAME].apply(lambda x: encoded_labels[x])
-
-            logger.info(f"Dataset saved to {dataset_file_name} from JSON")
-            df.to_csv(dataset_file_name, index=False)
-        except Exception as e:
-            logger.error(
-                f"Failed to save dataset to {dataset_file_name} from JSON: {e}"
-            )
-            raise
+        with span("save_dataset"):
+            try:
+                json_dataset = json_content["dataset"]
+                logging.debug(f"Transforming the dataset to a DataFrame")
+                dataset = [
+                    self.transform_json_to_dataset(fragment)
+                    for fragment in json_dataset
+                ]
+                df = pd.concat(dataset, ignore_index=True)
+                df = self.canonicalize_species_guesses(df, mapping_path)
+                if store_path:
+                    # The store keeps every rank, queries pick the observations they need
+                    store = ObservationStore(store_path)
+                    store.upsert_observations(df, run_id)
+                    store.close()
+                df = df[df[TAXON_RANK] == SPECIES_NAME]
+                logging.debug(f"Kept {len(df)} images")
+                count("dataset_rows", len(df))
+
+                # One hot encoding for the labels
+                unique_values = df[TAXON_NAME].unique()
+                logging.debug(f"Found this many labels: {unique_values.shape}")
+                encoded_labels = DatasetLoader.encode_labels(unique_values)
+                df[ENCODED_LABELS] = df[TAXON_NAME].apply(lambda x: encoded_labels[x])
+
+                logger.info(f"Dataset saved to {dataset_file_name} from JSON")
+                df.to_csv(dataset_file_name, index=False)
+            except Exception as e:
+                logger.error(
+                    f"Failed to save dataset to {dataset_file_name} from JSON: {e}"
+                )
+                raise
 
     def download_dataset(self, dataset_path: str, run_dir: str) -> None:
-        """Download the dataset to the input path
+        """Download the dataset to the input path. Photos are named after their observation id,
+        photos shared by several observations are only downloaded once. Photos already on disk
+        are skipped, the ones that fail are retried once at the end and then saved to the
+        retry queue of the run directory for the next run
 
         Args:
             dataset_path: Path to save the dataset
+            run_dir: Directory to save the photos in
         """
         df = self.load_dataset(dataset_path)
-        df = df[[TAXON_NAME, PHOTOS]]
+        df = df[["id", TAXON_NAME, PHOTOS]]
+        downloader = PhotoDownloader()
+        retry_queue = RetryQueue(os.path.join(run_dir, DOWNLOAD_RETRY_NAME))
 
-        for index, row in tqdm(df.iterrows(), total=df.shape[0]):
-            species_name = row[TAXON_NAME]
+        photos = {}
+        for _, row in df.iterrows():
+            species_dir = os.path.join(run_dir, row[TAXON_NAME])
             photo_urls = eval(row[PHOTOS])  # convert string to list
-            species_dir = os.path.join(run_dir, species_name)
-            if not BaseIO.path_exists(species_dir):
-                BaseIO.create_directory(species_dir)
-
             for i, url in enumerate(photo_urls):
-                try:
-                    response = get_request(url, stream=True)
-                    if response.status_code == 200:
-                        with open(
-                            os.path.join(species_dir, f"{index}_{i}.jpg"), "wb"
-                        ) as f:
-                            for chunk in response.iter_content(1024):
-                                f.write(chunk)
-                except Exception as e:
-                    logger.error(f"Failed to download photo {url}: {e}")
+                if url in photos:
+                    logger.debug(f"Skipping duplicate photo {url}")
                     continue
+                photos[url] = os.path.join(species_dir, f"{row['id']}_{i}.jpg")
+        if len(retry_queue):
+            logger.info(f"Retrying {len(retry_queue)} photos of the previous run")
+            photos.update(retry_queue.pending())
+
+        failed = self.download_photos(downloader, retry_queue, photos.items())
+        if failed:
+            # Transient failures often clear up by the end of the run
+            logger.info(f"Retrying {len(failed)} failed photos")
+            failed = self.download_photos(downloader, retry_queue, failed)
+        retry_queue.save()
+
+    def download_photos(
+        self,
+        downloader: PhotoDownloader,
+        retry_queue: RetryQueue,
+        photos: list[tuple[str, str]],
+    ) -> list[tuple[str, str]]:
+        """Download the input photos, the failed ones are added to the retry queue
+
+        Args:
+            downloader: downloader of the photos
+            retry_queue: queue of the photos that failed
+            photos: url and path of every photo
+
+        Returns:
+            the url and path of the photos that failed
+        """
+        failed = []
+        for url, photo_path in tqdm(photos):
+            try:
+                if downloader.download(url, photo_path):
+                    count("photos_downloaded")
+                retry_queue.remove(photo_path)
+            except Exception as e:
+                logger.error(f"Failed to download photo {url}: {e}")
+                count("photo_failures")
+                retry_queue.add(url, photo_path, e)
+                failed.append((url, photo_path))
+        return failed
@@ -0,0 +1,193 @@
+from common.constants import DATASET_NAME, TAXON_NAME, PARTIAL_SUFFIX
+from library.base_io import BaseIO
+
+import csv
+import glob
+import json
+import logging
+import os
+import random
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+def read_dataset_labels(dataset_dir: str) -> list[str]:
+    """Read the labels of the dataset file of the dataset directory, in order of appearance.
+    Uses the csv module only, so listing a dataset never imports pandas or torch
+
+    Args:
+        dataset_dir: directory of the dataset
+
+    Returns:
+        the unique labels of the dataset file
+    """
+    dataset_file = sorted(glob.glob(f"{dataset_dir}/{DATASET_NAME}_*.csv"))
+    if not dataset_file:
+        raise FileNotFoundError(f"No dataset file found in {dataset_dir}")
+
+    with open(dataset_file[0], "r", newline="") as file:
+        labels = (row[TAXON_NAME] for row in csv.DictReader(file))
+        return list(dict.fromkeys(label for label in labels if label))
+
+
+def scan_dataset_dir(dataset_dir: str, labels) -> list[tuple[str, str]]:
+    """List the images of every label directory of the dataset, without decoding them
+
+    Args:
+        dataset_dir: directory of the dataset, with one sub-directory of images per label
+        labels: labels of the dataset, other directories (e.g. caches) are skipped
+
+    Returns:
+        the (image path, label) samples
+    """
+    samples = []
+    for label in os.listdir(dataset_dir):
+        label_dir = os.path.join(dataset_dir, label)
+        if label not in labels or not BaseIO.is_path_directory(label_dir):
+            continue
+        for image_name in os.listdir(label_dir):
+            # Photos still being downloaded are not part of the dataset yet
+            if image_name.endswith(PARTIAL_SUFFIX):
+                continue
+            samples.append((os.path.join(label_dir, image_name), label))
+    return samples
+
+
+class DatasetView:
+    """Subset of a dataset defined by a manifest of image paths and labels, so a subset never
+    copies the images. The train and val splits are part of the view.
+
+    * dataset_dir: directory of the dataset, the image paths are relative to it. It is kept
+      as an absolute path, so the manifest works from any working directory
+    * train: (image path, label) samples of the training split
+    * val: (image path, label) samples of the validation split
+    * params: arguments the view was built with, kept in the manifest for reference
+    """
+
+    def __init__(
+        self,
+        dataset_dir: str,
+        train: list[tuple[str, str]],
+        val: list[tuple[str, str]],
+        params: dict = None,
+    ):
+        self.dataset_dir = os.path.abspath(dataset_dir)
+        self.train = train
+        self.val = val
+        self.params = params or {}
+
+    @property
+    def class_names(self) -> list[str]:
+        return sorted({label for _, label in self.train + self.val})
+
+    def samples(self) -> list[tuple[str, str]]:
+        """Get the train samples followed by the val samples, with the full image paths"""
+        return [
+            (os.path.join(self.dataset_dir, path), label)
+            for path, label in self.train + self.val
+        ]
+
+    def save(self, view_path: str) -> None:
+        """Save the view as a JSON manifest"""
+        with open(view_path, "w") as file:
+            json.dump(
+                {
+                    "dataset_dir": self.dataset_dir,
+                    "params": self.params,
+                    "train": self.train,
+                    "val": self.val,
+                },
+                file,
+            )
+        logger.info(
+            f"Saved the view to: {view_path} | Classes: {len(self.class_names)} | Train size: {len(self.train)} | Val size: {len(self.val)}"
+        )
+
+    @staticmethod
+    def load(view_path: str) -> "DatasetView":
+        """Load a view from its JSON manifest"""
+        with open(view_path, "r") as file:
+            manifest = json.load(file)
+        return DatasetView(
+            manifest["dataset_dir"],
+            [tuple(sample) for sample in manifest["train"]],
+            [tuple(sample) for sample in manifest["val"]],
+            manifest.get("params"),
+        )
+
+    @staticmethod
+    def build(
+        dataset_dir: str,
+        samples: list[tuple[str, str]],
+        classes: list[str] = None,
+        top_classes: int = None,
+        min_per_class: int = None,
+        max_per_class: int = None,
+        val_fraction: float = 0.25,
+        seed: int = 42,
+    ) -> "DatasetView":
+        """Build a class-filtered and balanced view of the input samples with a stratified split
+
+        Examples:
+
+            The 10 species with the most images, at most 200 images each:
+
+            >>>  samples = scan_dataset_dir(dataset_dir, read_dataset_labels(dataset_dir))
+            >>>  view = DatasetView.build(dataset_dir, samples, top_classes=10,
+            >>>     max_per_class=200)
+
+        Args:
+            dataset_dir: directory of the dataset
+            samples: (image path, label) samples to select from
+            classes: only keep these labels
+            top_classes: only keep the labels with the most samples
+            min_per_class: drop the labels with fewer samples
+            max_per_class: keep at most this many samples of every label
+            val_fraction: fraction of the samples of every label in the validation split
+            seed: seed of the sampling and of the split
+
+        Returns:
+            the view
+        """
+        if not 0.0 < val_fraction < 1.0:
+            raise ValueError(f"Val fraction must be in (0, 1), got: {val_fraction}")
+
+        selected = set(classes) if classes else None
+        by_class = defaultdict(list)
+        for path, label in samples:
+            if selected is None or label in selected:
+                by_class[label].append(os.path.relpath(path, dataset_dir))
+
+        labels = [
+            label
+            for label in sorted(by_class)
+            if min_per_class is None or len(by_class[label]) >= min_per_class
+        ]
+        if top_classes is not None:
+            # Ties are broken by the label name so the same arguments give the same view
+            labels = sorted(labels, key=lambda label: -len(by_class[label]))
+            labels = sorted(labels[:top_classes])
+        if not labels:
+            raise ValueError("No class of the dataset matches the view filters")
+
+        rng = random.Random(seed)
+        train, val = [], []
+        for label in labels:
+            paths = sorted(by_class[label])
+            rng.shuffle(paths)
+            paths = paths[:max_per_class]
+            # Every label with more than one sample is in both splits
+            val_size = min(max(1, round(len(paths) * val_fraction)), len(paths) - 1)
+            val.extend((path, label) for path in paths[:val_size])
+            train.extend((path, label) for path in paths[val_size:])
+
+        params = {
+            "classes": classes,
+            "top_classes": top_classes,
+            "min_per_class": min_per_class,
+            "max_per_class": max_per_class,
+            "val_fraction": val_fraction,
+            "seed": seed,
+        }
+        return DatasetView(dataset_dir, train, val, params)
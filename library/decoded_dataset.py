@@ -0,0 +1,113 @@
+from library.base_io import BaseIO
+from library.species_dataset import SpeciesDataset
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+from torchvision import transforms
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+IMAGES_FILE = "decoded_{key}.npy"
+INDEX_FILE = "decoded_{key}.json"
+
+
+class DecodedDataset(Dataset):
+    """Images of a SpeciesDataset that were decoded and resized once into a uint8 memory-mapped
+    file. Every process opening the file maps the same pages read-only, so parallel training runs
+    share a single decoded copy of the dataset instead of each decoding the JPEGs again.
+
+    Samples are returned like SpeciesDataset returns them: a float image in [0, 1] and a one-hot label.
+
+    * images_path: path of the decoded images written by build()
+    """
+
+    def __init__(self, images_path: str):
+        self.images_path = images_path
+        with open(images_path.replace(".npy", ".json"), "r") as file:
+            index = json.load(file)
+        self.class_names = index["class_names"]
+        self.targets = torch.tensor(index["targets"], dtype=torch.int64)
+        self.images = np.load(images_path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, idx):
+        image = torch.from_numpy(self.images[idx].astype(np.float32) / 255)
+        label = F.one_hot(self.targets[idx], len(self.class_names)).float()
+        return image, label
+
+    @staticmethod
+    def cache_key(dataset: SpeciesDataset, image_size: tuple[int, int]) -> str:
+        """Hash the image paths, sizes and modification times, so any change to the files
+        gives a new key"""
+        digest = hashlib.sha256(str(image_size).encode())
+        for index, image_path in enumerate(dataset.image_paths):
+            stat = os.stat(image_path)
+            image_id = dataset.get_image_id(index)
+            digest.update(f"{image_id}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def build(
+        dataset_dir: str,
+        cache_dir: str,
+        image_size: tuple[int, int] = (128, 128),
+        batch_size: int = 64,
+    ) -> str:
+        """Decode the images of the dataset directory into the cache, unless they already are
+
+        Args:
+            dataset_dir: directory of the SpeciesDataset
+            cache_dir: directory to store the decoded images in
+            image_size: size to resize the images to
+            batch_size: number of images decoded per batch
+
+        Returns:
+            path of the decoded images, to open with DecodedDataset
+        """
+        transform = transforms.Compose(
+            [transforms.Resize(image_size), transforms.PILToTensor()]
+        )
+        dataset = SpeciesDataset(dataset_dir, transform=transform)
+        key = DecodedDataset.cache_key(dataset, image_size)
+        images_path = os.path.join(cache_dir, IMAGES_FILE.format(key=key))
+        index_path = os.path.join(cache_dir, INDEX_FILE.format(key=key))
+        if BaseIO.is_path_file(images_path) and BaseIO.is_path_file(index_path):
+            logger.info(f"Using the decoded dataset: {images_path}")
+            return images_path
+
+        BaseIO.create_directory(cache_dir)
+        for path in glob.glob(os.path.join(cache_dir, "decoded_*")):
+            logger.info(f"Removing stale decoded dataset: {path}")
+            os.remove(path)
+
+        logger.info(f"Decoding {len(dataset)} images to: {images_path}")
+        temp_path = f"{images_path}.tmp"
+        images = np.lib.format.open_memmap(
+            temp_path, mode="w+", dtype=np.uint8, shape=(len(dataset), 3, *image_size)
+        )
+        targets = []
+        row = 0
+        loader = DataLoader(
+            dataset, batch_size=batch_size, num_workers=min(4, os.cpu_count() or 1)
+        )
+        for inputs, labels in tqdm(loader):
+            images[row : row + len(inputs)] = inputs.numpy()
+            targets.extend(labels.argmax(dim=1).tolist())
+            row += len(inputs)
+        images.flush()
+        del images
+        os.replace(temp_path, images_path)
+
+        with open(index_path, "w") as file:
+            json.dump({"class_names": dataset.class_names, "targets": targets}, file)
+        return images_path
@@ -0,0 +1,196 @@
+from common.constants import (
+    PHOTOS,
+    TAXON_NAME,
+    TAXON_RANK,
+    SPECIES_NAME,
+    SPECIES_GUESSES,
+    SPECIES_GUESS_CANONICAL,
+    USER_LOGIN,
+    QUALITY_GRADE,
+    TIME_OBSERVED_AT,
+)
+
+import os
+import re
+import logging
+import sqlite3
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Dataset column -> store column of the observations table
+OBSERVATION_COLUMNS = {
+    "id": "id",
+    SPECIES_GUESSES: "species_guess",
+    SPECIES_GUESS_CANONICAL: "species_guess_canonical",
+    TIME_OBSERVED_AT: "time_observed_at",
+    "identifications_most_agree": "identifications_most_agree",
+    QUALITY_GRADE: "quality_grade",
+    USER_LOGIN: "user_login",
+    "uri": "uri",
+    "taxon.id": "taxon_id",
+    TAXON_RANK: "taxon_rank",
+    "taxon.rank_level": "taxon_rank_level",
+    TAXON_NAME: "taxon_name",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    id INTEGER PRIMARY KEY,
+    species_guess TEXT,
+    species_guess_canonical TEXT,
+    time_observed_at TEXT,
+    identifications_most_agree INTEGER,
+    quality_grade TEXT,
+    user_login TEXT,
+    uri TEXT,
+    taxon_id INTEGER,
+    taxon_rank TEXT,
+    taxon_rank_level REAL,
+    taxon_name TEXT,
+    run_id TEXT
+);
+CREATE TABLE IF NOT EXISTS photos (
+    observation_id INTEGER NOT NULL REFERENCES observations(id),
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    path TEXT,
+    PRIMARY KEY (observation_id, position)
+);
+CREATE INDEX IF NOT EXISTS observations_taxon_name ON observations(taxon_name);
+CREATE INDEX IF NOT EXISTS observations_taxon_rank ON observations(taxon_rank);
+CREATE INDEX IF NOT EXISTS observations_user_login ON observations(user_login);
+CREATE INDEX IF NOT EXISTS observations_time_observed_at ON observations(time_observed_at);
+CREATE INDEX IF NOT EXISTS photos_url ON photos(url);
+"""
+
+# Photo files are saved as <observation id>_<photo position>.jpg
+PHOTO_FILE_PATTERN = re.compile(r"^(\d+)_(\d+)\.jpg$")
+
+
+class ObservationStore:
+    """Persistent SQLite store of the harvested observations and their photos, shared by all
+    the runs of a dataset path. Observations are upserted by id, so harvesting again updates
+    the existing rows instead of duplicating them.
+
+    * store_path: path of the SQLite database, created if it does not exist
+    """
+
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        self.connection = sqlite3.connect(store_path)
+        # WAL lets queries read the store while a harvest writes to it
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def upsert_observations(self, df: pd.DataFrame, run_id: str = None) -> None:
+        """Insert or update the observations of the input dataset and their photo urls.
+        A photo whose url changed loses its downloaded path
+
+        Args:
+            df: dataset as created by DatasetLoader.transform_json_to_dataset
+            run_id: run that harvested the observations
+        """
+        columns = list(OBSERVATION_COLUMNS.values()) + ["run_id"]
+        observations = df[list(OBSERVATION_COLUMNS)].astype(object)
+        observations = observations.where(observations.notna(), None)
+        rows = [(*row, run_id) for row in observations.itertuples(index=False)]
+        updates = ", ".join(
+            f"{column} = excluded.{column}" for column in columns if column != "id"
+        )
+        photos = [
+            (int(observation_id), position, url)
+            for observation_id, urls in zip(df["id"], df[PHOTOS])
+            for position, url in enumerate(urls)
+        ]
+
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO observations ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT(id) DO UPDATE SET {updates}",
+                rows,
+            )
+            self.connection.executemany(
+                "INSERT INTO photos (observation_id, position, url) VALUES (?, ?, ?) "
+                "ON CONFLICT(observation_id, position) DO UPDATE SET url = excluded.url, "
+                "path = CASE WHEN photos.url = excluded.url THEN photos.path ELSE NULL END",
+                photos,
+            )
+        logger.info(
+            f"Upserted {len(rows)} observations and {len(photos)} photos into {self.store_path}"
+        )
+
+    def add_photo_paths(self, run_dir: str) -> None:
+        """Record the paths of the photos downloaded to the input run directory. A photo shared
+        by several observations is only downloaded once, under the first of them, and its path
+        is recorded for every observation that has its url
+
+        Args:
+            run_dir: directory with one sub-directory of photos per species
+        """
+        paths = []
+        for species in os.listdir(run_dir):
+            species_dir = os.path.join(run_dir, species)
+            if not os.path.isdir(species_dir):
+                continue
+            for file_name in os.listdir(species_dir):
+                match = PHOTO_FILE_PATTERN.match(file_name)
+                if match:
+                    path = os.path.abspath(os.path.join(species_dir, file_name))
+                    paths.append((path, int(match.group(1)), int(match.group(2))))
+
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE photos SET path = ? WHERE observation_id = ? AND position = ?",
+                paths,
+            )
+            self.connection.execute(
+                "UPDATE photos SET path = ("
+                "SELECT shared.path FROM photos AS shared "
+                "WHERE shared.url = photos.url AND shared.path IS NOT NULL LIMIT 1"
+                ") WHERE path IS NULL"
+            )
+        logger.info(f"Recorded {len(paths)} photo paths from {run_dir}")
+
+    def query(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+        """Run a read-only query against the store"""
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    def select_photos(
+        self, where: str = None, params: tuple = (), min_class_photos: int = None
+    ) -> pd.DataFrame:
+        """Select the downloaded photos of the species observations matching the filter
+
+        Examples:
+
+            >>>  store.select_photos("quality_grade = ? AND time_observed_at >= ?",
+            >>>     ("research", "2024-01-01"), min_class_photos=50)
+
+        Args:
+            where: SQL condition on the columns of the observations table
+            params: parameters of the condition
+            min_class_photos: drop the species with fewer matching photos
+
+        Returns:
+            DataFrame with the path and the taxon_name of every photo, a photo shared by
+            several matching observations is kept once
+        """
+        condition = f"AND ({where})" if where else ""
+        photos = self.query(
+            "SELECT photos.path, observations.taxon_name FROM photos "
+            "JOIN observations ON observations.id = photos.observation_id "
+            f"WHERE photos.path IS NOT NULL AND observations.taxon_rank = ? {condition} "
+            "ORDER BY photos.observation_id, photos.position",
+            (SPECIES_NAME, *params),
+        )
+        photos = photos.drop_duplicates("path")
+        if min_class_photos:
+            counts = photos["taxon_name"].map(photos["taxon_name"].value_counts())
+            photos = photos[counts >= min_class_photos]
+        logger.info(
+            f"Selected {len(photos)} photos of {photos['taxon_name'].nunique()} species from {self.store_path}"
+        )
+        return photos.reset_index(drop=True)
@@ -0,0 +1,240 @@
+from common.constants import PARTIAL_SUFFIX, RETRY_BACKOFF_FACTOR
+from library.request_helper import get_request
+from library.run_report import count
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import requests
+
+logger = logging.getLogger(__name__)
+
+# First bytes of the image formats served as photos
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+CHUNK_SIZE = 64 * 1024
+# Number of bytes read at once when looking for the end marker of an image
+TAIL_SIZE = 64 * 1024
+CONTENT_RANGE_PATTERN = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+def is_image_header(header: bytes) -> bool:
+    """Check if the input bytes start like a JPEG, PNG, GIF or WebP file"""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return True
+    return header.startswith(IMAGE_SIGNATURES)
+
+
+def get_image_end(file) -> bytes:
+    """Get the last bytes of the input file before its trailing zero padding, at most
+    TAIL_SIZE of them"""
+    end = file.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - TAIL_SIZE)
+        file.seek(start)
+        tail = file.read(end - start).rstrip(b"\0")
+        if tail:
+            return tail
+        end = start
+    return b""
+
+
+def is_complete_image(image_path: str) -> bool:
+    """Check if the input file is a whole image: it starts with an image header and ends
+    with the end marker of its format (JPEG EOI, PNG IEND, GIF trailer) or, for WebP, has
+    the size of its RIFF header. A truncated transfer fails the check"""
+    try:
+        with open(image_path, "rb") as file:
+            header = file.read(16)
+            if not is_image_header(header):
+                return False
+            if header[:4] == b"RIFF":
+                riff_size = int.from_bytes(header[4:8], "little")
+                return file.seek(0, os.SEEK_END) >= riff_size + 8
+            tail = get_image_end(file)
+    except OSError:
+        return False
+    if header.startswith(b"\xff\xd8\xff"):
+        return tail.endswith(b"\xff\xd9")
+    if header.startswith(b"\x89PNG"):
+        return tail.endswith(b"IEND\xaeB`\x82")
+    return tail.endswith(b";")
+
+
+def is_complete_photo(photo_path: str) -> bool:
+    """Check if the input photo exists and is a whole image"""
+    return os.path.isfile(photo_path) and is_complete_image(photo_path)
+
+
+class PhotoDownloader:
+    """Downloads photos to a <photo>.part file that is renamed to the photo path once its size
+    matches the Content-Length and it is a whole image, so an interrupted transfer never leaves
+    a truncated photo behind. The next attempt resumes the partial file with an HTTP Range
+    request. Photos on disk that are not whole images are downloaded again.
+
+    * max_attempts: number of transfers tried per photo before giving up
+    * chunk_size: number of bytes written at once
+    """
+
+    def __init__(self, max_attempts: int = 3, chunk_size: int = CHUNK_SIZE):
+        if max_attempts < 1:
+            raise ValueError(f"Max attempts must be >= 1, got: {max_attempts}")
+        self.max_attempts = max_attempts
+        self.chunk_size = chunk_size
+
+    def download(self, url: str, photo_path: str) -> bool:
+        """Download the input photo, unless it is already on disk
+
+        Args:
+            url: URL of the photo
+            photo_path: path to save the photo to
+
+        Returns:
+            True if the photo was downloaded, False if it was already complete
+        """
+        if is_complete_photo(photo_path):
+            return False
+        if os.path.isfile(photo_path):
+            # A truncated photo written before downloads were atomic is resumed like a
+            # partial file, the checks of the transfer decide if it can be kept
+            part_path = photo_path + PARTIAL_SUFFIX
+            logger.info(f"Downloading the incomplete photo again: {photo_path}")
+            if os.path.isfile(part_path):
+                os.remove(photo_path)
+            else:
+                os.replace(photo_path, part_path)
+            count("photo_repairs")
+
+        error = None
+        progress = True
+        for attempt in range(self.max_attempts):
+            # An attempt that got part of the photo is resumed right away
+            if attempt and not progress:
+                time.sleep(RETRY_BACKOFF_FACTOR * 2 ** (attempt - 1))
+            part_size = self.get_part_size(photo_path)
+            try:
+                self.transfer(url, photo_path)
+                return True
+            except (requests.RequestException, OSError, ValueError) as e:
+                error = e
+                progress = self.get_part_size(photo_path) > part_size
+                logger.debug(
+                    f"Attempt {attempt+1}/{self.max_attempts} to download {url} failed: {e}"
+                )
+        raise ValueError(f"{error} after {self.max_attempts} attempts")
+
+    @staticmethod
+    def get_part_size(photo_path: str) -> int:
+        """Get the number of bytes of the partial file of the input photo"""
+        part_path = photo_path + PARTIAL_SUFFIX
+        return os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+
+    def transfer(self, url: str, photo_path: str) -> None:
+        """Download the photo once, resuming its partial file if there is one"""
+        part_path = photo_path + PARTIAL_SUFFIX
+        offset = self.get_part_size(photo_path)
+        # The Content-Length has to count the bytes written to the file
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        response = get_request(url, stream=True, headers=headers)
+        try:
+            if response.status_code == 206:
+                match = CONTENT_RANGE_PATTERN.match(
+                    response.headers.get("Content-Range", "")
+                )
+                if match is None or int(match.group(1)) != offset:
+                    os.remove(part_path)
+                    raise ValueError(
+                        f"unexpected Content-Range: {response.headers.get('Content-Range')}"
+                    )
+                count("photo_resumes")
+                mode = "ab"
+            elif response.status_code == 200:
+                # The server sent the whole photo, the partial file is started over
+                offset = 0
+                mode = "wb"
+            elif response.status_code == 416:
+                # The partial file is at least as long as the photo, it can not be trusted
+                os.remove(part_path)
+                raise ValueError("range not satisfiable")
+            else:
+                raise ValueError(f"status {response.status_code}")
+
+            content_length = response.headers.get("Content-Length")
+            expected_size = offset + int(content_length) if content_length else None
+            os.makedirs(os.path.dirname(photo_path), exist_ok=True)
+            with open(part_path, mode) as file:
+                for chunk in response.iter_content(self.chunk_size):
+                    file.write(chunk)
+                    count("http_bytes", len(chunk))
+        finally:
+            response.close()
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            if size > expected_size:
+                os.remove(part_path)
+            raise ValueError(f"incomplete transfer: {size}/{expected_size} bytes")
+        if not is_complete_image(part_path):
+            os.remove(part_path)
+            raise ValueError("the response is not a whole image")
+        os.replace(part_path, photo_path)
+
+
+class RetryQueue:
+    """Photos that failed to download, saved as JSON next to the photos so the next run
+    retries them. The photo paths are stored relative to the directory of the queue.
+    Thread-safe.
+
+    * queue_path: JSON file of the queue, loaded if it exists
+    """
+
+    def __init__(self, queue_path: str):
+        self.queue_path = queue_path
+        self.root_dir = os.path.dirname(queue_path)
+        self.lock = threading.Lock()
+        self.items = {}
+        if os.path.isfile(queue_path):
+            with open(queue_path) as file:
+                self.items = json.load(file)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, url: str, photo_path: str, error: Exception) -> None:
+        """Queue a photo that failed to download"""
+        key = os.path.relpath(photo_path, self.root_dir)
+        with self.lock:
+            item = self.items.setdefault(key, {"url": url, "failures": 0})
+            item["failures"] += 1
+            item["error"] = str(error)
+
+    def remove(self, photo_path: str) -> None:
+        """Drop a photo from the queue once it is downloaded"""
+        with self.lock:
+            self.items.pop(os.path.relpath(photo_path, self.root_dir), None)
+
+    def pending(self) -> list[tuple[str, str]]:
+        """Get the url and the path of every queued photo"""
+        with self.lock:
+            return [
+                (item["url"], os.path.join(self.root_dir, key))
+                for key, item in self.items.items()
+            ]
+
+    def save(self) -> None:
+        """Write the queue, or delete its file once it is empty"""
+        with self.lock:
+            if not self.items:
+                if os.path.isfile(self.queue_path):
+                    os.remove(self.queue_path)
+                return
+            temp_path = self.queue_path + PARTIAL_SUFFIX
+            with open(temp_path, "w") as file:
+                json.dump(self.items, file, indent=2)
+            os.replace(temp_path, self.queue_path)
+        logger.info(f"{len(self.items)} photos left to retry in: {self.queue_path}")
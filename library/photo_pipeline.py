@@ -0,0 +1,327 @@
+from common.constants import (
+    PHOTOS,
+    TAXON_NAME,
+    TAXON_RANK,
+    SPECIES_NAME,
+    ASCENDING_ORDER,
+    ID_ORDER,
+    DOWNLOAD_RETRY_NAME,
+)
+from controller.observation_controller import ObservationController
+from library.dataset_Loader import DatasetLoader
+from library.photo_downloader import PhotoDownloader, RetryQueue
+from library.run_report import count as report_count
+from library.streaming_dataset import StreamingDataset
+
+import io
+import os
+import queue
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from torchvision import transforms
+
+logger = logging.getLogger(__name__)
+
+# Seconds a blocked stage waits before checking if the pipeline was stopped
+QUEUE_TIMEOUT = 0.5
+
+
+class PhotoPipeline:
+    """Streams the photos of a project into a StreamingDataset through three stages connected by
+    bounded queues: the observation pages of the projects are fetched concurrently and turned
+    into photo jobs, a pool of threads downloads the photos and another pool decodes and resizes
+    them. A full queue blocks the stage that feeds it, so a slow stage throttles the ones before
+    it instead of buffering the project in memory.
+
+    The photos are also saved under run_dir/<species>/, so the run directory can later be
+    trained on like a dataset created by the download command.
+
+    * project_ids: projects to harvest, observations in several projects are only used once
+    * run_dir: directory to save the photos in
+    * dataset: dataset the preprocessed images are appended to
+    * transform: transform applied to every decoded photo
+    * download_workers: number of photo download threads
+    * preprocess_workers: number of decode and resize threads
+    * queue_size: capacity of each queue between the stages
+    """
+
+    def __init__(
+        self,
+        project_ids: list[str],
+        run_dir: str,
+        dataset: StreamingDataset,
+        transform: transforms.Compose,
+        download_workers: int = 8,
+        preprocess_workers: int = 2,
+        queue_size: int = 256,
+    ):
+        self.project_ids = project_ids
+        self.run_dir = run_dir
+        self.dataset = dataset
+        self.transform = transform
+        self.download_workers = download_workers
+        self.preprocess_workers = preprocess_workers
+        self.download_queue = queue.Queue(maxsize=queue_size)
+        self.preprocess_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.downloader = PhotoDownloader()
+        self.retry_queue = RetryQueue(os.path.join(run_dir, DOWNLOAD_RETRY_NAME))
+        self.observations = []
+        self.stats = {"observations": 0, "photos": 0, "failed": 0}
+        self.stats_lock = threading.Lock()
+        self.error = None
+        self.thread = None
+
+    def start(self) -> None:
+        """Start the stages on background threads"""
+        self.thread = threading.Thread(target=self.run, name="pipeline", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop all the stages, the items still queued are dropped"""
+        self.stop_event.set()
+
+    def join(self) -> list[dict]:
+        """Wait for all the stages to finish
+
+        Returns:
+            the raw observations that were fetched
+        """
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.observations
+
+    def run(self) -> None:
+        """Run the stages and close every queue once the stage feeding it is done"""
+        start = time.perf_counter()
+        fetcher = self.start_workers(self.fetch_observations, 1, "fetch")
+        downloaders = self.start_workers(
+            self.download_photos, self.download_workers, "download"
+        )
+        preprocessors = self.start_workers(
+            self.preprocess_photos, self.preprocess_workers, "preprocess"
+        )
+
+        # One sentinel per worker tells the next stage there is nothing left
+        self.close_stage(fetcher, self.download_queue, self.download_workers)
+        self.close_stage(downloaders, self.preprocess_queue, self.preprocess_workers)
+        self.close_stage(preprocessors, None, 0)
+
+        self.retry_queue.save()
+        self.dataset.finish(self.error)
+        logger.info(
+            f"Pipeline finished in {time.perf_counter() - start:.1f}s | {self.stats['observations']} observations | {self.stats['photos']} photos | {self.stats['failed']} failed"
+        )
+
+    def start_workers(self, target, num_workers: int, name: str) -> list:
+        workers = [
+            threading.Thread(target=self.guard, args=(target,), name=f"{name}-{index}")
+            for index in range(num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        return workers
+
+    def close_stage(self, workers: list, next_queue: queue.Queue, num_next: int):
+        for worker in workers:
+            worker.join()
+        for _ in range(num_next):
+            self.put(next_queue, None)
+
+    def guard(self, target) -> None:
+        """Run a stage, an error stops the whole pipeline"""
+        try:
+            target()
+        except Exception as e:
+            logger.error(
+                f"Pipeline stage {threading.current_thread().name} failed: {e}"
+            )
+            self.error = self.error or e
+            self.stop()
+
+    def put(self, target_queue: queue.Queue, item) -> bool:
+        """Put the item on the queue, waiting while it is full
+
+        Returns:
+            False if the pipeline was stopped before the item could be queued
+        """
+        while not self.stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=QUEUE_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, source_queue: queue.Queue):
+        """Get the next item of the queue, None once the stage is closed or the pipeline stopped"""
+        while not self.stop_event.is_set():
+            try:
+                return source_queue.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
+        return None
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.stats_lock:
+            self.stats[name] += value
+
+    def fetch_observations(self) -> None:
+        """Page through the observations of the projects concurrently and queue a job for
+        every photo. A project that fails is logged and skipped, the stage only fails when
+        every project does"""
+        observation_controller = ObservationController()
+        seen_ids = set()
+        seen_urls = set()
+        seen_lock = threading.Lock()
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, len(self.project_ids)), thread_name_prefix="fetch"
+        ) as executor:
+            futures = {
+                project_id: executor.submit(
+                    self.fetch_project,
+                    observation_controller,
+                    project_id,
+                    seen_ids,
+                    seen_urls,
+                    seen_lock,
+                )
+                for project_id in self.project_ids
+            }
+            failed = []
+            for project_id, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Failed to harvest project {project_id}: {e}")
+                    report_count("failed_projects")
+                    failed.append(project_id)
+        if failed and len(failed) == len(self.project_ids):
+            raise ValueError(f"Failed to harvest every project: {failed}")
+
+    def fetch_project(
+        self,
+        observation_controller: ObservationController,
+        project_id: str,
+        seen_ids: set,
+        seen_urls: set,
+        seen_lock: threading.Lock,
+    ) -> None:
+        """Page through the observations of one project and queue a job for every photo
+
+        Args:
+            observation_controller: controller sharing the rate limiter of the run
+            project_id: project to harvest
+            seen_ids: ids of the observations already queued by any project
+            seen_urls: urls of the photos already queued by any project
+            seen_lock: lock of seen_ids and seen_urls
+        """
+        dataset_loader = DatasetLoader()
+        id_above = None
+        while not self.stop_event.is_set():
+            results = observation_controller.get_project_observations(
+                project_id,
+                id_above=id_above,
+                per_page=200,
+                order=ASCENDING_ORDER,
+                order_by=ID_ORDER,
+            )
+            if results is None:
+                raise ValueError(
+                    f"Failed to get the observations of project {project_id}"
+                )
+            observations = results["results"]
+            if not observations:
+                break
+            id_above = observations[-1]["id"]
+            # Observations in several projects are only queued by the first project to get them
+            with seen_lock:
+                observations = [
+                    observation
+                    for observation in observations
+                    if observation["id"] not in seen_ids
+                ]
+                seen_ids.update(observation["id"] for observation in observations)
+                self.observations.extend(observations)
+            if not observations:
+                continue
+            self.count("observations", len(observations))
+            if not self.queue_photos(
+                dataset_loader, observations, seen_urls, seen_lock
+            ):
+                return
+
+    def queue_photos(
+        self,
+        dataset_loader: DatasetLoader,
+        observations: list,
+        seen_urls: set,
+        seen_lock: threading.Lock,
+    ) -> bool:
+        """Queue a download job for every photo of the species observations. A photo shared by
+        several observations is only queued for the first of them, like the download command
+
+        Returns:
+            False if the pipeline was stopped
+        """
+        df = dataset_loader.transform_json_to_dataset(observations)
+        df = df[df[TAXON_RANK] == SPECIES_NAME]
+        for observation_id, label, photo_urls in zip(
+            df["id"], df[TAXON_NAME], df[PHOTOS]
+        ):
+            # Registering the class here keeps it even if none of its photos download
+            self.dataset.add_class(label)
+            for index, url in enumerate(photo_urls):
+                with seen_lock:
+                    if url in seen_urls:
+                        logger.debug(f"Skipping duplicate photo {url}")
+                        continue
+                    seen_urls.add(url)
+                photo_path = os.path.join(
+                    self.run_dir, label, f"{observation_id}_{index}.jpg"
+                )
+                if not self.put(self.download_queue, (url, photo_path, label)):
+                    return False
+        return True
+
+    def download_photos(self) -> None:
+        """Download the queued photos, photos already on disk are read instead. The photos
+        that fail are saved to the retry queue of the run directory"""
+        while (job := self.get(self.download_queue)) is not None:
+            url, photo_path, label = job
+            try:
+                if self.downloader.download(url, photo_path):
+                    report_count("photos_downloaded")
+                self.retry_queue.remove(photo_path)
+            except Exception as e:
+                logger.error(f"Failed to download photo {url}: {e}")
+                self.count("failed")
+                report_count("photo_failures")
+                self.retry_queue.add(url, photo_path, e)
+                continue
+            with open(photo_path, "rb") as file:
+                content = file.read()
+
+            if not self.put(self.preprocess_queue, (content, photo_path, label)):
+                return
+
+    def preprocess_photos(self) -> None:
+        """Decode and transform the downloaded photos and add them to the dataset"""
+        while (job := self.get(self.preprocess_queue)) is not None:
+            content, photo_path, label = job
+            try:
+                image = Image.open(io.BytesIO(content)).convert("RGB")
+                image = self.transform(image)
+            except Exception as e:
+                logger.error(f"Failed to decode photo {photo_path}: {e}")
+                self.count("failed")
+                continue
+            image_id = os.path.relpath(photo_path, self.run_dir)
+            self.dataset.append(image, label, image_id)
+            self.count("photos")
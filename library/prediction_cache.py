@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    model_hash TEXT NOT NULL,
+    image_hash TEXT NOT NULL,
+    top_k INTEGER NOT NULL,
+    predictions TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model_hash, image_hash)
+);
+CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions(last_used);
+"""
+
+# SQLite limits the number of parameters of one statement
+QUERY_CHUNK_SIZE = 500
+
+
+def hash_bytes(content: bytes) -> str:
+    """Hash the content of an image, identical files get the same hash wherever they are"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_files(paths: list[str]) -> str:
+    """Hash the content of the input files together, e.g. a checkpoint and its label sidecar"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class PredictionCache:
+    """Persistent SQLite cache of the top-k predictions of images, keyed by the hash of the image
+    content and the hash of the model. A new model never sees the entries of another one, and
+    the least recently used entries are evicted beyond max_entries.
+
+    * cache_path: path of the SQLite database, created if it does not exist
+    * max_entries: number of predictions kept across all the models
+    """
+
+    def __init__(self, cache_path: str, max_entries: int = 100_000):
+        if max_entries < 1:
+            raise ValueError(f"Cache size must be >= 1, got: {max_entries}")
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get_many(
+        self, model_hash: str, image_hashes: list[str], top_k: int
+    ) -> dict[str, list[dict]]:
+        """Get the cached predictions of the input images. Entries with fewer than top_k
+        predictions are misses
+
+        Args:
+            model_hash: hash of the model
+            image_hashes: hashes of the image contents
+            top_k: number of predictions needed per image
+
+        Returns:
+            dict of the image hash to its top_k predictions, for the cached images only
+        """
+        unique_hashes = list(dict.fromkeys(image_hashes))
+        found = {}
+        for start in range(0, len(unique_hashes), QUERY_CHUNK_SIZE):
+            chunk = unique_hashes[start : start + QUERY_CHUNK_SIZE]
+            rows = self.connection.execute(
+                "SELECT image_hash, predictions FROM predictions "
+                f"WHERE model_hash = ? AND top_k >= ? AND image_hash IN ({', '.join('?' * len(chunk))})",
+                (model_hash, top_k, *chunk),
+            ).fetchall()
+            found.update(
+                (image_hash, json.loads(predictions)[:top_k])
+                for image_hash, predictions in rows
+            )
+
+        if found:
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE predictions SET last_used = ? WHERE model_hash = ? AND image_hash = ?",
+                    [(time.time(), model_hash, image_hash) for image_hash in found],
+                )
+        hits = sum(1 for image_hash in image_hashes if image_hash in found)
+        self.hits += hits
+        self.misses += len(image_hashes) - hits
+        return found
+
+    def put_many(
+        self, model_hash: str, predictions: dict[str, list[dict]], top_k: int
+    ) -> None:
+        """Store the predictions of the input images and evict the least recently used entries
+
+        Args:
+            model_hash: hash of the model
+            predictions: dict of the image hash to its top_k predictions
+            top_k: number of predictions per image
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO predictions (model_hash, image_hash, top_k, predictions, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (model_hash, image_hash, top_k, json.dumps(image_predictions), now)
+                    for image_hash, image_predictions in predictions.items()
+                ],
+            )
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used entries beyond max_entries"""
+        (num_entries,) = self.connection.execute(
+            "SELECT COUNT(*) FROM predictions"
+        ).fetchone()
+        if num_entries <= self.max_entries:
+            return
+        self.connection.execute(
+            "DELETE FROM predictions WHERE rowid IN "
+            "(SELECT rowid FROM predictions ORDER BY last_used LIMIT ?)",
+            (num_entries - self.max_entries,),
+        )
+        logger.debug(f"Evicted {num_entries - self.max_entries} cached predictions")
+
+    def stats(self) -> dict:
+        """Get the hits and misses of this cache instance and the number of cached entries"""
+        (num_entries,) = self.connection.execute(
+            "SELECT COUNT(*) FROM predictions"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": num_entries,
+            "max_entries": self.max_entries,
+        }
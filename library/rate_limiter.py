@@ -0,0 +1,31 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Spaces out requests so that all the threads sharing the limiter together stay within
+    the request budget
+
+    * requests_per_minute: request budget, 0 or None disables the limit
+    """
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60 / requests_per_minute if requests_per_minute else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Wait until the next request is allowed"""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            # Reserve the next slot before sleeping so the other threads queue up behind it
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            logger.debug(f"Rate limited, waiting {wait:.2f}s")
+            time.sleep(wait)
@@ -5,6 +5,8 @@ import requests
 from urllib.parse import urlencode, quote
 from requests import Session, Request
 from urllib3.util import Retry
+from common.constants import RETRY_STATUS_CODES, RETRY_BACKOFF_FACTOR
+from library.run_report import count
 
 logger = logging.getLogger(__name__)
 thread_local = threading.local()
@@ -24,8 +26,13 @@ class RequestsHelper(Session):
         self.timeout = timeout
         super().__init__()
 
-        # Retry settings
-        self.retries = Retry(total=max_retries)
+        # Retry settings, 429 and 503 responses are retried after their Retry-After header
+        self.retries = Retry(
+            total=max_retries,
+            backoff_factor=RETRY_BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUS_CODES,
+            raise_on_status=False,
+        )
         adapter = requests.adapters.HTTPAdapter(max_retries=self.retries)
         self.mount("https://", adapter)
         self.mount("http://", adapter)
@@ -72,9 +79,12 @@ class RequestsHelper(Session):
             )
             prepared_request = self.prepare_request(request)
             response = self.send(prepared_request, timeout=self.timeout)
+            record_response(response)
+            count("http_bytes", len(response.content))
             response.raise_for_status()
         except requests.RequestException as e:
             logger.error(f"{method} request to {url} failed: {e}")
+            count("http_errors")
             return None
 
         if return_type == "json":
@@ -82,6 +92,14 @@ class RequestsHelper(Session):
         return response
 
 
+def record_response(response: requests.Response) -> None:
+    """Count the request and the retries urllib3 made for it in the run report"""
+    count("http_requests")
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        count("http_retries", len(retries.history))
+
+
 def get_local_session(**kwargs) -> RequestsHelper:
     """Get a thread-local Session object with default settings. This will be reused across requests
     to take advantage of connection pooling and (optionally) caching. If used in a multi-threaded
@@ -96,15 +114,21 @@ def get_local_session(**kwargs) -> RequestsHelper:
     return thread_local.session
 
 
-def get_request(url: str, stream: bool) -> requests.Response:
+def get_request(url: str, stream: bool, headers: dict = None) -> requests.Response:
     """Send a GET request to the input URL
 
     Args:
         url: URL to send the GET request to
         stream: Whether to stream the response
+        headers: Headers to send on top of the session headers
 
     Returns:
         The response object
     """
     session = get_local_session()
-    return session.get(url, stream=stream)
+    # A stalled transfer times out instead of hanging, so it can be resumed
+    response = session.get(url, stream=stream, headers=headers, timeout=session.timeout)
+    record_response(response)
+    if not stream:
+        count("http_bytes", len(response.content))
+    return response
@@ -0,0 +1,40 @@
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # resource is not available on Windows
+    resource = None
+
+
+def get_peak_rss_bytes() -> int:
+    """Get the peak resident set size of the current process
+
+    Returns:
+        peak RSS in bytes, None if it cannot be read on this platform
+    """
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return max_rss
+    return max_rss * 1024
+
+
+def get_children_peak_rss_bytes() -> int:
+    """Get the largest peak resident set size of the child processes that were waited for
+
+    Returns:
+        peak RSS in bytes, None if it cannot be read on this platform
+    """
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        return max_rss
+    return max_rss * 1024
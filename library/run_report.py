@@ -0,0 +1,169 @@
+from library.resource_usage import get_peak_rss_bytes
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class RunReport:
+    """Timed spans and counters of one run, collected from every thread of the process and
+    written as one JSON report. A span that runs several times (e.g. one per page) is aggregated
+    under its name.
+
+    Examples:
+
+        >>>  with span("harvest"):
+        >>>     count("observations", len(observations))
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self, run_id: str = None, command: str = None) -> None:
+        """Start collecting the spans and counters of a new run"""
+        with self.lock:
+            self.run_id = run_id
+            self.command = command
+            self.started_at = datetime.now().isoformat(timespec="seconds")
+            self.start_time = time.perf_counter()
+            self.spans = {}
+            self.counters = {}
+            self.error = None
+
+    @contextmanager
+    def span(self, name: str):
+        """Time the enclosed block under the input name"""
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            self.add_span(name, parent, start, end)
+
+    def add_span(self, name: str, parent: str, start: float, end: float) -> None:
+        peak_rss = get_peak_rss_bytes()
+        with self.lock:
+            record = self.spans.get(name)
+            if record is None:
+                record = self.spans[name] = {
+                    "parent": parent,
+                    "count": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "first_start": start - self.start_time,
+                    "last_end": 0.0,
+                    "peak_rss_bytes": None,
+                }
+            record["count"] += 1
+            record["seconds"] += end - start
+            record["max_seconds"] = max(record["max_seconds"], end - start)
+            record["last_end"] = end - self.start_time
+            # The peak RSS of the process when the span ended, it never decreases
+            record["peak_rss_bytes"] = peak_rss
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add the input value to a counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, report: dict, offset: float = 0.0) -> None:
+        """Add the spans and the counters of the report of another process, e.g. a training
+        rank started by the run
+
+        Args:
+            report: report of the other process, from to_dict()
+            offset: seconds between the start of this run and the start of the other report
+        """
+        with self.lock:
+            for name, other in report["spans"].items():
+                record = self.spans.get(name)
+                if record is None:
+                    record = self.spans[name] = {
+                        **other,
+                        "count": 0,
+                        "seconds": 0.0,
+                        "max_seconds": 0.0,
+                        "first_start": other["first_start"] + offset,
+                    }
+                record["count"] += other["count"]
+                record["seconds"] += other["seconds"]
+                record["max_seconds"] = max(record["max_seconds"], other["max_seconds"])
+                record["last_end"] = max(record["last_end"], other["last_end"] + offset)
+                peaks = [
+                    peak
+                    for peak in (record["peak_rss_bytes"], other["peak_rss_bytes"])
+                    if peak is not None
+                ]
+                record["peak_rss_bytes"] = max(peaks, default=None)
+            for name, value in report["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def fail(self, error: Exception) -> None:
+        """Mark the run as failed with the input error"""
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda item: item[1]["first_start"])
+            top_level = [item for item in spans if item[1]["parent"] is None]
+            slowest = max(top_level, key=lambda item: item[1]["seconds"], default=None)
+            return {
+                "run_id": self.run_id,
+                "command": self.command,
+                "started_at": self.started_at,
+                "seconds": time.perf_counter() - self.start_time,
+                "status": "failed" if self.error else "completed",
+                "error": self.error,
+                "peak_rss_bytes": get_peak_rss_bytes(),
+                "slowest_stage": slowest[0] if slowest else None,
+                "spans": {name: dict(record) for name, record in spans},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def write(self, report_path: str) -> None:
+        """Write the report as JSON and log the time spent in every top-level span"""
+        report = self.to_dict()
+        with open(report_path, "w") as file:
+            json.dump(report, file, indent=2)
+
+        stages = " | ".join(
+            f"{name}: {record['seconds']:.2f}s"
+            for name, record in report["spans"].items()
+            if record["parent"] is None
+        )
+        logger.info(
+            f"Run {report['run_id']} {report['status']} in {report['seconds']:.2f}s | {stages}"
+        )
+        logger.info(f"Run report saved to: {report_path}")
+
+
+# One report per process, the commands only run once per process
+run_report = RunReport()
+
+
+def get_run_report() -> RunReport:
+    """Get the report of the current run"""
+    return run_report
+
+
+def span(name: str):
+    """Time the enclosed block in the report of the current run"""
+    return run_report.span(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add the input value to a counter of the report of the current run"""
+    run_report.count(name, value)
@@ -1,14 +1,16 @@
 import os
 import glob
 import torch
+import numpy as np
 import pandas as pd
 from torch.utils.data import Dataset
 from torchvision import transforms
 from PIL import Image
-from common.constants import TAXON_NAME
+from common.constants import DATASET_NAME, TAXON_NAME
 from library.dataset_Loader import DatasetLoader
+from library.dataset_view import scan_dataset_dir
 
-from library.base_io import BaseIO
+from library.run_report import span, count
 
 import logging
 
@@ -16,41 +18,86 @@ logging.getLogger("PIL").setLevel(logging.WARNING)
 
 
 class SpeciesDataset(Dataset):
-    def __init__(self, dataset_dir: str, transform: transforms.Compose = None):
+    def __init__(
+        self,
+        dataset_dir: str,
+        transform: transforms.Compose = None,
+        samples: list[tuple[str, str]] = None,
+    ):
         self.dataset_dir = dataset_dir
         self.transform = transform
         self.image_paths = []
         self.label_names = []
 
+        # Samples selected elsewhere (e.g. from the observation store) replace the directory scan
+        if samples is not None:
+            if not samples:
+                raise ValueError("No samples were selected for the dataset")
+            self.image_paths = [path for path, _ in samples]
+            self.label_names = [label for _, label in samples]
+            self.lables_to_index = DatasetLoader.encode_labels(
+                np.array(sorted(set(self.label_names)))
+            )
+            return
+
+        with span("dataset_scan"):
+            self.scan_dataset(dataset_dir)
+        count("images_scanned", len(self.image_paths))
+
+    def scan_dataset(self, dataset_dir: str) -> None:
+        """List the images of every label directory of the dataset"""
         # Dynamically create the labels from the dataset
         self.lables_to_index = self.generate_labels(dataset_dir, ".csv")
 
-        for label in os.listdir(dataset_dir):
-            label_dir = os.path.join(dataset_dir, label)
-            if BaseIO.is_path_directory(label_dir):
+        # Directories that are not a label in the dataset csv (e.g. caches) are skipped
+        for image_path, label in scan_dataset_dir(dataset_dir, self.lables_to_index):
+            self.image_paths.append(image_path)
+            self.label_names.append(label)
 
-                for image_name in os.listdir(label_dir):
-                    image_path = os.path.join(label_dir, image_name)
-                    self.image_paths.append(image_path)
-                    self.label_names.append(label)
+    @property
+    def class_names(self) -> list[str]:
+        """Get the label names ordered by their class index"""
+        return sorted(
+            self.lables_to_index, key=lambda label: self.lables_to_index[label].argmax()
+        )
 
     def __len__(self):
         return len(self.image_paths)
 
     def __getitem__(self, idx):
         image_path = self.image_paths[idx]
-        label = self.label_names[idx]
-        encoded_label = self.lables_to_index[label].toarray().squeeze()
-        encoded_label = torch.tensor(encoded_label, dtype=torch.float32)
+        encoded_label = self.get_label(idx)
         image = Image.open(image_path).convert("RGB")
 
         if self.transform:
             image = self.transform(image)
         return image, encoded_label
 
+    def get_label(self, idx) -> torch.Tensor:
+        """Get the encoded label of the input sample without loading its image"""
+        label = self.label_names[idx]
+        encoded_label = self.lables_to_index[label].toarray().squeeze()
+        return torch.tensor(encoded_label, dtype=torch.float32)
+
+    def set_class_names(self, class_names: list[str]) -> None:
+        """Encode the labels with the class indices of the input class names, e.g. to keep the
+        class indices of an earlier model. Every label of the dataset must be in class_names
+        """
+        missing = set(self.label_names) - set(class_names)
+        if missing:
+            raise ValueError(f"Labels missing from the class names: {sorted(missing)}")
+        self.lables_to_index = DatasetLoader.encode_labels(
+            np.array(class_names), keep_order=True
+        )
+
+    def get_image_id(self, idx) -> str:
+        """Get the id of the input sample: its path relative to the dataset directory"""
+        return os.path.relpath(self.image_paths[idx], self.dataset_dir)
+
     def generate_labels(self, dataset_dir: str, extension: str) -> dict:
-        """Generate the labels from the dataset directory"""
-        dataset_file = glob.glob(f"{dataset_dir}/*{extension}")
+        """Generate the labels from the dataset file of the dataset directory, other files
+        with the same extension such as sweep results are ignored"""
+        dataset_file = sorted(glob.glob(f"{dataset_dir}/{DATASET_NAME}_*{extension}"))
         if not dataset_file:
             raise FileNotFoundError(f"No dataset file found in {dataset_dir}")
 
@@ -0,0 +1,328 @@
+from common.constants import (
+    UNKNOWN,
+    SPECIES_GUESSES,
+    SPECIES_GUESS_CANONICAL,
+    SPECIES_GUESS_COUNT,
+)
+from library.base_io import BaseIO
+
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Blocks up to this size are compared together as one batch of candidate pairs
+SMALL_BLOCK_SIZE = 32
+# Number of candidate pairs whose similarity is computed at once
+PAIR_CHUNK_SIZE = 500_000
+
+
+class SpeciesGuessNormalizer:
+    """Clusters the free-text species_guess values and maps every guess to a canonical spelling.
+
+    Instead of comparing every pair of guesses, the distinct guesses are split into blocks that share
+    a prefix or a suffix and only guesses in the same block are compared, with the cosine similarity
+    of their character n-gram TF-IDF vectors. Oversized blocks are split further with a longer key,
+    so the work grows near-linearly with the number of distinct guesses.
+
+    * similarity_threshold: minimum cosine similarity for two guesses to be the same species
+    * key_length: number of characters of the prefix / suffix blocking keys
+    * max_block_size: blocks larger than this are split with a longer key
+    * mapping: guess -> canonical mapping from a previous run to extend
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.7,
+        key_length: int = 4,
+        max_block_size: int = 2000,
+        mapping: pd.DataFrame = None,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.key_length = key_length
+        self.max_block_size = max_block_size
+        self.mapping = (
+            mapping
+            if mapping is not None
+            else pd.DataFrame(
+                columns=[SPECIES_GUESSES, SPECIES_GUESS_CANONICAL, SPECIES_GUESS_COUNT]
+            )
+        )
+
+    @staticmethod
+    def load_mapping(mapping_path: str) -> pd.DataFrame:
+        """Load the guess -> canonical mapping table written by a previous run
+
+        Args:
+            mapping_path: path to the mapping csv
+
+        Returns:
+            the mapping table, None if it does not exist yet
+        """
+        if not BaseIO.is_path_file(mapping_path):
+            return None
+        mapping = pd.read_csv(mapping_path, keep_default_na=False)
+        logger.info(f"Loaded {len(mapping)} species guess mappings from {mapping_path}")
+        return mapping
+
+    def save_mapping(self, mapping_path: str) -> None:
+        """Save the guess -> canonical mapping table so later runs can reuse it
+
+        Args:
+            mapping_path: path to the mapping csv
+        """
+        self.mapping.to_csv(mapping_path, index=False)
+        logger.info(
+            f"Saved {len(self.mapping)} species guess mappings to {mapping_path}"
+        )
+
+    @staticmethod
+    def clean_guess(guess: str) -> str:
+        """Strip everything but letters and single spaces, used for the blocking keys"""
+        return re.sub(r"\s+", " ", re.sub(r"[^a-z ]", " ", guess)).strip()
+
+    def fit(self, guesses: pd.Series) -> pd.DataFrame:
+        """Extend the mapping with the input guesses. Guesses already in the mapping keep their
+        canonical value and the known canonical values anchor the clusters of the new guesses
+
+        Args:
+            guesses: normalized species_guess values, one per observation
+
+        Returns:
+            the updated mapping table
+        """
+        counts = guesses.value_counts()
+        known = self.mapping.set_index(SPECIES_GUESSES)
+        new_guesses = counts.index.difference(known.index).difference([UNKNOWN])
+
+        # Carry over the counts of the guesses that are already mapped
+        known_counts = known[SPECIES_GUESS_COUNT].astype(np.int64)
+        known_counts = known_counts.add(
+            counts.reindex(known.index, fill_value=0), fill_value=0
+        )
+
+        if len(new_guesses) == 0:
+            self.mapping = known.assign(**{SPECIES_GUESS_COUNT: known_counts})
+            self.mapping = self.mapping.reset_index()
+            return self.mapping
+
+        # The known canonical values take part in the clustering so new variants join them
+        anchors = pd.Index(known[SPECIES_GUESS_CANONICAL].unique()).difference(
+            new_guesses
+        )
+        texts = new_guesses.append(anchors)
+        is_anchor = np.zeros(len(texts), dtype=bool)
+        is_anchor[len(new_guesses) :] = True
+        text_counts = np.concatenate(
+            [
+                counts.reindex(new_guesses).to_numpy(),
+                np.zeros(len(anchors), dtype=np.int64),
+            ]
+        )
+
+        labels = self.cluster(texts.to_numpy(dtype=str))
+        canonical = self.pick_canonical(texts, labels, text_counts, is_anchor)
+
+        new_mapping = pd.DataFrame(
+            {
+                SPECIES_GUESSES: new_guesses,
+                SPECIES_GUESS_CANONICAL: canonical[: len(new_guesses)],
+                SPECIES_GUESS_COUNT: text_counts[: len(new_guesses)],
+            }
+        )
+        known_mapping = known.assign(**{SPECIES_GUESS_COUNT: known_counts})
+        self.mapping = pd.concat(
+            [known_mapping.reset_index(), new_mapping], ignore_index=True
+        )
+        logger.info(
+            f"Mapped {len(new_guesses)} new species guesses to {len(set(canonical[: len(new_guesses)]))} canonical values"
+        )
+        return self.mapping
+
+    def transform(self, guesses: pd.Series) -> pd.Series:
+        """Map the input guesses to their canonical values, unmapped guesses are kept as they are"""
+        lookup = self.mapping.set_index(SPECIES_GUESSES)[SPECIES_GUESS_CANONICAL]
+        return guesses.map(lookup).fillna(guesses)
+
+    def cluster(self, texts: np.ndarray) -> np.ndarray:
+        """Cluster the input distinct texts
+
+        Args:
+            texts: distinct guesses to cluster
+
+        Returns:
+            cluster label of every text
+        """
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        # Rows are L2 normalized, so the dot product of two rows is their cosine similarity
+        vectors = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 3)).fit_transform(
+            texts
+        )
+        cleaned = [self.clean_guess(text) for text in texts]
+
+        # Most blocks only hold a few guesses, comparing them one block at a time is dominated by
+        # the per-call overhead, so their pairs are enumerated and scored together
+        sources, targets = [], []
+        small_blocks = []
+        for key_function in (self.prefix_key, self.suffix_key):
+            for block in self.blocks(cleaned, key_function, self.key_length):
+                if len(block) <= SMALL_BLOCK_SIZE:
+                    small_blocks.append(block)
+                    continue
+                block_sources, block_targets = self.similar_pairs(vectors, block)
+                sources.append(block_sources)
+                targets.append(block_targets)
+
+        block_sources, block_targets = self.candidate_pairs(small_blocks)
+        block_sources, block_targets = self.similar_candidate_pairs(
+            vectors, block_sources, block_targets
+        )
+        sources.append(block_sources)
+        targets.append(block_targets)
+
+        sources = np.concatenate(sources)
+        targets = np.concatenate(targets)
+        graph = coo_matrix(
+            (np.ones(len(sources), dtype=np.int8), (sources, targets)),
+            shape=(len(texts), len(texts)),
+        )
+        num_clusters, labels = connected_components(graph, directed=False)
+        logger.debug(f"Clustered {len(texts)} guesses into {num_clusters} clusters")
+        return labels
+
+    @staticmethod
+    def prefix_key(text: str, length: int) -> str:
+        return text[:length]
+
+    @staticmethod
+    def suffix_key(text: str, length: int) -> str:
+        return text[-length:]
+
+    def blocks(self, cleaned: list[str], key_function, key_length: int, indices=None):
+        """Yield the indices of the texts sharing a blocking key. Blocks larger than
+        max_block_size are split again with a longer key until they fit
+
+        Args:
+            cleaned: cleaned texts used to compute the keys
+            key_function: function of (text, length) returning the blocking key
+            key_length: length of the key
+            indices: indices of the texts to block, all of them if None
+        """
+        if indices is None:
+            indices = np.arange(len(cleaned))
+
+        keys = pd.Series(
+            [key_function(cleaned[index], key_length) for index in indices]
+        )
+        for _, positions in keys.groupby(keys).indices.items():
+            block = indices[positions]
+            if len(block) < 2:
+                continue
+            longest = max(len(cleaned[index]) for index in block)
+            if len(block) > self.max_block_size and key_length < longest:
+                yield from self.blocks(cleaned, key_function, key_length + 2, block)
+            else:
+                yield block
+
+    @staticmethod
+    def candidate_pairs(blocks: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+        """Enumerate every pair of texts within the same block, blocks of equal size are
+        stacked so their pairs are generated in one step
+
+        Args:
+            blocks: indices of the texts in every block
+
+        Returns:
+            source and target indices of the candidate pairs
+        """
+        sources = [np.empty(0, dtype=np.int64)]
+        targets = [np.empty(0, dtype=np.int64)]
+        blocks_by_size = {}
+        for block in blocks:
+            blocks_by_size.setdefault(len(block), []).append(block)
+
+        for size, same_size_blocks in blocks_by_size.items():
+            stacked = np.stack(same_size_blocks)
+            rows, columns = np.triu_indices(size, k=1)
+            sources.append(stacked[:, rows].ravel())
+            targets.append(stacked[:, columns].ravel())
+        return np.concatenate(sources), np.concatenate(targets)
+
+    def similar_candidate_pairs(
+        self, vectors, sources: np.ndarray, targets: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Keep the candidate pairs that are similar enough to be merged
+
+        Args:
+            vectors: TF-IDF vectors of all the texts
+            sources: source indices of the candidate pairs
+            targets: target indices of the candidate pairs
+
+        Returns:
+            source and target indices of the similar pairs
+        """
+        keep = np.zeros(len(sources), dtype=bool)
+        for start in range(0, len(sources), PAIR_CHUNK_SIZE):
+            end = start + PAIR_CHUNK_SIZE
+            similarity = (
+                vectors[sources[start:end]].multiply(vectors[targets[start:end]]).sum(1)
+            )
+            keep[start:end] = (
+                np.asarray(similarity).ravel() >= self.similarity_threshold
+            )
+        return sources[keep], targets[keep]
+
+    def similar_pairs(
+        self, vectors, block: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Get the pairs of texts in the block that are similar enough to be merged.
+        Large blocks are compared in row chunks to bound the memory of the similarity matrix
+
+        Args:
+            vectors: TF-IDF vectors of all the texts
+            block: indices of the texts in the block
+
+        Returns:
+            source and target indices of the similar pairs
+        """
+        block_vectors = vectors[block]
+        sources, targets = [], []
+        for start in range(0, len(block), self.max_block_size):
+            similarity = (
+                block_vectors[start : start + self.max_block_size] @ block_vectors.T
+            ).tocoo()
+            keep = similarity.data >= self.similarity_threshold
+            sources.append(block[similarity.row[keep] + start])
+            targets.append(block[similarity.col[keep]])
+        return np.concatenate(sources), np.concatenate(targets)
+
+    @staticmethod
+    def pick_canonical(
+        texts: pd.Index, labels: np.ndarray, counts: np.ndarray, is_anchor: np.ndarray
+    ) -> np.ndarray:
+        """Pick the canonical value of every cluster: a known canonical value if the cluster has one,
+        otherwise its most frequent guess, the shortest one on ties
+
+        Returns:
+            canonical value of every text
+        """
+        clusters = pd.DataFrame(
+            {
+                "text": texts.to_numpy(dtype=str),
+                "label": labels,
+                "anchor": is_anchor,
+                "count": counts,
+                "length": texts.str.len(),
+            }
+        )
+        ranked = clusters.sort_values(
+            ["label", "anchor", "count", "length", "text"],
+            ascending=[True, False, False, True, True],
+        )
+        canonical = ranked.drop_duplicates("label").set_index("label")["text"]
+        return canonical.reindex(labels).to_numpy()
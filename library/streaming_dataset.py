@@ -0,0 +1,159 @@
+import logging
+import tempfile
+import threading
+import zlib
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+logger = logging.getLogger(__name__)
+
+# Number of images the storage file holds before it is first grown
+INITIAL_CAPACITY = 1024
+
+
+class StreamingDataset(Dataset):
+    """Dataset that grows while it is being trained on. Producer threads append preprocessed
+    images and the trainer reads a snapshot of the samples that arrived so far.
+
+    Class indices follow the order in which the labels are first seen, so they never change
+    once assigned. Every image is assigned to the validation split from a hash of its id, so the
+    split stays the same as the dataset grows.
+
+    The uint8 images are written to a memory-mapped temporary file that doubles in size when it
+    is full, so the decoded images are paged from disk instead of all being held in memory.
+
+    * val_fraction: fraction of the images kept for validation
+    * storage_dir: directory of the temporary image file, the system temp directory by default
+    """
+
+    def __init__(self, val_fraction: float = 0.25, storage_dir: str = None):
+        if not 0.0 <= val_fraction < 1.0:
+            raise ValueError(
+                f"Validation fraction must be in [0, 1), got: {val_fraction}"
+            )
+
+        self.val_fraction = val_fraction
+        self.storage_dir = storage_dir
+        # Created on the first append, once the image shape is known
+        self.storage = None
+        self.images = None
+        self.num_images = 0
+        self.targets = []
+        self.image_ids = []
+        self.class_names = []
+        self.class_index = {}
+        self.train_indices = []
+        self.val_indices = []
+        self.finished = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    @property
+    def num_classes(self) -> int:
+        return len(self.class_names)
+
+    def __len__(self):
+        return self.num_images
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self.num_images:
+            raise IndexError(f"Index {idx} out of range for {self.num_images} images")
+        return torch.from_numpy(np.array(self.images[idx])), self.targets[idx]
+
+    def add_class(self, label: str) -> int:
+        """Get the class index of the input label, assigning the next index to new labels"""
+        with self.condition:
+            if label not in self.class_index:
+                self.class_index[label] = len(self.class_names)
+                self.class_names.append(label)
+                logger.debug(f"New class {self.class_index[label]}: {label}")
+            return self.class_index[label]
+
+    def append(self, image: torch.Tensor, label: str, image_id: str) -> None:
+        """Add a preprocessed image and wake up the readers waiting for samples
+
+        Args:
+            image: preprocessed uint8 image tensor, every image has the same shape
+            label: label name of the image
+            image_id: unique id of the image, decides its split
+        """
+        target = self.add_class(label)
+        with self.condition:
+            index = self.num_images
+            self.reserve(index + 1, tuple(image.shape))
+            self.images[index] = image.numpy()
+            self.num_images += 1
+            self.targets.append(target)
+            self.image_ids.append(image_id)
+            if self.is_validation(image_id):
+                self.val_indices.append(index)
+            else:
+                self.train_indices.append(index)
+            self.condition.notify_all()
+
+    def reserve(self, num_images: int, image_shape: tuple) -> None:
+        """Grow the storage file until it holds num_images images. Readers keep the previous
+        mapping of the file, which still holds every image appended before the growth"""
+        if self.images is not None and self.images.shape[0] >= num_images:
+            if self.images.shape[1:] != image_shape:
+                raise ValueError(
+                    f"Images must have the shape {self.images.shape[1:]}, got: {image_shape}"
+                )
+            return
+        if self.storage is None:
+            self.storage = tempfile.TemporaryFile(dir=self.storage_dir)
+            capacity = INITIAL_CAPACITY
+        else:
+            self.images.flush()
+            capacity = 2 * self.images.shape[0]
+        capacity = max(capacity, num_images)
+        logger.debug(f"Growing the image storage to {capacity} images")
+        self.images = np.memmap(
+            self.storage, dtype=np.uint8, mode="r+", shape=(capacity, *image_shape)
+        )
+
+    def close(self) -> None:
+        """Delete the temporary image file, the dataset can not be read afterwards"""
+        with self.condition:
+            self.images = None
+            if self.storage is not None:
+                self.storage.close()
+                self.storage = None
+
+    def is_validation(self, image_id: str) -> bool:
+        """Check if the input image belongs to the validation split"""
+        return zlib.crc32(image_id.encode()) % 1000 < self.val_fraction * 1000
+
+    def finish(self, error: Exception = None) -> None:
+        """Mark the dataset as complete, no more samples will be appended
+
+        Args:
+            error: error that stopped the producers early, raised to the readers
+        """
+        with self.condition:
+            self.finished = True
+            self.error = error
+            self.condition.notify_all()
+
+    def wait_for_samples(self, num_samples: int) -> int:
+        """Block until the dataset holds at least num_samples samples or is complete
+
+        Args:
+            num_samples: number of samples to wait for
+
+        Returns:
+            number of samples in the dataset
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.num_images >= num_samples or self.finished
+            )
+            if self.error is not None:
+                raise self.error
+            return self.num_images
+
+    def split(self) -> tuple[list[int], list[int]]:
+        """Get a snapshot of the train and validation indices of the samples so far"""
+        with self.condition:
+            return list(self.train_indices), list(self.val_indices)
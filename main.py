@@ -5,16 +5,15 @@ This is the main runner with argument options. It will allow us to run the diffe
 
 import logging
 import argparse
-from datetime import datetime
+import importlib
 import os
+from datetime import datetime
 
-from common.constants import DATASET_NAME, OUTPUT_NAME, MODEL_NAME
+from common.constants import DEFAULT_MASTER_ADDR, DEFAULT_MASTER_PORT, REPORT_NAME
 from common.command import Command, validate_command, string_to_command
 from common.config import ConfigHelper
 from library.base_io import BaseIO
-from controller.project_controller import ProjectController
-from controller.observation_controller import ObservationController
-from model.trainer import ModelTrainer
+from library.run_report import get_run_report
 
 
 def run_application(args: str) -> None:
@@ -27,53 +26,23 @@ def run_application(args: str) -> None:
     logging.debug(f"Config: {config}")
     run_id = get_run_id(args.run_id)
 
-    match (command):
-        case Command.DOWNLOAD:
-            # Get the project ID from the config name
-            projectController = ProjectController()
-            project_id = projectController.get_project_id_by_name(config.project_name)
-
-            logging.debug(f"Found the following project id {project_id}")
-
-            run_dir = os.path.join(args.dataset_path, run_id)
-            if not BaseIO.path_exists(run_dir):
-                BaseIO.create_directory(run_dir)
-
-            file_name = f"{DATASET_NAME}_{run_id}.csv"
-            dataset_path = os.path.join(run_dir, file_name)
-            observationController = ObservationController()
-
-            # Download the dataset if it does not exist
-            if not BaseIO.is_path_file(dataset_path):
-                logging.info(f"Downloading dataset to: {dataset_path}")
-                observationController.save_observations_as_dataset(
-                    project_id,
-                    dataset_path,
-                    run_id=str(args.run_id) if args.run_id else None,
-                )
-            else:
-                logging.info(
-                    f"Dataset already exists at: {dataset_path} for run: {run_id}"
-                )
-
-            # Create the dataset
-            logging.debug(f"Creating dataset from: {dataset_path}")
-            observationController.download_dataset(dataset_path, run_dir)
-            logging.info(f"Created the dataset at: {dataset_path}")
-
-        case Command.TRAIN:
-            logging.info(f"Training model on dataset: {args.predict_path}")
-
-            output_file = os.path.join(args.predict_path, f"{OUTPUT_NAME}_{run_id}.txt")
-            output_model = os.path.join(args.predict_path, f"{MODEL_NAME}_{run_id}.pt")
-            logging.debug(f"Output file: {output_file} | Output model: {output_model}")
-
-            trainer = ModelTrainer(output_model, args.predict_path, output_file)
-
-        case Command.PREDICT:
-            logging.info(f"Predicting dataset: {args.predict_path}")
-        case _:
-            logging.error(f"Command not found: {args.command}")
+    # Every command lives in its own module under commands/ and is only imported when it runs,
+    # so a command never pays for the imports (torch, pandas, ...) of the other commands
+    # Every run writes a report of the time spent in every stage and of its counters
+    report = get_run_report()
+    report.reset(run_id, command.value)
+    try:
+        command_module = importlib.import_module(f"commands.{command.value}")
+        command_module.run(args, config, run_id)
+    except Exception as e:
+        report.fail(e)
+        raise
+    finally:
+        report.write(
+            os.path.join(
+                get_operating_path(args, command), f"{REPORT_NAME}_{run_id}.json"
+            )
+        )
 
 
 def validate_args(args: argparse.Namespace) -> bool:
@@ -92,9 +61,7 @@ def validate_args(args: argparse.Namespace) -> bool:
         logging.error(f"Command: {args.command} is not valid")
         return False
 
-    operating_path = (
-        args.dataset_path if command == Command.DOWNLOAD else args.predict_path
-    )
+    operating_path = get_operating_path(args, command)
 
     if not BaseIO.is_path_directory(operating_path):
         logging.debug(f"Input path {operating_path} is not valid. Creating it...")
@@ -103,6 +70,13 @@ def validate_args(args: argparse.Namespace) -> bool:
     return True
 
 
+def get_operating_path(args: argparse.Namespace, command: Command) -> str:
+    """Get the directory the command works in"""
+    if command in (Command.DOWNLOAD, Command.PIPELINE):
+        return args.dataset_path
+    return args.predict_path
+
+
 def get_run_id(run_id: str) -> str:
     """Get the run ID from the arguments or generate a new one"""
     id = run_id if run_id else datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -129,7 +103,7 @@ if __name__ == "__main__":
     subparsers = parser.add_subparsers(
         dest="command",
         required=True,
-        help="Command to run. Options are: download, predict",
+        help="Command to run. Options are: download, train, predict, pipeline, sweep, view, distill",
     )
 
     # Subparser for the download command
@@ -142,6 +116,12 @@ if __name__ == "__main__":
         help="Path to save the downloaded dataset",
         required=True,
     )
+    download_parser.add_argument(
+        "--max_projects",
+        type=int,
+        default=None,
+        help="Number of projects harvested at once, all the configured projects by default",
+    )
 
     # Subparser for the classify command
     classify_parser = subparsers.add_parser(
@@ -150,6 +130,34 @@ if __name__ == "__main__":
     classify_parser.add_argument(
         "-p", "--predict_path", help="Path to the dataset to predict", required=True
     )
+    classify_parser.add_argument(
+        "--model_path",
+        required=True,
+        help="Training checkpoint or serving artifact (e.g. a distilled student) to predict with",
+    )
+    classify_parser.add_argument(
+        "--top_k", type=int, default=5, help="Number of species returned per image"
+    )
+    classify_parser.add_argument(
+        "--batch_size", type=int, default=64, help="Number of images classified at once"
+    )
+    classify_parser.add_argument(
+        "--cache",
+        default=True,
+        help="Reuse the predictions of images the same model already classified",
+        action=argparse.BooleanOptionalAction,
+    )
+    classify_parser.add_argument(
+        "--cache_path",
+        default=None,
+        help="Prediction cache to use, .prediction_cache.db in the predict path by default",
+    )
+    classify_parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=100_000,
+        help="Number of cached predictions, the least recently used ones are evicted",
+    )
 
     # Subparser for the train command
     train_parser = subparsers.add_parser(
@@ -158,6 +166,354 @@ if __name__ == "__main__":
     train_parser.add_argument(
         "-p", "--predict_path", help="Path to the dataset to predict", required=True
     )
+    train_parser.add_argument(
+        "--num_epochs", type=int, default=20, help="Maximum number of epochs to train"
+    )
+    train_parser.add_argument(
+        "--patience",
+        type=int,
+        default=5,
+        help="Stop after this many epochs without a validation improvement",
+    )
+    train_parser.add_argument(
+        "--min_delta",
+        type=float,
+        default=0.0,
+        help="Minimum decrease of the validation loss that counts as an improvement",
+    )
+    train_parser.add_argument(
+        "--val_subsample",
+        type=float,
+        default=None,
+        help="Fraction of the validation split to evaluate after every epoch",
+    )
+    train_parser.add_argument(
+        "--metrics",
+        default=False,
+        help="Write per-step timings and per-epoch throughput to metrics_<run_id>.jsonl",
+        action=argparse.BooleanOptionalAction,
+    )
+    train_parser.add_argument(
+        "--profile_steps",
+        type=int,
+        nargs=2,
+        metavar=("START", "END"),
+        default=None,
+        help="Capture the training steps in [START, END) with torch.profiler to trace_<run_id>.json",
+    )
+    train_parser.add_argument(
+        "--head_only",
+        default=False,
+        help="Train only the fully connected head on cached backbone embeddings",
+        action=argparse.BooleanOptionalAction,
+    )
+    train_parser.add_argument(
+        "--backbone_path",
+        default=None,
+        help="Checkpoint to take the frozen backbone weights from in --head_only mode",
+    )
+    train_parser.add_argument(
+        "--store_path",
+        default=None,
+        help="Observation store to select the training photos from instead of the predict path",
+    )
+    train_parser.add_argument(
+        "--store_query",
+        default=None,
+        help="SQL condition on the observations of the store, e.g. \"quality_grade = 'research'\"",
+    )
+    train_parser.add_argument(
+        "--min_class_photos",
+        type=int,
+        default=None,
+        help="Drop the species with fewer selected photos from the store",
+    )
+    train_parser.add_argument(
+        "--view_path",
+        default=None,
+        help="Dataset view manifest to train on, with its train/val split, see the view command",
+    )
+    train_parser.add_argument(
+        "--incremental",
+        default=False,
+        help="Fine-tune a base model on the images it has not seen, adding the new species to its head",
+        action=argparse.BooleanOptionalAction,
+    )
+    train_parser.add_argument(
+        "--base_model",
+        default=None,
+        help="Checkpoint to continue from with --incremental, it needs its .labels.json sidecar",
+    )
+    train_parser.add_argument(
+        "--replay_fraction",
+        type=float,
+        default=0.1,
+        help="Fraction of the images the base model has seen that --incremental trains on again",
+    )
+    train_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=512,
+        help="Number of images per optimizer step, across all the processes",
+    )
+    train_parser.add_argument(
+        "--micro_batch_size",
+        type=int,
+        default=None,
+        help="Number of images per forward and backward pass, the gradients are accumulated up to the batch size",
+    )
+    train_parser.add_argument(
+        "--auto_batch_size",
+        default=False,
+        help="Probe the largest micro-batch size that fits in the memory budget",
+        action=argparse.BooleanOptionalAction,
+    )
+    train_parser.add_argument(
+        "--memory_budget_mb",
+        type=float,
+        default=None,
+        help="Memory a process may use with --auto_batch_size, by default 80%% of the free memory split between the --nproc_per_node processes",
+    )
+    train_parser.add_argument(
+        "--progressive_resizing",
+        nargs="*",
+        metavar="SIZE:EPOCHS",
+        default=None,
+        help="Train the first epochs on downscaled images with larger batches, e.g. 64:4 96:3. Without phases 40%% of the epochs run at 64, 30%% at 96 and the rest at 128",
+    )
+    train_parser.add_argument(
+        "--nproc_per_node",
+        type=int,
+        default=1,
+        help="Number of data-parallel training processes to start on this node",
+    )
+    train_parser.add_argument(
+        "--nnodes", type=int, default=1, help="Number of nodes taking part in training"
+    )
+    train_parser.add_argument(
+        "--node_rank", type=int, default=0, help="Rank of this node, 0 to nnodes - 1"
+    )
+    train_parser.add_argument(
+        "--master_addr",
+        default=DEFAULT_MASTER_ADDR,
+        help="Address of the node with node_rank 0",
+    )
+    train_parser.add_argument(
+        "--master_port",
+        type=int,
+        default=DEFAULT_MASTER_PORT,
+        help="Free port on the node with node_rank 0",
+    )
+
+    # Subparser for the pipeline command
+    pipeline_parser = subparsers.add_parser(
+        str(Command.PIPELINE.value).lower(),
+        help="Download a dataset and train a model on it while the photos stream in",
+    )
+    pipeline_parser.add_argument(
+        "-d",
+        "--dataset_path",
+        help="Path to save the downloaded dataset and the model",
+        required=True,
+    )
+    pipeline_parser.add_argument(
+        "--num_epochs",
+        type=int,
+        default=20,
+        help="Maximum number of epochs to train once every photo is downloaded",
+    )
+    pipeline_parser.add_argument(
+        "--patience",
+        type=int,
+        default=5,
+        help="Stop after this many epochs without a validation improvement",
+    )
+    pipeline_parser.add_argument(
+        "--min_delta",
+        type=float,
+        default=0.0,
+        help="Minimum decrease of the validation loss that counts as an improvement",
+    )
+    pipeline_parser.add_argument(
+        "--min_samples",
+        type=int,
+        default=512,
+        help="Number of photos to wait for before training starts",
+    )
+    pipeline_parser.add_argument(
+        "--download_workers",
+        type=int,
+        default=8,
+        help="Number of photo download threads",
+    )
+    pipeline_parser.add_argument(
+        "--preprocess_workers",
+        type=int,
+        default=2,
+        help="Number of photo decode and resize threads",
+    )
+    pipeline_parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=256,
+        help="Capacity of the queues between the download, preprocess and train stages",
+    )
+
+    # Subparser for the sweep command
+    sweep_parser = subparsers.add_parser(
+        str(Command.SWEEP.value).lower(),
+        help="Train many hyperparameter configurations of a dataset in parallel",
+    )
+    sweep_parser.add_argument(
+        "-p", "--predict_path", help="Path to the dataset to train on", required=True
+    )
+    sweep_parser.add_argument(
+        "--search_space",
+        required=True,
+        help='JSON file mapping ModelTrainer arguments to values, e.g. {"learning_rate": [0.01, 0.001]}',
+    )
+    sweep_parser.add_argument(
+        "--strategy",
+        choices=["grid", "random"],
+        default="grid",
+        help="Try every combination or sample --num_trials configurations",
+    )
+    sweep_parser.add_argument(
+        "--num_trials",
+        type=int,
+        default=10,
+        help="Number of configurations to sample with --strategy random",
+    )
+    sweep_parser.add_argument(
+        "--seed", type=int, default=42, help="Seed for the random configurations"
+    )
+    sweep_parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=None,
+        help="Number of trials running at once, one per core by default",
+    )
+    sweep_parser.add_argument(
+        "--threads_per_trial",
+        type=int,
+        default=None,
+        help="Torch threads of every trial, the cores divided by --max_workers by default",
+    )
+    sweep_parser.add_argument(
+        "--prune",
+        default=True,
+        help="Stop trials whose validation loss is worse than the median of the other trials",
+        action=argparse.BooleanOptionalAction,
+    )
+    sweep_parser.add_argument(
+        "--min_trials",
+        type=int,
+        default=3,
+        help="Number of trials that must have reached an epoch before pruning at that epoch",
+    )
+    sweep_parser.add_argument(
+        "--warmup_epochs",
+        type=int,
+        default=1,
+        help="Number of epochs every trial runs before it can be pruned",
+    )
+
+    # Subparser for the view command
+    view_parser = subparsers.add_parser(
+        str(Command.VIEW.value).lower(),
+        help="Build a class-filtered and balanced subset of a dataset without copying it",
+    )
+    view_parser.add_argument(
+        "-p",
+        "--predict_path",
+        help="Path to the dataset to take the view of",
+        required=True,
+    )
+    view_parser.add_argument(
+        "--classes", nargs="+", default=None, help="Only keep these species"
+    )
+    view_parser.add_argument(
+        "--top_classes",
+        type=int,
+        default=None,
+        help="Only keep the species with the most images",
+    )
+    view_parser.add_argument(
+        "--min_per_class",
+        type=int,
+        default=None,
+        help="Drop the species with fewer images",
+    )
+    view_parser.add_argument(
+        "--max_per_class",
+        type=int,
+        default=None,
+        help="Keep at most this many images of every species",
+    )
+    view_parser.add_argument(
+        "--val_fraction",
+        type=float,
+        default=0.25,
+        help="Fraction of the images of every species in the validation split",
+    )
+    view_parser.add_argument(
+        "--seed", type=int, default=42, help="Seed for the sampling and the split"
+    )
+    view_parser.add_argument(
+        "--store_path",
+        default=None,
+        help="Observation store to take the images from instead of the predict path",
+    )
+    view_parser.add_argument(
+        "--store_query",
+        default=None,
+        help="SQL condition on the observations of the store",
+    )
+
+    # Subparser for the distill command
+    distill_parser = subparsers.add_parser(
+        str(Command.DISTILL.value).lower(),
+        help="Train a compact student model against a trained teacher model",
+    )
+    distill_parser.add_argument(
+        "-p", "--predict_path", help="Path to the dataset to train on", required=True
+    )
+    distill_parser.add_argument(
+        "--teacher_path", required=True, help="Checkpoint of the trained teacher model"
+    )
+    distill_parser.add_argument(
+        "--num_epochs", type=int, default=20, help="Maximum number of epochs to train"
+    )
+    distill_parser.add_argument(
+        "--temperature",
+        type=float,
+        default=4.0,
+        help="Softening temperature of the teacher and student outputs",
+    )
+    distill_parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.7,
+        help="Weight of the teacher loss, the rest goes to the label loss",
+    )
+    distill_parser.add_argument(
+        "--width",
+        type=int,
+        default=16,
+        help="Channels of the first convolution of the student",
+    )
+    distill_parser.add_argument(
+        "--patience",
+        type=int,
+        default=5,
+        help="Number of epochs without validation improvement before stopping",
+    )
+    distill_parser.add_argument(
+        "--min_delta",
+        type=float,
+        default=0.0,
+        help="Minimum decrease of the validation loss that counts as an improvement",
+    )
 
     args = parser.parse_args()
     if args.verbose:
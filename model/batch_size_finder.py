@@ -0,0 +1,223 @@
+import logging
+import os
+import threading
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the free memory used when no memory budget is passed in
+DEFAULT_MEMORY_FRACTION = 0.8
+# Interval of the resident set size sampling while a CPU probe runs
+RSS_SAMPLE_INTERVAL = 0.001
+# Number of binary search steps between the largest fitting and the smallest failing batch size
+SEARCH_STEPS = 3
+
+
+def get_rss_bytes() -> int:
+    """Get the current resident set size of the process
+
+    Returns:
+        RSS in bytes, None if it cannot be read on this platform
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_available_memory_bytes() -> int:
+    """Get the memory the system can still give to the process without swapping
+
+    Returns:
+        available memory in bytes, None if it cannot be read on this platform
+    """
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class PeakRSSSampler:
+    """Samples the resident set size of the process in a background thread, the peak RSS of
+    the process can not be reset between two probes
+
+    Examples:
+
+        >>> with PeakRSSSampler() as sampler:
+        >>>     model(inputs).sum().backward()
+        >>> sampler.peak
+    """
+
+    def __init__(self):
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self) -> None:
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, get_rss_bytes() or 0)
+            self.stopped.wait(RSS_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.peak = get_rss_bytes() or 0
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, get_rss_bytes() or 0)
+
+
+class BatchSizeFinder:
+    """Finds the largest batch that one forward and backward pass of a model can run on
+    within a memory budget. The batch size is doubled until a probe exceeds the budget or
+    runs out of memory, then refined with a binary search.
+
+    On CUDA the peak allocated memory of the device is measured, on the CPU the peak resident
+    set size of the process, which also holds the dataset, the model and everything else.
+
+    * model: model to probe, its weights and random state are left untouched
+    * criterion: loss of the model outputs
+    * sample_input: one input sample, without the batch dimension
+    * num_classes: number of classes of the labels
+    * device: device the model runs on
+    * memory_budget_mb: memory the training step of this process may use. By default 80% of
+      the free memory, split evenly between the local processes
+    * reserved_bytes: memory allocated later in the budget, e.g. the optimizer state
+    * num_local_processes: number of training processes sharing the memory of this node
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        criterion: nn.Module,
+        sample_input: torch.Tensor,
+        num_classes: int,
+        device: torch.device,
+        memory_budget_mb: float = None,
+        reserved_bytes: int = 0,
+        num_local_processes: int = 1,
+    ):
+        self.model = model
+        self.criterion = criterion
+        self.sample_input = sample_input
+        self.num_classes = num_classes
+        self.device = device
+        self.reserved_bytes = reserved_bytes
+        self.num_local_processes = max(1, num_local_processes)
+        self.budget_bytes = self.get_budget_bytes(memory_budget_mb)
+
+    def get_budget_bytes(self, memory_budget_mb: float) -> int:
+        """Get the memory budget in bytes, None if it can not be measured on this device"""
+        if memory_budget_mb is not None:
+            if memory_budget_mb <= 0:
+                raise ValueError(
+                    f"Memory budget must be > 0 MB, got: {memory_budget_mb}"
+                )
+            return int(memory_budget_mb * 1024 * 1024)
+
+        if self.device.type == "cuda":
+            free, _ = torch.cuda.mem_get_info(self.device)
+            used = torch.cuda.memory_allocated(self.device)
+            return int(
+                DEFAULT_MEMORY_FRACTION * (free + used) / self.num_local_processes
+            )
+
+        available, rss = get_available_memory_bytes(), get_rss_bytes()
+        if available is None or rss is None:
+            return None
+        # Every local process gets its share of the free memory on top of what it already holds
+        return int(DEFAULT_MEMORY_FRACTION * available / self.num_local_processes) + rss
+
+    def find(self, max_batch_size: int) -> int:
+        """Get the largest batch size up to max_batch_size that fits in the memory budget
+
+        Args:
+            max_batch_size: batch size to stop probing at
+
+        Returns:
+            the largest fitting batch size, at least 1. max_batch_size when the memory can not
+            be measured on this device
+        """
+        if self.budget_bytes is None:
+            logger.warning(
+                "Can not measure the memory of this device, training without gradient accumulation"
+            )
+            return max_batch_size
+
+        # Dropout draws from the global generator, the probes must not shift the shuffling
+        rng_state = torch.random.get_rng_state()
+        was_training = self.model.training
+        self.model.train()
+        try:
+            fitting, failing = 0, None
+            batch_size = 1
+            while fitting < max_batch_size:
+                if not self.fits(batch_size):
+                    failing = batch_size
+                    break
+                fitting = batch_size
+                batch_size = min(batch_size * 2, max_batch_size)
+
+            for _ in range(SEARCH_STEPS):
+                if failing is None or failing - fitting <= 1:
+                    break
+                batch_size = (fitting + failing) // 2
+                if self.fits(batch_size):
+                    fitting = batch_size
+                else:
+                    failing = batch_size
+        finally:
+            self.model.train(was_training)
+            torch.random.set_rng_state(rng_state)
+
+        if fitting == 0:
+            logger.warning(
+                f"Not even a batch of 1 fits in the memory budget of {self.budget_bytes / 2**20:.0f} MB"
+            )
+        return max(1, fitting)
+
+    def fits(self, batch_size: int) -> bool:
+        """Run one forward and backward pass on a random batch and check its peak memory"""
+        try:
+            peak_bytes = self.probe(batch_size)
+        except torch.cuda.OutOfMemoryError:
+            peak_bytes = None
+        except RuntimeError as e:
+            if "out of memory" not in str(e):
+                raise
+            peak_bytes = None
+        finally:
+            self.model.zero_grad(set_to_none=True)
+            if self.device.type == "cuda":
+                torch.cuda.empty_cache()
+
+        fits = peak_bytes is not None and (
+            peak_bytes + self.reserved_bytes <= self.budget_bytes
+        )
+        peak = f"{peak_bytes / 2**20:.0f} MB" if peak_bytes is not None else "OOM"
+        logger.debug(f"Batch size probe: {batch_size} | Peak: {peak} | Fits: {fits}")
+        return fits
+
+    def probe(self, batch_size: int) -> int:
+        """Get the peak memory of one forward and backward pass on a random batch"""
+        inputs = torch.rand(
+            batch_size, *self.sample_input.shape, device=self.device
+        ).to(self.sample_input.dtype)
+        labels = torch.randint(0, self.num_classes, (batch_size,), device=self.device)
+
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self.criterion(self.model(inputs), labels).backward()
+            return torch.cuda.max_memory_allocated(self.device)
+
+        with PeakRSSSampler() as sampler:
+            self.criterion(self.model(inputs), labels).backward()
+        return sampler.peak
@@ -0,0 +1,83 @@
+from model.cnn import CNN
+from model.student import StudentCNN
+from model.label_sidecar import load_label_sidecar
+
+import logging
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+# Architecture name -> model class, saved in the serving artifacts
+ARCHITECTURES = {"cnn": CNN, "student": StudentCNN}
+
+
+def save_model(
+    model_path: str,
+    model: nn.Module,
+    architecture: str,
+    class_names: list[str],
+    model_kwargs: dict = None,
+) -> None:
+    """Save a self-contained serving artifact: the architecture, its constructor arguments, the
+    class names and the weights
+
+    Args:
+        model_path: path of the artifact
+        model: model to save
+        architecture: name of the architecture in ARCHITECTURES
+        class_names: class names in class index order
+        model_kwargs: constructor arguments of the model besides num_classes, e.g. the width
+            of a StudentCNN
+    """
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture: {architecture}")
+    torch.save(
+        {
+            "architecture": architecture,
+            # Plain strings, numpy strings can not be loaded with weights_only
+            "class_names": [str(name) for name in class_names],
+            "model_kwargs": dict(model_kwargs or {}),
+            "state_dict": model.state_dict(),
+        },
+        model_path,
+    )
+
+
+def load_model(
+    model_path: str, device: torch.device = torch.device("cpu")
+) -> tuple[nn.Module, list[str]]:
+    """Load a serving artifact, or a CNN checkpoint saved by training. The class names of a
+    training checkpoint come from its label sidecar, or are the class indices without one
+
+    Args:
+        model_path: path of the artifact or checkpoint
+        device: device to load the model on
+
+    Returns:
+        the model in eval mode and its class names in class index order
+    """
+    checkpoint = torch.load(model_path, map_location=device)
+    if "architecture" in checkpoint:
+        architecture = checkpoint["architecture"]
+        if architecture not in ARCHITECTURES:
+            raise ValueError(f"Unknown architecture {architecture} in: {model_path}")
+        class_names = checkpoint["class_names"]
+        # Artifacts saved before the constructor arguments were recorded use the defaults
+        model = ARCHITECTURES[architecture](
+            num_classes=len(class_names), **checkpoint.get("model_kwargs", {})
+        )
+        model.load_state_dict(checkpoint["state_dict"])
+    else:
+        num_classes = checkpoint["fc3.weight"].shape[0]
+        sidecar = load_label_sidecar(model_path)
+        if sidecar is not None:
+            class_names = sidecar["class_names"]
+        else:
+            logger.warning(f"No label sidecar for: {model_path}, using class indices")
+            class_names = [str(index) for index in range(num_classes)]
+        model = CNN(num_classes=num_classes)
+        model.load_state_dict(checkpoint)
+
+    model.to(device).eval()
+    return model, class_names
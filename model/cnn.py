@@ -1,5 +1,9 @@
+import torch
 import torch.nn as nn
 
+# Prefix of the parameters of the convolutional backbone in the state dict
+BACKBONE_PREFIX = "conv"
+
 
 class CNN(nn.Module):
     def __init__(self, num_classes: int):
@@ -10,18 +14,71 @@ class CNN(nn.Module):
         # self.conv4 = nn.Conv2d(128, 256, kernel_size=3, stride=1, padding=1)
         self.relu = nn.ReLU()
         self.pool = nn.MaxPool2d(kernel_size=2, stride=2, padding=0)
+        # Brings the feature maps of any image size to the 16x16 the head expects, it does
+        # nothing for 128x128 images
+        self.feature_pool = nn.AdaptiveAvgPool2d((16, 16))
         self.dropout = nn.Dropout(0.5)
         self.fc1 = nn.Linear(128 * 16 * 16, 512)
         self.fc2 = nn.Linear(512, 256)
         self.fc3 = nn.Linear(256, num_classes)
 
-    def forward(self, x):
+    def features(self, x):
+        """Run the convolutional backbone, returns the flattened embeddings"""
         x = self.pool(self.relu(self.conv1(x)))
         x = self.pool(self.relu(self.conv2(x)))
         x = self.pool(self.relu(self.conv3(x)))
         # x = self.pool(self.relu(self.conv4(x)))
-        x = x.view(-1, 128 * 16 * 16)
+        x = self.feature_pool(x)
+        return x.view(-1, 128 * 16 * 16)
+
+    def classify(self, x):
+        """Run the fully connected head on the backbone embeddings"""
         x = self.dropout(self.relu(self.fc1(x)))
         x = self.dropout(self.relu(self.fc2(x)))
         x = self.fc3(x)
         return x
+
+    def forward(self, x):
+        return self.classify(self.features(x))
+
+    def backbone_state_dict(self) -> dict:
+        """Get the weights of the convolutional backbone"""
+        return {
+            name: value
+            for name, value in self.state_dict().items()
+            if name.startswith(BACKBONE_PREFIX)
+        }
+
+    def head_parameters(self) -> list[nn.Parameter]:
+        """Get the parameters of the fully connected head"""
+        return [
+            parameter
+            for name, parameter in self.named_parameters()
+            if not name.startswith(BACKBONE_PREFIX)
+        ]
+
+    def resize_head(self, num_classes: int) -> None:
+        """Replace the output layer with one for num_classes, the existing classes keep their weights"""
+        old_fc3 = self.fc3
+        self.fc3 = nn.Linear(old_fc3.in_features, num_classes).to(old_fc3.weight.device)
+        kept = min(old_fc3.out_features, num_classes)
+        with torch.no_grad():
+            self.fc3.weight[:kept] = old_fc3.weight[:kept]
+            self.fc3.bias[:kept] = old_fc3.bias[:kept]
+
+    def freeze_backbone(self) -> None:
+        """Stop computing gradients for the convolutional backbone"""
+        for name, parameter in self.named_parameters():
+            if name.startswith(BACKBONE_PREFIX):
+                parameter.requires_grad = False
+
+
+class CNNHead(nn.Module):
+    """Runs only the fully connected head of the input CNN, used to train on cached embeddings"""
+
+    def __init__(self, cnn: CNN):
+        super(CNNHead, self).__init__()
+        self.cnn = cnn
+
+    def forward(self, x):
+        return self.cnn.classify(x)
@@ -0,0 +1,304 @@
+from library.species_dataset import SpeciesDataset
+from model.checkpoint import load_model, save_model
+from model.early_stopping import EarlyStopping
+from model.feature_cache import LogitCache
+from model.label_sidecar import load_label_sidecar
+from model.metrics import MetricsAccumulator
+from model.student import StudentCNN
+from library.run_report import span, count
+
+import json
+import logging
+import os
+import random
+import statistics
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.utils.data import DataLoader, Dataset, Subset, random_split
+from torchvision import transforms
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+
+class DistillationDataset(Dataset):
+    """Returns the image, the label and the cached teacher logits of every sample
+
+    * dataset: dataset of the images
+    * logits: memory-mapped array of the teacher logits
+    * rows: row of the logits of every image of the dataset
+    """
+
+    def __init__(self, dataset: Dataset, logits: np.ndarray, rows: np.ndarray):
+        self.dataset = dataset
+        self.logits = logits
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        image, label = self.dataset[idx]
+        logits = torch.from_numpy(self.logits[self.rows[idx]].astype(np.float32))
+        return image, label, logits
+
+
+def distillation_loss(
+    student_logits: torch.Tensor,
+    teacher_logits: torch.Tensor,
+    labels: torch.Tensor,
+    temperature: float,
+    alpha: float,
+) -> torch.Tensor:
+    """Mix of the KL divergence to the softened teacher distribution and of the cross entropy
+    to the labels. The KL term is scaled by temperature^2 to keep its gradients comparable
+    """
+    soft_loss = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction="batchmean",
+    ) * (temperature**2)
+    hard_loss = F.cross_entropy(student_logits, labels)
+    return alpha * soft_loss + (1.0 - alpha) * hard_loss
+
+
+def measure_latency(
+    model: nn.Module, image_size: tuple[int, int], runs: int = 50
+) -> float:
+    """Get the median CPU latency of classifying one image, in milliseconds"""
+    model.eval()
+    inputs = torch.rand(1, 3, *image_size)
+    timings = []
+    with torch.no_grad():
+        for run in range(runs + 5):
+            start = time.perf_counter()
+            model(inputs)
+            # The first runs only warm up the allocator and the kernels
+            if run >= 5:
+                timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+class Distiller:
+    """Trains a StudentCNN against the soft logits of a trained teacher checkpoint. The teacher
+    logits of every image are computed once and cached on disk.
+
+    * teacher_path: checkpoint of the teacher, see model.checkpoint.load_model
+    * dataset_dir: directory of the dataset
+    * student_path: path of the student serving artifact
+    * output_path: JSON report comparing the student to the teacher
+    * cache_dir: directory of the teacher logit cache
+    * temperature: softening temperature of the teacher and student distributions
+    * alpha: weight of the distillation loss, the rest goes to the label loss
+    * width: channels of the first convolution of the student
+    """
+
+    def __init__(
+        self,
+        teacher_path: str,
+        dataset_dir: str,
+        student_path: str,
+        output_path: str,
+        cache_dir: str,
+        num_epochs: int = 20,
+        temperature: float = 4.0,
+        alpha: float = 0.7,
+        width: int = 16,
+        learning_rate: float = 0.001,
+        batch_size: int = 128,
+        train_fraction: float = 0.75,
+        patience: int = 5,
+        min_delta: float = 0.0,
+        seed: int = 42,
+    ):
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.teacher_path = teacher_path
+        self.student_path = student_path
+        self.output_path = output_path
+        self.num_epochs = num_epochs
+        self.temperature = temperature
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.width = width
+        self.image_size = (128, 128)
+
+        if not 0.0 <= alpha <= 1.0:
+            raise ValueError(f"Alpha must be in [0, 1], got: {alpha}")
+        random.seed(seed)
+        torch.manual_seed(seed)
+
+        # Same preprocessing and split as ModelTrainer. The split only matches the one of a
+        # teacher trained on this directory with the same seed, a teacher trained on a view, a
+        # store query or incrementally may have trained on validation images
+        self.transform = transforms.Compose(
+            [transforms.Resize(self.image_size), transforms.ToTensor()]
+        )
+        dataset = SpeciesDataset(dataset_dir, transform=self.transform)
+        sidecar = load_label_sidecar(teacher_path)
+        if sidecar is not None:
+            dataset.set_class_names(sidecar["class_names"])
+        train_size = int(train_fraction * len(dataset))
+        train_dataset, val_dataset = random_split(
+            dataset, [train_size, len(dataset) - train_size]
+        )
+
+        self.teacher, teacher_classes = load_model(teacher_path, self.device)
+        self.class_names = dataset.class_names
+        self.num_classes = len(self.class_names)
+        if len(teacher_classes) != self.num_classes:
+            raise ValueError(
+                f"The teacher has {len(teacher_classes)} classes, the dataset {self.num_classes}"
+            )
+        self.teacher_val_overlap = self.get_val_overlap(sidecar, dataset, val_dataset)
+
+        logits_dataset = self.cache_logits(dataset, cache_dir)
+        self.train_loader = DataLoader(
+            Subset(logits_dataset, train_dataset.indices),
+            batch_size=batch_size,
+            shuffle=True,
+        )
+        self.val_loader = DataLoader(val_dataset, batch_size=batch_size)
+        logger.info(
+            f"Loaded the dataset: {dataset_dir} | Train size: {train_size} | Val size: {len(val_dataset)}"
+        )
+
+        self.student = StudentCNN(num_classes=self.num_classes, width=width).to(
+            self.device
+        )
+        self.optimizer = optim.Adam(self.student.parameters(), lr=learning_rate)
+        self.early_stopping = EarlyStopping(patience=patience, min_delta=min_delta)
+
+    @staticmethod
+    def get_val_overlap(
+        sidecar: dict, dataset: SpeciesDataset, val_dataset: Subset
+    ) -> float:
+        """Get the fraction of the validation images that the teacher was trained on
+
+        Args:
+            sidecar: label sidecar of the teacher, None if it has none
+            dataset: dataset of the images
+            val_dataset: validation split of the dataset
+
+        Returns:
+            the fraction, None if the teacher does not record the images it was trained on
+        """
+        if sidecar is None or sidecar.get("image_ids") is None:
+            logger.warning(
+                "The teacher does not record its training images, its accuracy may be measured on images it was trained on"
+            )
+            return None
+        trained_ids = set(sidecar["image_ids"])
+        num_trained = sum(
+            dataset.get_image_id(index) in trained_ids for index in val_dataset.indices
+        )
+        if num_trained:
+            logger.warning(
+                f"The teacher was trained on {num_trained}/{len(val_dataset)} validation images, its accuracy is optimistic"
+            )
+        return num_trained / max(1, len(val_dataset))
+
+    def cache_logits(self, dataset: SpeciesDataset, cache_dir: str) -> Dataset:
+        """Compute the teacher logits of the images that are not cached yet"""
+        cache = LogitCache(cache_dir, self.teacher, self.device)
+        image_ids = [dataset.get_image_id(index) for index in range(len(dataset))]
+        with span("teacher_logits"):
+            logits, rows = cache.build(dataset, image_ids, batch_size=self.batch_size)
+        return DistillationDataset(dataset, logits, rows)
+
+    def distill(self) -> dict:
+        """Train the student, keep its best checkpoint and compare it to the teacher
+
+        Returns:
+            the report written to output_path
+        """
+        with span("distillation"):
+            for epoch in range(self.num_epochs):
+                self.student.train()
+                # The loss is summed on the device and only read once at the end of the epoch
+                running_loss = torch.zeros((), device=self.device)
+                num_samples = 0
+                for inputs, labels, teacher_logits in tqdm(self.train_loader):
+                    inputs = inputs.to(self.device)
+                    labels = labels.to(self.device)
+                    teacher_logits = teacher_logits.to(self.device)
+
+                    self.optimizer.zero_grad()
+                    loss = distillation_loss(
+                        self.student(inputs),
+                        teacher_logits,
+                        labels,
+                        self.temperature,
+                        self.alpha,
+                    )
+                    loss.backward()
+                    self.optimizer.step()
+                    running_loss += loss.detach() * inputs.size(0)
+                    num_samples += inputs.size(0)
+                count("images_trained", num_samples)
+                epoch_loss = running_loss.item() / max(1, num_samples)
+
+                val_loss, val_accuracy = self.evaluate(self.student)
+                logger.info(
+                    f"Epoch {epoch+1}/{self.num_epochs}, Loss: {epoch_loss:.4f}, Val Loss: {val_loss:.4f}, Val Accuracy: {val_accuracy:.4f}"
+                )
+                if self.early_stopping.step(val_loss, epoch):
+                    save_model(
+                        self.student_path,
+                        self.student,
+                        "student",
+                        self.class_names,
+                        model_kwargs={"width": self.width},
+                    )
+                if self.early_stopping.should_stop:
+                    logger.info(f"Early stopping at epoch {epoch+1}/{self.num_epochs}")
+                    break
+
+        self.student, _ = load_model(self.student_path, self.device)
+        report = {
+            "teacher_path": self.teacher_path,
+            "student_path": self.student_path,
+            "temperature": self.temperature,
+            "alpha": self.alpha,
+            "teacher_val_overlap": self.teacher_val_overlap,
+            "teacher": self.describe(self.teacher, self.teacher_path),
+            "student": self.describe(self.student, self.student_path),
+        }
+        with open(self.output_path, "w") as file:
+            json.dump(report, file, indent=4)
+        logger.info(
+            f"Teacher accuracy: {report['teacher']['accuracy']:.4f} | {report['teacher']['latency_ms']:.2f} ms | {report['teacher']['size_bytes']} bytes"
+        )
+        logger.info(
+            f"Student accuracy: {report['student']['accuracy']:.4f} | {report['student']['latency_ms']:.2f} ms | {report['student']['size_bytes']} bytes"
+        )
+        logger.info(f"Distillation report saved to: {self.output_path}")
+        return report
+
+    def evaluate(self, model: nn.Module) -> tuple[float, float]:
+        """Get the label loss and the accuracy of the input model on the validation split"""
+        model.eval()
+        accumulator = MetricsAccumulator(
+            self.num_classes, self.device, class_names=self.class_names
+        )
+        with torch.no_grad():
+            for inputs, labels in self.val_loader:
+                inputs, labels = inputs.to(self.device), labels.to(self.device)
+                outputs = model(inputs)
+                accumulator.update(F.cross_entropy(outputs, labels), outputs, labels)
+        results = accumulator.compute()
+        return results["loss"], results["accuracy"]
+
+    def describe(self, model: nn.Module, model_path: str) -> dict:
+        """Get the accuracy, the single image CPU latency and the size of the input model"""
+        _, accuracy = self.evaluate(model)
+        cpu_model = load_model(model_path, torch.device("cpu"))[0]
+        return {
+            "accuracy": accuracy,
+            "latency_ms": measure_latency(cpu_model, self.image_size),
+            "parameters": sum(parameter.numel() for parameter in model.parameters()),
+            "size_bytes": os.path.getsize(model_path),
+        }
@@ -0,0 +1,215 @@
+from common.constants import (
+    DISTRIBUTED_BACKEND,
+    DEFAULT_MASTER_ADDR,
+    DEFAULT_MASTER_PORT,
+)
+from library.run_report import get_run_report
+
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Callable
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+from torch.utils.data import Dataset, Sampler
+
+logger = logging.getLogger(__name__)
+
+
+def is_distributed() -> bool:
+    """Check if the current process is part of an initialized process group"""
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    """Get the global rank of the current process, 0 when not distributed"""
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    """Get the number of processes taking part in training, 1 when not distributed"""
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def get_local_world_size() -> int:
+    """Get the number of processes on this node, 1 when training is not distributed"""
+    return int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+
+
+def is_main_process() -> bool:
+    """Only the main process (rank 0) saves checkpoints and writes outputs"""
+    return get_rank() == 0
+
+
+def barrier() -> None:
+    """Wait for all the ranks to reach this point"""
+    if is_distributed():
+        dist.barrier()
+
+
+def all_reduce_sum(value: torch.Tensor) -> torch.Tensor:
+    """Sum the input tensor across all the ranks in place"""
+    if is_distributed():
+        dist.all_reduce(value, op=dist.ReduceOp.SUM)
+    return value
+
+
+def all_reduce_min(value: torch.Tensor) -> torch.Tensor:
+    """Take the minimum of the input tensor across all the ranks in place"""
+    if is_distributed():
+        dist.all_reduce(value, op=dist.ReduceOp.MIN)
+    return value
+
+
+def broadcast_object(value: Any, src: int = 0) -> Any:
+    """Get the input object of the src rank on every rank, it must be picklable"""
+    if not is_distributed():
+        return value
+    values = [value]
+    dist.broadcast_object_list(values, src=src)
+    return values[0]
+
+
+class ShardSampler(Sampler):
+    """Splits the indices of a dataset between the ranks without padding them, so every sample
+    is evaluated exactly once. DistributedSampler repeats samples to give every rank the same
+    number, which counts them twice in the metrics. The shards differ by at most one sample.
+
+    * dataset: dataset to shard
+    * num_replicas: number of ranks
+    * rank: rank of the shard
+    """
+
+    def __init__(self, dataset: Dataset, num_replicas: int, rank: int):
+        self.dataset = dataset
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+    def __iter__(self):
+        return iter(range(self.rank, len(self.dataset), self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, len(self.dataset), self.num_replicas))
+
+
+def unwrap_model(model: nn.Module) -> nn.Module:
+    """Get the underlying model from a DistributedDataParallel wrapper"""
+    if isinstance(model, nn.parallel.DistributedDataParallel):
+        return model.module
+    return model
+
+
+def launch(
+    fn: Callable[..., Any],
+    fn_kwargs: dict,
+    nproc_per_node: int = 1,
+    nnodes: int = 1,
+    node_rank: int = 0,
+    master_addr: str = DEFAULT_MASTER_ADDR,
+    master_port: int = DEFAULT_MASTER_PORT,
+) -> None:
+    """Run the input function on nproc_per_node local processes joined in one gloo process group.
+    The same command is run on every node with its own node_rank to train across machines.
+
+    Examples:
+
+        Four processes on one machine:
+
+        >>>  launch(ModelTrainer, trainer_kwargs, nproc_per_node=4)
+
+        Two machines with eight processes each, run on both nodes with node_rank 0 and 1:
+
+        >>>  launch(ModelTrainer, trainer_kwargs, nproc_per_node=8, nnodes=2,
+        >>>     node_rank=0, master_addr="10.0.0.1")
+
+    Args:
+        fn: function to run in every process, called with fn_kwargs
+        fn_kwargs: keyword arguments for the function
+        nproc_per_node: number of processes to start on this node
+        nnodes: number of nodes taking part in training
+        node_rank: rank of this node, between 0 and nnodes - 1
+        master_addr: address of the node with node_rank 0
+        master_port: free port on the node with node_rank 0
+    """
+    world_size = nproc_per_node * nnodes
+    if world_size == 1:
+        fn(**fn_kwargs)
+        return
+
+    if not 0 <= node_rank < nnodes:
+        raise ValueError(
+            f"Node rank must be between 0 and {nnodes - 1}, got: {node_rank}"
+        )
+
+    logger.info(
+        f"Launching {nproc_per_node} processes on node {node_rank} | world size: {world_size} | master: {master_addr}:{master_port}"
+    )
+    # The spawned processes have their own run report, the first local rank writes it to a
+    # file that is merged into the report of this process
+    report = get_run_report()
+    offset = time.perf_counter() - report.start_time
+    with tempfile.TemporaryDirectory() as report_dir:
+        report_path = os.path.join(report_dir, "report.json")
+        try:
+            mp.spawn(
+                _run_worker,
+                args=(
+                    fn,
+                    fn_kwargs,
+                    nproc_per_node,
+                    node_rank,
+                    world_size,
+                    master_addr,
+                    master_port,
+                    logging.getLogger().level,
+                    report_path,
+                ),
+                nprocs=nproc_per_node,
+                join=True,
+            )
+        finally:
+            if os.path.isfile(report_path):
+                with open(report_path, "r") as file:
+                    report.merge(json.load(file), offset)
+
+
+def _run_worker(
+    local_rank: int,
+    fn: Callable[..., Any],
+    fn_kwargs: dict,
+    nproc_per_node: int,
+    node_rank: int,
+    world_size: int,
+    master_addr: str,
+    master_port: int,
+    log_level: int,
+    report_path: str,
+) -> None:
+    """Entry point of every spawned process, the first local rank writes its run report to
+    report_path"""
+    rank = node_rank * nproc_per_node + local_rank
+    # Spawned processes do not inherit the logging configuration of the launcher
+    logging.basicConfig(encoding="utf-8", level=log_level)
+    os.environ["MASTER_ADDR"] = master_addr
+    os.environ["MASTER_PORT"] = str(master_port)
+    # Same variables as torchrun, the local processes share the memory of the node
+    os.environ["LOCAL_RANK"] = str(local_rank)
+    os.environ["LOCAL_WORLD_SIZE"] = str(nproc_per_node)
+
+    # Split the cores of the node between the local processes to avoid oversubscription
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // nproc_per_node))
+
+    dist.init_process_group(DISTRIBUTED_BACKEND, rank=rank, world_size=world_size)
+    logger.debug(f"Initialized process group | rank: {rank}/{world_size}")
+    try:
+        fn(**fn_kwargs)
+    finally:
+        dist.destroy_process_group()
+        if local_rank == 0:
+            with open(report_path, "w") as file:
+                json.dump(get_run_report().to_dict(), file)
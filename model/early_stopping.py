@@ -0,0 +1,69 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EarlyStopping:
+    """Tracks a validation metric and decides when training should stop
+
+    * patience: number of epochs without improvement before stopping
+    * min_delta: minimum change of the metric that counts as an improvement
+    * mode: "min" if lower values are better (loss), "max" otherwise (accuracy)
+    """
+
+    def __init__(self, patience: int = 5, min_delta: float = 0.0, mode: str = "min"):
+        if mode not in ("min", "max"):
+            raise ValueError(f"Early stopping mode must be min or max, got: {mode}")
+        if patience is not None and patience < 1:
+            raise ValueError(f"Early stopping patience must be >= 1, got: {patience}")
+
+        self.patience = patience
+        self.min_delta = abs(min_delta)
+        self.mode = mode
+        self.best = None
+        self.best_epoch = None
+        self.epochs_without_improvement = 0
+
+    def is_improvement(self, value: float) -> bool:
+        """Check if the input value improves on the best value seen so far
+
+        Args:
+            value: metric value for the current epoch
+
+        Returns:
+            True if the value improves on the best value by more than min_delta
+        """
+        if self.best is None:
+            return True
+        if self.mode == "min":
+            return value < self.best - self.min_delta
+        return value > self.best + self.min_delta
+
+    def step(self, value: float, epoch: int) -> bool:
+        """Record the metric for the input epoch
+
+        Args:
+            value: metric value for the current epoch
+            epoch: index of the current epoch
+
+        Returns:
+            True if the value is a new best value
+        """
+        if self.is_improvement(value):
+            self.best = value
+            self.best_epoch = epoch
+            self.epochs_without_improvement = 0
+            return True
+
+        self.epochs_without_improvement += 1
+        logger.debug(
+            f"No improvement for {self.epochs_without_improvement} epochs | best: {self.best:.4f} at epoch {self.best_epoch+1}"
+        )
+        return False
+
+    @property
+    def should_stop(self) -> bool:
+        """True once the metric has not improved for `patience` epochs"""
+        if self.patience is None:
+            return False
+        return self.epochs_without_improvement >= self.patience
@@ -0,0 +1,217 @@
+from library.base_io import BaseIO
+from model.cnn import CNN
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset, Subset
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+FEATURES_FILE = "{prefix}_{model_hash}.npy"
+INDEX_FILE = "{prefix}_{model_hash}.json"
+# Embeddings are stored as float16 to halve the size of the memory-mapped file
+FEATURE_DTYPE = np.float16
+
+
+def hash_state_dict(state_dict: dict) -> str:
+    """Hash the input weights, any change of the weights changes the hash"""
+    digest = hashlib.sha256()
+    for name in sorted(state_dict):
+        digest.update(name.encode())
+        digest.update(state_dict[name].detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+class FeatureCache:
+    """Memory-mapped cache of the backbone embeddings of a dataset, keyed by image id and by the
+    hash of the backbone weights. Caches of other backbone weights are deleted when a new one is built.
+
+    * cache_dir: directory to store the feature files in
+    * model: CNN whose backbone computes the embeddings
+    * device: device to compute the embeddings on
+    """
+
+    # Name prefix of the cache files, caches with other prefixes in the same directory are kept
+    prefix = "features"
+
+    def __init__(self, cache_dir: str, model: CNN, device: torch.device):
+        self.cache_dir = cache_dir
+        self.model = model
+        self.device = device
+        self.model_hash = hash_state_dict(self.hashed_state_dict())
+        self.features_path = os.path.join(
+            cache_dir,
+            FEATURES_FILE.format(prefix=self.prefix, model_hash=self.model_hash),
+        )
+        self.index_path = os.path.join(
+            cache_dir, INDEX_FILE.format(prefix=self.prefix, model_hash=self.model_hash)
+        )
+        BaseIO.create_directory(cache_dir)
+
+    def hashed_state_dict(self) -> dict:
+        """Get the weights the cached values depend on"""
+        return self.model.backbone_state_dict()
+
+    @property
+    def feature_dim(self) -> int:
+        return self.model.fc1.in_features
+
+    def encode(self, inputs: torch.Tensor) -> torch.Tensor:
+        """Compute the cached values of a batch of images"""
+        return self.model.features(inputs)
+
+    def load_index(self) -> list[str]:
+        """Get the image ids stored in the cache, in row order"""
+        if not BaseIO.is_path_file(self.index_path) or not BaseIO.is_path_file(
+            self.features_path
+        ):
+            return []
+        with open(self.index_path, "r") as file:
+            return json.load(file)["image_ids"]
+
+    def remove_stale_caches(self) -> None:
+        """Delete the feature files computed with other backbone weights"""
+        for path in glob.glob(os.path.join(self.cache_dir, f"{self.prefix}_*")):
+            if self.model_hash not in os.path.basename(path):
+                logger.info(f"Removing stale feature cache: {path}")
+                os.remove(path)
+
+    def build(self, dataset: Dataset, image_ids: list[str], batch_size: int = 256):
+        """Compute the embeddings of the images that are not cached yet and get the embeddings
+        of all the input images
+
+        Args:
+            dataset: dataset returning (image, label), in the same order as image_ids
+            image_ids: unique id of every image of the dataset
+            batch_size: number of images to run through the backbone at once
+
+        Returns:
+            memory-mapped array of the embeddings and the row of every input image in it
+        """
+        self.remove_stale_caches()
+        cached_ids = self.load_index()
+        cached_rows = {image_id: row for row, image_id in enumerate(cached_ids)}
+        missing = [
+            index
+            for index, image_id in enumerate(image_ids)
+            if image_id not in cached_rows
+        ]
+        logger.info(
+            f"Feature cache {self.model_hash}: {len(image_ids) - len(missing)} cached | {len(missing)} to compute"
+        )
+
+        if missing:
+            self.append(dataset, missing, image_ids, cached_ids, batch_size)
+            cached_rows = {
+                image_id: row for row, image_id in enumerate(self.load_index())
+            }
+
+        features = np.load(self.features_path, mmap_mode="r")
+        rows = np.array([cached_rows[image_id] for image_id in image_ids])
+        return features, rows
+
+    def append(
+        self,
+        dataset: Dataset,
+        missing: list[int],
+        image_ids: list[str],
+        cached_ids: list[str],
+        batch_size: int,
+    ) -> None:
+        """Write a new cache file with the cached embeddings followed by the missing ones"""
+        feature_dim = self.feature_dim
+        old_features = (
+            np.load(self.features_path, mmap_mode="r") if cached_ids else None
+        )
+        temp_path = f"{self.features_path}.tmp"
+        features = np.lib.format.open_memmap(
+            temp_path,
+            mode="w+",
+            dtype=FEATURE_DTYPE,
+            shape=(len(cached_ids) + len(missing), feature_dim),
+        )
+        if old_features is not None:
+            features[: len(cached_ids)] = old_features
+
+        was_training = self.model.training
+        self.model.eval()
+        loader = DataLoader(Subset(dataset, missing), batch_size=batch_size)
+        row = len(cached_ids)
+        with torch.no_grad():
+            for inputs, _ in tqdm(loader):
+                embeddings = self.encode(inputs.to(self.device))
+                features[row : row + len(embeddings)] = (
+                    embeddings.cpu().numpy().astype(FEATURE_DTYPE)
+                )
+                row += len(embeddings)
+        self.model.train(was_training)
+
+        features.flush()
+        del features, old_features
+        os.replace(temp_path, self.features_path)
+        with open(self.index_path, "w") as file:
+            json.dump(
+                {
+                    "model_hash": self.model_hash,
+                    "feature_dim": feature_dim,
+                    "image_ids": cached_ids + [image_ids[index] for index in missing],
+                },
+                file,
+            )
+        logger.info(f"Saved {row} embeddings to: {self.features_path}")
+
+
+class LogitCache(FeatureCache):
+    """Memory-mapped cache of the output logits of a model, keyed by image id and by the hash
+    of all the weights of the model. Used to distill a model without running it every epoch.
+
+    * cache_dir: directory to store the logit files in
+    * model: model computing the logits
+    * device: device to compute the logits on
+    """
+
+    prefix = "logits"
+
+    def hashed_state_dict(self) -> dict:
+        return self.model.state_dict()
+
+    @property
+    def feature_dim(self) -> int:
+        # The output layer is the last linear layer of the CNN and of the student
+        linear_layers = [
+            module for module in self.model.modules() if isinstance(module, nn.Linear)
+        ]
+        return linear_layers[-1].out_features
+
+    def encode(self, inputs: torch.Tensor) -> torch.Tensor:
+        return self.model(inputs)
+
+
+class FeatureDataset(Dataset):
+    """Dataset of cached embeddings and the labels of the images they were computed from
+
+    * features: memory-mapped array of the embeddings
+    * rows: row of the features of every image
+    * labels: label tensor of every image
+    """
+
+    def __init__(
+        self, features: np.ndarray, rows: np.ndarray, labels: list[torch.Tensor]
+    ):
+        self.features = features
+        self.rows = rows
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        row = self.features[self.rows[idx]]
+        return torch.from_numpy(row.astype(np.float32)), self.labels[idx]
@@ -0,0 +1,53 @@
+from common.constants import LABELS_SUFFIX
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def label_sidecar_path(model_path: str) -> str:
+    """Get the path of the label sidecar of a checkpoint: model_<run_id>.labels.json"""
+    return f"{os.path.splitext(model_path)[0]}{LABELS_SUFFIX}"
+
+
+def load_label_sidecar(model_path: str) -> dict:
+    """Load the label sidecar of a checkpoint
+
+    Returns:
+        the sidecar with the class_names in class index order, the image_ids of the training
+        split of the model and its val_accuracy, or None if the checkpoint has no sidecar
+    """
+    path = label_sidecar_path(model_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_label_sidecar(
+    model_path: str,
+    class_names: list[str],
+    image_ids: list[str] = None,
+    val_accuracy: float = None,
+) -> None:
+    """Save the classes of a checkpoint next to it, so later runs keep the same class indices
+
+    Args:
+        model_path: path of the checkpoint
+        class_names: class names in class index order
+        image_ids: ids of the images the model was trained on, without its validation split
+        val_accuracy: accuracy of the model on its validation split
+    """
+    path = label_sidecar_path(model_path)
+    with open(path, "w") as file:
+        json.dump(
+            {
+                "class_names": list(class_names),
+                "image_ids": sorted(image_ids) if image_ids is not None else None,
+                "val_accuracy": val_accuracy,
+            },
+            file,
+        )
+    logger.info(f"Saved the {len(class_names)} classes of the model to: {path}")
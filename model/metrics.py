@@ -0,0 +1,87 @@
+from model.distributed import all_reduce_sum
+
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsAccumulator:
+    """Accumulates the loss and the confusion matrix of a whole epoch on the device.
+    Nothing is copied to the host until compute() is called, so updating does not synchronize.
+
+    * num_classes: number of classes the model predicts
+    * device: device the outputs and labels live on
+    * class_names: optional class names, ordered by class index
+    """
+
+    def __init__(
+        self, num_classes: int, device: torch.device, class_names: list[str] = None
+    ):
+        self.num_classes = num_classes
+        self.device = device
+        self.class_names = class_names or [str(index) for index in range(num_classes)]
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+        self.num_samples = torch.zeros((), dtype=torch.int64, device=device)
+        self.confusion_matrix = torch.zeros(
+            (num_classes, num_classes), dtype=torch.int64, device=device
+        )
+
+    def update(
+        self, loss: torch.Tensor, outputs: torch.Tensor, labels: torch.Tensor
+    ) -> None:
+        """Add a batch to the running totals
+
+        Args:
+            loss: mean loss of the batch
+            outputs: model logits of shape (batch, num_classes)
+            labels: one-hot / probability labels of shape (batch, num_classes) or class indices
+        """
+        batch_size = outputs.size(0)
+        predicted = outputs.argmax(dim=1)
+        targets = labels.argmax(dim=1) if labels.dim() > 1 else labels
+
+        self.loss_sum += loss.detach().double() * batch_size
+        self.num_samples += batch_size
+        # Rows are the true classes, columns the predicted classes
+        self.confusion_matrix += torch.bincount(
+            targets * self.num_classes + predicted,
+            minlength=self.num_classes**2,
+        ).view(self.num_classes, self.num_classes)
+
+    def compute(self) -> dict:
+        """Combine the totals across the ranks and compute the metrics. This is the only
+        point at which the accumulated values are copied to the host
+
+        Returns:
+            dict with the loss, accuracy, per-class precision / recall / support and the confusion matrix
+        """
+        all_reduce_sum(self.loss_sum)
+        all_reduce_sum(self.num_samples)
+        all_reduce_sum(self.confusion_matrix)
+
+        confusion_matrix = self.confusion_matrix.cpu()
+        num_samples = int(self.num_samples.item())
+        loss_sum = float(self.loss_sum.item())
+
+        true_positives = confusion_matrix.diag().double()
+        support = confusion_matrix.sum(dim=1).double()
+        predicted_count = confusion_matrix.sum(dim=0).double()
+        precision = true_positives / predicted_count.clamp(min=1)
+        recall = true_positives / support.clamp(min=1)
+
+        return {
+            "loss": loss_sum / max(1, num_samples),
+            "accuracy": float(true_positives.sum()) / max(1, num_samples),
+            "num_samples": num_samples,
+            "classes": [
+                {
+                    "name": name,
+                    "precision": float(precision[index]),
+                    "recall": float(recall[index]),
+                    "support": int(support[index]),
+                }
+                for index, name in enumerate(self.class_names)
+            ],
+            "confusion_matrix": confusion_matrix.tolist(),
+        }
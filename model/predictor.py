@@ -0,0 +1,140 @@
+from model.checkpoint import load_model
+from model.label_sidecar import label_sidecar_path
+from library.prediction_cache import PredictionCache, hash_bytes, hash_files
+from library.run_report import span, count
+
+import io
+import logging
+import os
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+logging.getLogger("PIL").setLevel(logging.WARNING)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+IMAGE_SIZE = (128, 128)
+
+
+def preprocess_image(image: Image.Image) -> torch.Tensor:
+    """Same as the Resize((128, 128)) and ToTensor transforms of ModelTrainer, without the
+    import cost of torchvision"""
+    image = image.convert("RGB").resize(IMAGE_SIZE, Image.BILINEAR)
+    array = np.asarray(image, dtype=np.float32) / 255.0
+    return torch.from_numpy(array).permute(2, 0, 1).contiguous()
+
+
+def find_images(dataset_dir: str) -> list[str]:
+    """Get the paths of the images under the input directory, hidden directories (caches) are skipped"""
+    image_paths = []
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        image_paths.extend(
+            os.path.join(root, name)
+            for name in sorted(files)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return image_paths
+
+
+class Predictor:
+    """Classifies images with a training checkpoint or a serving artifact, e.g. a distilled student.
+    With a prediction cache, images whose content was already classified by the same model are
+    neither decoded nor run through the model again.
+
+    * model_path: checkpoint or artifact to load, see model.checkpoint.load_model
+    * batch_size: number of images run through the model at once
+    * device: device to run the model on, CUDA when available by default
+    * cache: cache of the predictions, None to always run the model
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        batch_size: int = 64,
+        device: torch.device = None,
+        cache: PredictionCache = None,
+    ):
+        self.device = device or torch.device(
+            "cuda" if torch.cuda.is_available() else "cpu"
+        )
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.cache = cache
+        self.model, self.class_names = load_model(model_path, self.device)
+
+        # The class names of a checkpoint live in its sidecar, so both make up the model
+        model_files = [model_path]
+        if os.path.isfile(label_sidecar_path(model_path)):
+            model_files.append(label_sidecar_path(model_path))
+        self.model_hash = hash_files(model_files)
+        logger.info(
+            f"Loaded the model: {model_path} | Classes: {len(self.class_names)} | Hash: {self.model_hash} | Device: {self.device}"
+        )
+
+    def predict(self, image_paths: list[str], top_k: int = 5) -> list[dict]:
+        """Get the top_k classes of every input image
+
+        Args:
+            image_paths: paths of the images to classify
+            top_k: number of classes to return per image
+
+        Returns:
+            one dict per image with its path and its top_k labels and probabilities
+        """
+        top_k = min(top_k, len(self.class_names))
+        results = []
+        with span("prediction"):
+            for start in range(0, len(image_paths), self.batch_size):
+                batch_paths = image_paths[start : start + self.batch_size]
+                batch_predictions = self.predict_batch(batch_paths, top_k)
+                results.extend(
+                    {"image": image_path, "predictions": predictions}
+                    for image_path, predictions in zip(batch_paths, batch_predictions)
+                )
+        count("images_predicted", len(results))
+        return results
+
+    def predict_batch(self, image_paths: list[str], top_k: int) -> list[list[dict]]:
+        """Get the top_k classes of a batch of images, the cache is checked before decoding"""
+        contents = []
+        for image_path in image_paths:
+            with open(image_path, "rb") as file:
+                contents.append(file.read())
+        image_hashes = [hash_bytes(content) for content in contents]
+
+        found = {}
+        if self.cache is not None:
+            found = self.cache.get_many(self.model_hash, image_hashes, top_k)
+
+        # Identical images of the batch are only decoded once
+        missing = {}
+        for image_hash, content in zip(image_hashes, contents):
+            if image_hash not in found and image_hash not in missing:
+                missing[image_hash] = content
+        if missing:
+            inputs = torch.stack(
+                [
+                    preprocess_image(Image.open(io.BytesIO(content)))
+                    for content in missing.values()
+                ]
+            )
+            computed = dict(zip(missing, self.classify(inputs, top_k)))
+            found.update(computed)
+            if self.cache is not None:
+                self.cache.put_many(self.model_hash, computed, top_k)
+        return [found[image_hash] for image_hash in image_hashes]
+
+    def classify(self, inputs: torch.Tensor, top_k: int) -> list[list[dict]]:
+        """Run the model on a batch of preprocessed images"""
+        with torch.no_grad():
+            probabilities = torch.softmax(self.model(inputs.to(self.device)), dim=1)
+            values, indices = probabilities.topk(top_k, dim=1)
+        return [
+            [
+                {"label": self.class_names[index], "probability": value}
+                for value, index in zip(image_values, image_indices)
+            ]
+            for image_values, image_indices in zip(values.tolist(), indices.tolist())
+        ]
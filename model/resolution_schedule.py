@@ -0,0 +1,104 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Image size the models are trained and evaluated at
+FULL_IMAGE_SIZE = 128
+# The three pooling layers of the CNN halve the image size three times
+MIN_IMAGE_SIZE = 8
+
+
+class ResolutionSchedule:
+    """Image size of every training epoch for progressive resizing: the first epochs run on
+    downscaled images, which mostly teach coarse features at a fraction of the compute, and the
+    last epochs run at full size. Low resolution epochs use larger micro-batches so every
+    micro-batch holds about as many pixels as a full size one, and fewer of them per optimizer
+    step so the batch size of the step stays the same.
+
+    Examples:
+
+        >>> schedule = ResolutionSchedule([(64, 4), (96, 3)])
+        >>> schedule.image_size(0), schedule.batch_scale(0)
+        (64, 4)
+        >>> schedule.image_size(7), schedule.batch_scale(7)
+        (128, 1)
+
+    * phases: image size and number of epochs of every low resolution phase, in order. The
+      epochs after the last phase run at full_size
+    * full_size: image size of the final epochs
+    """
+
+    def __init__(self, phases: list[tuple[int, int]], full_size: int = FULL_IMAGE_SIZE):
+        for image_size, num_epochs in phases:
+            if not MIN_IMAGE_SIZE <= image_size <= full_size:
+                raise ValueError(
+                    f"Image size must be in [{MIN_IMAGE_SIZE}, {full_size}], got: {image_size}"
+                )
+            if num_epochs < 0:
+                raise ValueError(f"Epochs must be >= 0, got: {num_epochs}")
+        self.phases = [(size, epochs) for size, epochs in phases if epochs > 0]
+        self.full_size = full_size
+
+    @classmethod
+    def default(
+        cls, num_epochs: int, full_size: int = FULL_IMAGE_SIZE
+    ) -> "ResolutionSchedule":
+        """Get a schedule with 40% of the epochs at half size, 30% at three quarters and the
+        rest at full size"""
+        return cls(
+            [
+                (full_size // 2, int(0.4 * num_epochs)),
+                (full_size * 3 // 4, int(0.3 * num_epochs)),
+            ],
+            full_size,
+        )
+
+    @classmethod
+    def parse(
+        cls, specs: list[str], num_epochs: int, full_size: int = FULL_IMAGE_SIZE
+    ) -> "ResolutionSchedule":
+        """Get a schedule from SIZE:EPOCHS phases, e.g. ["64:4", "96:3"]. No phases give the
+        default schedule for num_epochs"""
+        if not specs:
+            return cls.default(num_epochs, full_size)
+        phases = []
+        for spec in specs:
+            try:
+                image_size, epochs = spec.split(":")
+                phases.append((int(image_size), int(epochs)))
+            except ValueError:
+                raise ValueError(f"Phases must look like SIZE:EPOCHS, got: {spec}")
+        schedule = cls(phases, full_size)
+        schedule.validate(num_epochs)
+        return schedule
+
+    @property
+    def low_resolution_epochs(self) -> int:
+        """Get the number of epochs of all the low resolution phases"""
+        return sum(num_epochs for _, num_epochs in self.phases)
+
+    def validate(self, num_epochs: int) -> None:
+        """Check that at least the last of the input epochs runs at full size"""
+        if self.low_resolution_epochs >= num_epochs:
+            raise ValueError(
+                f"The low resolution phases take {self.low_resolution_epochs} of the {num_epochs} epochs, the last epochs must run at full size"
+            )
+
+    def is_full_size(self, epoch: int) -> bool:
+        """Check if the input epoch, counted from 0, runs at full size"""
+        return epoch >= self.low_resolution_epochs
+
+    def image_size(self, epoch: int) -> int:
+        """Get the image size of the input epoch, counted from 0"""
+        for image_size, num_epochs in self.phases:
+            if epoch < num_epochs:
+                return image_size
+            epoch -= num_epochs
+        return self.full_size
+
+    def batch_scale(self, epoch: int) -> int:
+        """Get the factor the micro-batch size of the input epoch is multiplied by"""
+        return max(1, round((self.full_size / self.image_size(epoch)) ** 2))
+
+    def to_dict(self) -> dict:
+        return {"phases": self.phases, "full_size": self.full_size}
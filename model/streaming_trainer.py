@@ -0,0 +1,217 @@
+from library.streaming_dataset import StreamingDataset
+from model.cnn import CNN
+from model.early_stopping import EarlyStopping
+from model.label_sidecar import save_label_sidecar
+from model.metrics import MetricsAccumulator
+
+import copy
+import json
+import random
+import logging
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, Subset
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingTrainer:
+    """Trains a CNN on a StreamingDataset while it is still being filled.
+
+    Training starts once min_samples images arrived. Until the dataset is complete, every epoch
+    runs over the training samples received so far and the output layer grows when new classes
+    appear. Once the dataset is complete, num_epochs epochs are run on the full data with
+    validation, early stopping and checkpoints, like ModelTrainer does.
+
+    The checkpoint orders the classes by name, like SpeciesDataset does, so it can be loaded
+    by the train command on the run directory. Its label sidecar lists the classes and the
+    trained images, so it can also be the base model of an incremental run.
+
+    * model_path: path to save the best checkpoint to
+    * output_path: path to write the evaluation results of the best checkpoint to
+    * dataset: dataset that is being filled
+    * num_epochs: maximum number of epochs once the dataset is complete
+    * min_samples: number of samples to wait for before the first epoch
+    * batch_size: number of images per training step
+    * patience: early stopping patience, None to never stop early
+    * min_delta: minimum decrease of the validation loss that counts as an improvement
+    * seed: seed for the weights and the shuffling
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        output_path: str,
+        dataset: StreamingDataset,
+        num_epochs: int = 20,
+        min_samples: int = 512,
+        batch_size: int = 512,
+        patience: int = 5,
+        min_delta: float = 0.0,
+        seed: int = 42,
+    ):
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model_path = model_path
+        self.output_path = output_path
+        self.dataset = dataset
+        self.num_epochs = num_epochs
+        self.min_samples = min_samples
+        self.batch_size = batch_size
+
+        random.seed(seed)
+        torch.manual_seed(seed)
+
+        self.model = CNN(num_classes=max(1, dataset.num_classes)).to(self.device)
+        self.criterion = nn.CrossEntropyLoss()
+        self.optimizer = optim.Adam(self.model.parameters(), lr=0.001)
+        self.early_stopping = EarlyStopping(patience=patience, min_delta=min_delta)
+        self.best_state_dict = None
+
+    def train(self) -> tuple[float, float]:
+        """Train while the dataset grows, then on the complete dataset
+
+        Returns:
+            validation loss and accuracy of the best checkpoint
+        """
+        logger.info(f"Waiting for {self.min_samples} samples to start training")
+        self.dataset.wait_for_samples(self.min_samples)
+
+        streaming_epoch = 0
+        while not self.dataset.finished:
+            num_seen = len(self.dataset)
+            train_indices, _ = self.dataset.split()
+            streaming_epoch += 1
+            self.train_epoch(train_indices, f"Streaming epoch {streaming_epoch}")
+            # Only start the next epoch once there is new data to learn from
+            self.dataset.wait_for_samples(num_seen + 1)
+        # Raise the error that stopped the producers, if any
+        self.dataset.wait_for_samples(0)
+
+        train_indices, val_indices = self.dataset.split()
+        if not train_indices:
+            raise ValueError("No photos were received, there is nothing to train on")
+        logger.info(
+            f"Dataset complete after {streaming_epoch} streaming epochs | Train size: {len(train_indices)} | Val size: {len(val_indices)}"
+        )
+        for epoch in range(self.num_epochs):
+            self.train_epoch(train_indices, f"Epoch {epoch+1}/{self.num_epochs}")
+            if not val_indices:
+                self.save_checkpoint()
+                continue
+
+            val_loss, _ = self.evaluate(val_indices)
+            if self.early_stopping.step(val_loss, epoch):
+                self.save_checkpoint()
+            if self.early_stopping.should_stop:
+                logger.info(
+                    f"Early stopping at epoch {epoch+1}/{self.num_epochs} | best epoch: {self.early_stopping.best_epoch+1}"
+                )
+                break
+
+        if self.best_state_dict is not None:
+            self.model.load_state_dict(self.best_state_dict)
+        val_loss, val_accuracy = self.evaluate(val_indices, self.output_path)
+
+        # The image ids are relative to the run directory, like the ones of SpeciesDataset
+        save_label_sidecar(
+            self.model_path,
+            sorted(self.dataset.class_names),
+            [self.dataset.image_ids[index] for index in train_indices],
+            val_accuracy,
+        )
+        return val_loss, val_accuracy
+
+    def sync_head(self) -> None:
+        """Grow the output layer to the classes seen so far, the optimizer keeps the state of
+        every parameter but the replaced output layer"""
+        num_classes = max(1, self.dataset.num_classes)
+        if self.model.fc3.out_features == num_classes:
+            return
+        logger.debug(f"Growing the output layer to {num_classes} classes")
+        self.model.resize_head(num_classes)
+
+        old_optimizer = self.optimizer
+        self.optimizer = optim.Adam(self.model.parameters(), lr=0.001)
+        for parameter in self.model.parameters():
+            if parameter in old_optimizer.state:
+                self.optimizer.state[parameter] = old_optimizer.state[parameter]
+
+    def create_dataloader(self, indices: list[int], shuffle: bool) -> DataLoader:
+        return DataLoader(
+            Subset(self.dataset, indices), batch_size=self.batch_size, shuffle=shuffle
+        )
+
+    def to_device(self, inputs: torch.Tensor, labels: torch.Tensor):
+        """The images are kept as uint8 to fit 4 times more of them in memory"""
+        inputs = inputs.to(self.device).float().div_(255)
+        return inputs, labels.to(self.device)
+
+    def train_epoch(self, indices: list[int], name: str) -> float:
+        """Train one epoch over the input samples
+
+        Args:
+            indices: indices of the samples to train on
+            name: name of the epoch for the logs
+
+        Returns:
+            the average training loss
+        """
+        self.sync_head()
+        self.model.train()
+        running_loss = torch.zeros((), device=self.device)
+        start = time.perf_counter()
+        for inputs, labels in tqdm(self.create_dataloader(indices, shuffle=True)):
+            inputs, labels = self.to_device(inputs, labels)
+            self.optimizer.zero_grad()
+            loss = self.criterion(self.model(inputs), labels)
+            loss.backward()
+            self.optimizer.step()
+            running_loss += loss.detach() * inputs.size(0)
+
+        epoch_time = time.perf_counter() - start
+        epoch_loss = running_loss.item() / max(1, len(indices))
+        logger.info(
+            f"{name} took {epoch_time:.2f}s | {len(indices)} samples | {len(indices) / epoch_time:.1f} images/sec | Loss: {epoch_loss:.4f}"
+        )
+        return epoch_loss
+
+    def evaluate(self, indices: list[int], output_path: str = None):
+        """Evaluate the model on the input samples and write the results to output_path as JSON"""
+        self.sync_head()
+        self.model.eval()
+        accumulator = MetricsAccumulator(
+            self.model.fc3.out_features,
+            self.device,
+            class_names=list(self.dataset.class_names),
+        )
+        with torch.no_grad():
+            for inputs, labels in self.create_dataloader(indices, shuffle=False):
+                inputs, labels = self.to_device(inputs, labels)
+                outputs = self.model(inputs)
+                accumulator.update(self.criterion(outputs, labels), outputs, labels)
+
+        results = accumulator.compute()
+        logger.info(
+            f"Evaluation Loss: {results['loss']:.4f}, Accuracy: {results['accuracy']:.4f}"
+        )
+        if output_path is not None:
+            with open(output_path, "w") as f:
+                json.dump(results, f, indent=4)
+            logger.debug(f"Output saved to: {output_path}")
+        return results["loss"], results["accuracy"]
+
+    def save_checkpoint(self) -> None:
+        """Keep the weights in memory and save them with the classes sorted by name"""
+        self.best_state_dict = copy.deepcopy(self.model.state_dict())
+
+        order = sorted(
+            range(self.dataset.num_classes), key=self.dataset.class_names.__getitem__
+        )
+        state_dict = dict(self.best_state_dict)
+        state_dict["fc3.weight"] = state_dict["fc3.weight"][order]
+        state_dict["fc3.bias"] = state_dict["fc3.bias"][order]
+        torch.save(state_dict, self.model_path)
+        logger.debug(f"Saved the best model so far to: {self.model_path}")
@@ -0,0 +1,36 @@
+import torch.nn as nn
+
+
+class StudentCNN(nn.Module):
+    """Compact CNN for CPU serving, trained by distilling a CNN. Global average pooling replaces
+    the large fully connected layers of the CNN, so the model has a few percent of its weights.
+
+    * num_classes: number of output classes
+    * width: number of channels of the first convolution, doubled by every following one
+    """
+
+    def __init__(self, num_classes: int, width: int = 16):
+        super(StudentCNN, self).__init__()
+        self.backbone = nn.Sequential(
+            self.block(3, width),
+            self.block(width, width * 2),
+            self.block(width * 2, width * 4),
+            self.block(width * 4, width * 8),
+        )
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.dropout = nn.Dropout(0.2)
+        self.fc = nn.Linear(width * 8, num_classes)
+
+    @staticmethod
+    def block(in_channels: int, out_channels: int) -> nn.Sequential:
+        """Convolution, batch norm and ReLU, halving the resolution"""
+        return nn.Sequential(
+            nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1, bias=False),
+            nn.BatchNorm2d(out_channels),
+            nn.ReLU(inplace=True),
+            nn.MaxPool2d(kernel_size=2, stride=2),
+        )
+
+    def forward(self, x):
+        x = self.pool(self.backbone(x)).flatten(1)
+        return self.fc(self.dropout(x))
@@ -0,0 +1,268 @@
+from library.decoded_dataset import DecodedDataset
+from library.run_report import get_run_report
+from model.trainer import ModelTrainer
+
+import itertools
+import json
+import logging
+import math
+import multiprocessing as mp
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import torch
+
+logger = logging.getLogger(__name__)
+
+# ModelTrainer arguments a search space can set
+SWEEP_PARAMETERS = (
+    "learning_rate",
+    "batch_size",
+    "train_fraction",
+    "num_epochs",
+    "val_subsample",
+    "patience",
+    "min_delta",
+    "seed",
+)
+
+
+def load_search_space(search_space_path: str) -> dict:
+    """Load and validate a search space JSON file. Every parameter maps to a list of values,
+    or for random search to a range {"min": 0.0001, "max": 0.01, "log": true}
+
+    Examples:
+
+        >>>  {"learning_rate": [0.01, 0.001, 0.0001], "batch_size": [64, 128, 256]}
+
+    Args:
+        search_space_path: path to the search space JSON
+
+    Returns:
+        the search space
+    """
+    with open(search_space_path, "r") as file:
+        search_space = json.load(file)
+
+    for name, values in search_space.items():
+        if name not in SWEEP_PARAMETERS:
+            raise ValueError(
+                f"Unknown sweep parameter: {name}, expected one of {SWEEP_PARAMETERS}"
+            )
+        if isinstance(values, dict):
+            if "min" not in values or "max" not in values:
+                raise ValueError(f"Range of {name} needs a min and a max: {values}")
+        elif not isinstance(values, list) or not values:
+            raise ValueError(f"Values of {name} must be a non-empty list: {values}")
+    return search_space
+
+
+def grid_trials(search_space: dict) -> list[dict]:
+    """Get every combination of the values of the search space"""
+    for name, values in search_space.items():
+        if isinstance(values, dict):
+            raise ValueError(f"Grid search needs a list of values for {name}")
+
+    names = list(search_space)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(search_space[name] for name in names))
+    ]
+
+
+def random_trials(search_space: dict, num_trials: int, seed: int = 42) -> list[dict]:
+    """Sample num_trials configurations of the search space. Lists are sampled uniformly,
+    ranges uniformly or log-uniformly, and ranges with integer bounds give integers"""
+    rng = random.Random(seed)
+    trials = []
+    for _ in range(num_trials):
+        trial = {}
+        for name, values in search_space.items():
+            if isinstance(values, list):
+                trial[name] = rng.choice(values)
+                continue
+            low, high = values["min"], values["max"]
+            if values.get("log", False):
+                value = math.exp(rng.uniform(math.log(low), math.log(high)))
+            else:
+                value = rng.uniform(low, high)
+            if isinstance(low, int) and isinstance(high, int):
+                value = int(round(value))
+            trial[name] = value
+        trials.append(trial)
+    return trials
+
+
+class TrialPruner:
+    """Median stopping rule shared by the trials of a sweep: a trial is stopped when its
+    validation loss after an epoch is worse than the median of the losses the other trials
+    reported for the same epoch.
+
+    * history: epoch -> reported losses, a multiprocessing Manager dict shared by the trials
+    * lock: Manager lock guarding the history
+    * min_trials: number of other trials that must have reported the epoch before comparing
+    * warmup_epochs: number of epochs every trial runs before it can be stopped
+    """
+
+    def __init__(self, history, lock, min_trials: int = 3, warmup_epochs: int = 1):
+        self.history = history
+        self.lock = lock
+        self.min_trials = min_trials
+        self.warmup_epochs = warmup_epochs
+
+    def should_prune(self, epoch: int, value: float) -> bool:
+        """Report the validation loss of an epoch and check if the trial should stop
+
+        Args:
+            epoch: epoch index, starting at 0
+            value: validation loss of the epoch
+
+        Returns:
+            True if the trial is worse than the median of the other trials
+        """
+        with self.lock:
+            reported = list(self.history.get(epoch, []))
+            self.history[epoch] = reported + [value]
+        if epoch + 1 < self.warmup_epochs or len(reported) < self.min_trials:
+            return False
+        return value > statistics.median(reported)
+
+
+def init_worker(num_threads: int, log_level: int) -> None:
+    """Limit the threads of a trial process so concurrent trials do not oversubscribe the cores"""
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["MKL_NUM_THREADS"] = str(num_threads)
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only possible before the first parallel work of the process
+        pass
+    logging.basicConfig(encoding="utf-8", level=log_level)
+
+
+def run_trial(
+    trial_id: int,
+    params: dict,
+    images_path: str,
+    dataset_dir: str,
+    sweep_dir: str,
+    pruner: TrialPruner = None,
+) -> tuple[dict, dict]:
+    """Train one configuration on the shared decoded dataset
+
+    Returns:
+        the record of the trial for the results table and the run report of the trial
+    """
+    # A worker process runs several trials, every trial reports its own spans and counters
+    report = get_run_report()
+    report.reset()
+    started_at = time.time()
+    start = time.perf_counter()
+    trainer = ModelTrainer(
+        os.path.join(sweep_dir, f"trial_{trial_id}.pt"),
+        dataset_dir,
+        os.path.join(sweep_dir, f"trial_{trial_id}.json"),
+        dataset=DecodedDataset(images_path),
+        pruner=pruner,
+        **params,
+    )
+    record = {
+        "trial": trial_id,
+        **params,
+        "val_loss": trainer.val_loss,
+        "val_accuracy": trainer.val_accuracy,
+        "best_epoch": (
+            trainer.early_stopping.best_epoch + 1
+            if trainer.early_stopping.best_epoch is not None
+            else None
+        ),
+        "epochs": trainer.epochs_trained,
+        "status": "pruned" if trainer.pruned else "completed",
+        "seconds": time.perf_counter() - start,
+    }
+    return record, {**report.to_dict(), "start_timestamp": started_at}
+
+
+def run_sweep(
+    dataset_dir: str,
+    sweep_dir: str,
+    cache_dir: str,
+    trials: list[dict],
+    max_workers: int = None,
+    threads_per_trial: int = None,
+    prune: bool = True,
+    min_trials: int = 3,
+    warmup_epochs: int = 1,
+) -> pd.DataFrame:
+    """Run the trials concurrently on one decoded copy of the dataset
+
+    Args:
+        dataset_dir: directory of the dataset
+        sweep_dir: directory for the checkpoints and evaluations of the trials
+        cache_dir: directory of the decoded dataset
+        trials: ModelTrainer arguments of every trial
+        max_workers: number of trials running at once, one per core by default
+        threads_per_trial: torch threads of every trial, the cores split between the workers by default
+        prune: whether to stop trials that fall behind the others
+        min_trials: trials that must report an epoch before pruning compares against it
+        warmup_epochs: epochs every trial runs before it can be pruned
+
+    Returns:
+        the results table, best trial first
+    """
+    cpu_count = os.cpu_count() or 1
+    max_workers = max_workers or max(1, min(len(trials), cpu_count))
+    threads_per_trial = threads_per_trial or max(1, cpu_count // max_workers)
+    images_path = DecodedDataset.build(dataset_dir, cache_dir)
+
+    logger.info(
+        f"Running {len(trials)} trials | {max_workers} at once | {threads_per_trial} threads each"
+    )
+    # The trials run in other processes, their spans and counters are merged into the run
+    # report of this process once they return
+    report = get_run_report()
+    context = mp.get_context("spawn")
+    records = []
+    with context.Manager() as manager, ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(threads_per_trial, logging.getLogger().getEffectiveLevel()),
+    ) as executor:
+        pruner = (
+            TrialPruner(manager.dict(), manager.Lock(), min_trials, warmup_epochs)
+            if prune
+            else None
+        )
+        futures = {
+            executor.submit(
+                run_trial, trial_id, params, images_path, dataset_dir, sweep_dir, pruner
+            ): (trial_id, params)
+            for trial_id, params in enumerate(trials)
+        }
+        for future in as_completed(futures):
+            trial_id, params = futures[future]
+            try:
+                record, trial_report = future.result()
+                # The clocks of the processes only agree on the wall time
+                offset = (
+                    trial_report["start_timestamp"]
+                    - time.time()
+                    + time.perf_counter()
+                    - report.start_time
+                )
+                report.merge(trial_report, offset)
+            except Exception as e:
+                logger.error(f"Trial {trial_id} failed: {e}")
+                record = {"trial": trial_id, **params, "status": "failed"}
+            logger.info(f"Trial {trial_id} {record['status']}: {record}")
+            records.append(record)
+
+    results = pd.DataFrame(records)
+    if "val_loss" in results:
+        results = results.sort_values(["val_loss", "trial"], na_position="last")
+    return results
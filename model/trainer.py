@@ -1,13 +1,40 @@
 from library.species_dataset import SpeciesDataset
+from library.dataset_view import DatasetView
 from library.base_io import BaseIO
-from model.cnn import CNN
+from model.batch_size_finder import BatchSizeFinder
+from model.cnn import CNN, CNNHead
+from model.early_stopping import EarlyStopping
+from model.feature_cache import FeatureCache, FeatureDataset
+from model.label_sidecar import load_label_sidecar, save_label_sidecar
+from model.resolution_schedule import ResolutionSchedule
+from library.run_report import span, count
+from model.metrics import MetricsAccumulator
+from model.training_metrics import TrainingMetrics, create_step_profiler
+from model.distributed import (
+    ShardSampler,
+    all_reduce_min,
+    barrier,
+    broadcast_object,
+    get_local_world_size,
+    get_rank,
+    get_world_size,
+    is_main_process,
+    unwrap_model,
+)
 
+import copy
+import json
+import math
 import random
 import logging
+import time
+from contextlib import nullcontext
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, random_split
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Dataset, Subset, random_split
+from torch.utils.data.distributed import DistributedSampler
 from torchvision import transforms
 from tqdm import tqdm
 
@@ -22,12 +49,46 @@ class ModelTrainer:
         output_path: str,
         num_epochs: int = 20,
         seed: int = 42,
+        patience: int = 5,
+        min_delta: float = 0.0,
+        val_subsample: float = None,
+        metrics_path: str = None,
+        profile_steps: tuple[int, int] = None,
+        trace_path: str = None,
+        head_only: bool = False,
+        backbone_path: str = None,
+        feature_cache_dir: str = None,
+        learning_rate: float = 0.001,
+        batch_size: int = 512,
+        train_fraction: float = 0.75,
+        dataset: Dataset = None,
+        pruner=None,
+        samples: list[tuple[str, str]] = None,
+        view_path: str = None,
+        incremental: bool = False,
+        base_model_path: str = None,
+        replay_fraction: float = 0.1,
+        micro_batch_size: int = None,
+        auto_batch_size: bool = False,
+        memory_budget_mb: float = None,
+        resolution_schedule: ResolutionSchedule = None,
     ) -> None:
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # Distributed training runs on the CPU with the gloo backend, see model.distributed.launch
+        self.rank = get_rank()
+        self.world_size = get_world_size()
+        if self.world_size > 1:
+            self.device = torch.device("cpu")
+        else:
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model_path = model_path
         self.dataset_dir = dataset_dir
         self.output_path = output_path
         self.seed = seed
+        self.head_only = head_only
+        self.batch_size = batch_size
+        self.pruner = pruner
+        self.pruned = False
+        self.resolution_schedule = resolution_schedule
 
         random.seed(self.seed)
         torch.manual_seed(self.seed)
@@ -40,49 +101,341 @@ class ModelTrainer:
             ]
         )
 
-        # Load the dataset
-        logger.info(f"Loading the dataset: {dataset_dir}")
-        dataset = SpeciesDataset(self.dataset_dir, transform=self.transform)
+        # A view brings its own samples and its own stratified split
+        view = None
+        if view_path:
+            if dataset is not None or samples is not None:
+                raise ValueError("A view can not be combined with a dataset or samples")
+            view = DatasetView.load(view_path)
+            samples = view.samples()
 
-        # Define the split sizes
-        train_size = int(0.75 * len(dataset))
-        val_size = len(dataset) - train_size
-        batch_size = 512
-        train_dataset, val_dataset = random_split(dataset, [train_size, val_size])
+        # Load the dataset, unless an already decoded one is passed in
+        if dataset is None:
+            logger.info(f"Loading the dataset: {dataset_dir}")
+            dataset = SpeciesDataset(
+                self.dataset_dir, transform=self.transform, samples=samples
+            )
+        elif head_only:
+            raise ValueError("Head-only training needs the images of the dataset")
 
-        train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-        val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
+        # Incremental training starts from the base model and only trains on the images it
+        # has not seen, plus a replay sample of the ones it has
+        base = None
+        if incremental:
+            if not isinstance(dataset, SpeciesDataset) or view is not None:
+                raise ValueError(
+                    "Incremental training needs the images of the dataset and its own split"
+                )
+            base = self.prepare_incremental(
+                dataset, base_model_path or model_path, replay_fraction
+            )
+
+        if view is not None:
+            train_size, val_size = len(view.train), len(view.val)
+            train_dataset = Subset(dataset, list(range(train_size)))
+            val_dataset = Subset(dataset, list(range(train_size, len(dataset))))
+        else:
+            # Define the split sizes
+            if not 0.0 < train_fraction < 1.0:
+                raise ValueError(
+                    f"Train fraction must be in (0, 1), got: {train_fraction}"
+                )
+            split_dataset = (
+                Subset(dataset, base["indices"]) if base is not None else dataset
+            )
+            train_size = int(train_fraction * len(split_dataset))
+            val_size = len(split_dataset) - train_size
+            # Every rank sees the same split since the generator is seeded identically
+            train_dataset, val_dataset = random_split(
+                split_dataset, [train_size, val_size]
+            )
+            if base is not None:
+                # Index the dataset itself, the head-only feature cache is built over all of it
+                train_dataset = Subset(
+                    dataset, [base["indices"][i] for i in train_dataset.indices]
+                )
+                val_dataset = Subset(
+                    dataset, [base["indices"][i] for i in val_dataset.indices]
+                )
         logger.info(
-            f"Loaded the dataset: {dataset_dir} | Train size: {train_size} | Val size: {val_size}"
+            f"Loaded the dataset: {dataset_dir} | Train size: {train_size} | Val size: {val_size} | Rank: {self.rank}/{self.world_size}"
         )
 
-        num_clases = len(dataset.lables_to_index)
-        self.model = CNN(num_classes=num_clases).to(self.device)
+        # Progressive resizing changes the transform of the training images every phase, the
+        # validation images keep the full size transform
+        if resolution_schedule is not None:
+            if head_only or not isinstance(dataset, SpeciesDataset):
+                raise ValueError("Progressive resizing needs the images of the dataset")
+            self.train_images = copy.copy(dataset)
+            train_dataset = Subset(self.train_images, train_dataset.indices)
+
+        self.num_classes = len(dataset.class_names)
+        self.class_names = dataset.class_names
+        self.model = CNN(num_classes=self.num_classes).to(self.device)
 
         # If a model exists, load the model
-        if BaseIO.is_path_file(self.model_path):
-            self.model.load_state_dict(torch.load(self.model_path))
+        if base is not None:
+            # The new classes get new rows in the output layer, the others keep their weights
+            self.model.resize_head(base["num_classes"])
+            self.model.load_state_dict(
+                torch.load(base["model_path"], map_location=self.device)
+            )
+            self.model.resize_head(self.num_classes)
+            logger.info(
+                f"Base model loaded from: {base['model_path']} | Classes: {base['num_classes']} -> {self.num_classes}"
+            )
+        elif BaseIO.is_path_file(self.model_path):
+            self.model.load_state_dict(
+                torch.load(self.model_path, map_location=self.device)
+            )
             logger.info(f"Model loaded from: {self.model_path}")
         self.model.eval()
 
+        # In head-only mode the backbone is frozen, so its embeddings are computed once and
+        # the head is trained on the cached embeddings instead of the images
+        self.eval_model = self.model
+        parameters = self.model.parameters()
+        if self.head_only:
+            self.load_backbone(backbone_path)
+            self.model.freeze_backbone()
+            feature_dataset = self.cache_features(dataset, feature_cache_dir)
+            train_dataset = Subset(feature_dataset, train_dataset.indices)
+            val_dataset = Subset(feature_dataset, val_dataset.indices)
+            self.eval_model = CNNHead(self.model)
+            parameters = self.model.head_parameters()
+
+        # The batch size stays the number of samples per optimizer step, the loaders only
+        # hold one micro-batch in memory at a time
         self.criterion = nn.CrossEntropyLoss()
-        self.optimizer = optim.Adam(self.model.parameters(), lr=0.001)
+        self.micro_batch_size, self.accumulation_steps = self.plan_micro_batches(
+            train_dataset, micro_batch_size, auto_batch_size, memory_budget_mb
+        )
+        loader_batch_size = self.micro_batch_size * self.world_size
+        self.train_loader = self.create_dataloader(
+            train_dataset, loader_batch_size, shuffle=True
+        )
+        self.val_loader = self.create_dataloader(
+            val_dataset, loader_batch_size, shuffle=False, evaluation=True
+        )
+        epoch_val_loader = self.create_dataloader(
+            self.subsample_dataset(val_dataset, val_subsample),
+            loader_batch_size,
+            shuffle=False,
+            evaluation=True,
+        )
+
+        # The DDP wrapper all-reduces the gradients across the ranks during backward
+        self.train_model_module = self.eval_model
+        if self.world_size > 1:
+            self.train_model_module = DistributedDataParallel(self.eval_model)
+
+        self.optimizer = optim.Adam(parameters, lr=learning_rate)
         self.num_epochs = num_epochs
+        self.early_stopping = EarlyStopping(patience=patience, min_delta=min_delta)
 
-        self.train_model(
-            self.model,
-            train_loader,
-            self.criterion,
-            self.optimizer,
-            self.model_path,
-            self.num_epochs,
+        # Step timings and the profiler capture are only recorded by the main process
+        self.training_metrics = TrainingMetrics(
+            metrics_path if is_main_process() else None,
+            self.device,
+            run_info={
+                "dataset_dir": dataset_dir,
+                "device": str(self.device),
+                "world_size": self.world_size,
+                "batch_size": self.batch_size,
+                "micro_batch_size": self.micro_batch_size,
+                "accumulation_steps": self.accumulation_steps,
+                "learning_rate": learning_rate,
+                "train_size": train_size,
+                "val_size": val_size,
+                "head_only": self.head_only,
+                "resolution_schedule": (
+                    resolution_schedule.to_dict() if resolution_schedule else None
+                ),
+            },
         )
+        self.profiler = None
+        if profile_steps and is_main_process():
+            self.profiler = create_step_profiler(
+                *profile_steps, trace_path, self.device
+            )
 
-        avg_loss, accuracy = self.evaluate_model(
-            self.model, val_loader, self.criterion, self.output_path
-        )
+        # The accuracy of the base model in its sidecar was measured on another split, so the
+        # base model is measured again on the split of this run. Only the samples of its own
+        # classes count, the rows of the new classes in its output layer are untrained
+        target_accuracy = None
+        recovery_loader = None
+        if base is not None:
+            base_classes = set(base["class_names"])
+            recovery_indices = [
+                index
+                for index in val_dataset.indices
+                if dataset.label_names[index] in base_classes
+            ]
+            if recovery_indices:
+                recovery_loader = self.create_dataloader(
+                    self.subsample_dataset(
+                        Subset(val_dataset.dataset, recovery_indices), val_subsample
+                    ),
+                    loader_batch_size,
+                    shuffle=False,
+                    evaluation=True,
+                )
+                _, target_accuracy = self.evaluate_model(
+                    self.eval_model, recovery_loader, self.criterion
+                )
+                logger.info(
+                    f"Base model accuracy on the validation samples of its classes: {target_accuracy:.4f}"
+                )
+
+        with span("training"):
+            self.train_model(
+                self.train_model_module,
+                self.train_loader,
+                self.criterion,
+                self.optimizer,
+                self.model_path,
+                self.num_epochs,
+                val_loader=epoch_val_loader,
+                early_stopping=self.early_stopping,
+                target_accuracy=target_accuracy,
+                recovery_loader=recovery_loader,
+            )
+        self.training_metrics.close()
+        if resolution_schedule is not None:
+            self.train_images.transform = self.transform
+
+        # Evaluate the best checkpoint on the full validation split. Only the main process
+        # wrote it, the other ranks, possibly on other nodes, get its weights from it
+        state_dict = None
+        if is_main_process() and BaseIO.is_path_file(self.model_path):
+            state_dict = torch.load(self.model_path, map_location="cpu")
+        state_dict = broadcast_object(state_dict)
+        if state_dict is not None:
+            self.model.load_state_dict(state_dict)
+
+        with span("evaluation"):
+            self.val_loss, self.val_accuracy = self.evaluate_model(
+                self.eval_model,
+                self.val_loader,
+                self.criterion,
+                self.output_path if is_main_process() else None,
+            )
         self.model.eval()
 
+        # The class order and the trained images are kept next to the checkpoint for the next
+        # run. The validation images are left out, so the next run can still train on them
+        if is_main_process():
+            image_ids = None
+            if isinstance(dataset, SpeciesDataset):
+                image_ids = [dataset.get_image_id(i) for i in train_dataset.indices]
+                if base is not None:
+                    image_ids = list(base["image_ids"] | set(image_ids))
+            save_label_sidecar(
+                self.model_path, self.class_names, image_ids, self.val_accuracy
+            )
+
+    def create_dataloader(
+        self, dataset: Dataset, batch_size: int, shuffle: bool, evaluation: bool = False
+    ) -> DataLoader:
+        """Create a DataLoader for the input dataset. When training is distributed, the dataset
+        is sharded across the ranks and the batch size is split so the global batch size stays the same
+
+        Args:
+            dataset: dataset to load
+            batch_size: global batch size
+            shuffle: whether to shuffle the samples every epoch
+            evaluation: shard without repeating samples, the ranks may get one sample more
+                than the others
+
+        Returns:
+            the DataLoader
+        """
+        if self.world_size == 1:
+            return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle)
+
+        if evaluation:
+            sampler = ShardSampler(dataset, self.world_size, self.rank)
+        else:
+            sampler = DistributedSampler(
+                dataset,
+                num_replicas=self.world_size,
+                rank=self.rank,
+                shuffle=shuffle,
+                seed=self.seed,
+            )
+        return DataLoader(
+            dataset,
+            batch_size=max(1, batch_size // self.world_size),
+            sampler=sampler,
+        )
+
+    def plan_micro_batches(
+        self,
+        train_dataset: Dataset,
+        micro_batch_size: int,
+        auto_batch_size: bool,
+        memory_budget_mb: float,
+    ) -> tuple[int, int]:
+        """Split the per-rank batch into micro-batches of the input size, or of the largest size
+        that fits in the memory budget. All the ranks agree on the smallest micro-batch size
+
+        Args:
+            train_dataset: dataset to train on, its first sample gives the input shape
+            micro_batch_size: number of samples per forward and backward pass, None for the batch size
+            auto_batch_size: whether to probe the largest micro-batch size that fits
+            memory_budget_mb: memory budget of every process, by default the free memory is
+                split between the processes of the node, see BatchSizeFinder
+
+        Returns:
+            the micro-batch size and the number of micro-batches per optimizer step
+        """
+        per_rank_batch_size = max(1, self.batch_size // self.world_size)
+        if auto_batch_size:
+            if micro_batch_size is not None:
+                raise ValueError(
+                    "A micro-batch size can not be combined with the automatic batch size"
+                )
+            if len(train_dataset) == 0:
+                raise ValueError("The automatic batch size needs training samples")
+
+            # Adam keeps two moments of every trained parameter once it takes its first step
+            optimizer_bytes = 2 * sum(
+                parameter.numel() * parameter.element_size()
+                for parameter in self.eval_model.parameters()
+                if parameter.requires_grad
+            )
+            finder = BatchSizeFinder(
+                self.eval_model,
+                self.criterion,
+                train_dataset[0][0],
+                self.num_classes,
+                self.device,
+                memory_budget_mb=memory_budget_mb,
+                reserved_bytes=optimizer_bytes,
+                num_local_processes=get_local_world_size(),
+            )
+            # A batch never holds more samples than the shard of a rank
+            shard_size = math.ceil(len(train_dataset) / self.world_size)
+            with span("batch_size_probe"):
+                micro_batch_size = finder.find(min(per_rank_batch_size, shard_size))
+            micro_batch_size = int(
+                all_reduce_min(torch.tensor(micro_batch_size)).item()
+            )
+        elif micro_batch_size is None:
+            micro_batch_size = per_rank_batch_size
+        elif micro_batch_size < 1:
+            raise ValueError(f"Micro-batch size must be >= 1, got: {micro_batch_size}")
+
+        accumulation_steps = math.ceil(
+            per_rank_batch_size / min(micro_batch_size, per_rank_batch_size)
+        )
+        # Spread the batch evenly, e.g. 512 in micro-batches of 200 gives 3 micro-batches of 171
+        micro_batch_size = math.ceil(per_rank_batch_size / accumulation_steps)
+        logger.info(
+            f"Batch size: {self.batch_size} | Micro-batch size: {micro_batch_size} | Accumulation steps: {accumulation_steps}"
+        )
+        return micro_batch_size, accumulation_steps
+
     def train_model(
         self,
         model: CNN,
@@ -91,62 +444,350 @@ class ModelTrainer:
         optimizer: optim.Optimizer,
         model_path: str,
         num_epochs: int,
+        val_loader: DataLoader = None,
+        early_stopping: EarlyStopping = None,
+        target_accuracy: float = None,
+        recovery_loader: DataLoader = None,
     ):
-        model.train()
+        """Train the input model, validating after every epoch when a val_loader is passed in.
+        Only the checkpoint with the best validation loss is kept at model_path. Training stops
+        once the accuracy on recovery_loader reaches target_accuracy, when both are passed in.
+
+        The gradients of accumulation_steps micro-batches are summed before every optimizer
+        step, each loss is weighted by its share of the samples of the step so the update is
+        the same as for one batch of all of them."""
         logger.info(
-            f"Training the model for {num_epochs} epochs | device: {self.device}"
+            f"Training the model for {num_epochs} epochs | device: {self.device} | world size: {self.world_size}"
         )
+        if self.resolution_schedule is not None:
+            self.resolution_schedule.validate(num_epochs)
+        metrics = self.training_metrics
+        self.epochs_trained = 0
+        if self.profiler is not None:
+            self.profiler.start()
+
         for epoch in range(num_epochs):
-            running_loss = 0.0
-            for inputs, labels in tqdm(dataloader):
+            model.train()
+            accumulation_steps = self.accumulation_steps
+            if self.resolution_schedule is not None:
+                dataloader, accumulation_steps = self.get_epoch_loader(epoch)
+            if isinstance(dataloader.sampler, DistributedSampler):
+                dataloader.sampler.set_epoch(epoch)
+
+            # The loss is summed on the device and only read once at the end of the epoch
+            running_loss = torch.zeros((), device=self.device)
+            num_samples = 0
+            num_micro_batches = len(dataloader)
+            step_samples = dataloader.batch_size * accumulation_steps
+            epoch_samples = len(dataloader.sampler)
+            epoch_start = time.perf_counter()
+            metrics.start_data_wait()
+            for index, (inputs, labels) in enumerate(
+                tqdm(dataloader, disable=not is_main_process())
+            ):
+                metrics.lap("data_wait")
                 inputs, labels = inputs.to(self.device), labels.to(self.device)
+                metrics.lap("host_to_device")
 
-                optimizer.zero_grad()
+                step, micro_step = divmod(index, accumulation_steps)
+                last_micro_step = (
+                    micro_step == accumulation_steps - 1
+                    or index == num_micro_batches - 1
+                )
+                if micro_step == 0:
+                    optimizer.zero_grad()
 
-                outputs = model(inputs)
-                loss = criterion(outputs, labels)
-                loss.backward()
-                optimizer.step()
+                # The ranks only all-reduce the gradients on the last micro-batch of a step
+                sync = nullcontext()
+                if not last_micro_step and isinstance(model, DistributedDataParallel):
+                    sync = model.no_sync()
+                with sync:
+                    outputs = model(inputs)
+                    loss = criterion(outputs, labels)
+                    metrics.lap("forward")
+                    batch_share = inputs.size(0) / min(
+                        step_samples, epoch_samples - step * step_samples
+                    )
+                    (loss * batch_share).backward()
+                    metrics.lap("backward")
+                if last_micro_step:
+                    optimizer.step()
+                    metrics.lap("optimizer")
 
-                running_loss += loss.item() * inputs.size(0)
+                running_loss += loss.detach() * inputs.size(0)
+                num_samples += inputs.size(0)
 
-            epoch_loss = running_loss / len(dataloader.dataset)
+                metrics.end_step(epoch, inputs.size(0))
+                if self.profiler is not None:
+                    self.profiler.step()
+
+            epoch_time = time.perf_counter() - epoch_start
+            epoch_loss = running_loss.item() / max(1, num_samples)
             logger.debug(f"Epoch {epoch+1}/{num_epochs}, Loss: {epoch_loss:.4f}")
+            logger.info(
+                f"Epoch {epoch+1}/{num_epochs} took {epoch_time:.2f}s | {num_samples * self.world_size / epoch_time:.1f} images/sec"
+            )
+            metrics.end_epoch(epoch, epoch_loss, num_samples, epoch_time)
+            self.epochs_trained = epoch + 1
+            count("epochs")
+            count("images_trained", num_samples)
+
+            if val_loader is None or len(val_loader.dataset) == 0:
+                self.save_checkpoint(model_path)
+                continue
 
-            torch.save(model.state_dict(), model_path)
+            # The shards of the ranks can differ in size, the DDP wrapper is left out so no
+            # rank waits on a collective of the others
+            val_loss, val_accuracy = self.evaluate_model(
+                unwrap_model(model), val_loader, criterion
+            )
+            logger.debug(
+                f"Epoch {epoch+1}/{num_epochs}, Val Loss: {val_loss:.4f}, Val Accuracy: {val_accuracy:.4f}"
+            )
+            # Low resolution epochs are never kept, early stopping and the other stop
+            # conditions only start with the full resolution epochs
+            if (
+                self.resolution_schedule is not None
+                and not self.resolution_schedule.is_full_size(epoch)
+            ):
+                continue
+            if early_stopping is None or early_stopping.step(val_loss, epoch):
+                self.save_checkpoint(model_path)
+                logger.debug(f"Saved the best model so far to: {model_path}")
 
-        torch.save(model.state_dict(), model_path)
+            if target_accuracy is not None and recovery_loader is not None:
+                _, recovery_accuracy = self.evaluate_model(
+                    unwrap_model(model), recovery_loader, criterion
+                )
+                if recovery_accuracy >= target_accuracy:
+                    logger.info(
+                        f"Base classes recovered at epoch {epoch+1}/{num_epochs} | accuracy: {recovery_accuracy:.4f} >= {target_accuracy:.4f}"
+                    )
+                    break
+
+            if early_stopping is not None and early_stopping.should_stop:
+                logger.info(
+                    f"Early stopping at epoch {epoch+1}/{num_epochs} | best epoch: {early_stopping.best_epoch+1}"
+                )
+                break
+
+            # A sweep stops the trials that fall behind the other trials
+            if (
+                self.pruner is not None
+                and epoch + 1 < num_epochs
+                and self.pruner.should_prune(epoch, val_loss)
+            ):
+                logger.info(f"Pruned at epoch {epoch+1}/{num_epochs}")
+                self.pruned = True
+                break
+
+        if self.profiler is not None:
+            self.profiler.stop()
         logger.info(f"Model saved to: {model_path}")
 
+    def get_epoch_loader(self, epoch: int) -> tuple[DataLoader, int]:
+        """Resize the training images to the image size of the input epoch and get a loader
+        with the micro-batch size of the epoch. Low resolution epochs run fewer, larger
+        micro-batches per optimizer step, the batch size of the step and so the learning
+        rate stay the same
+
+        Args:
+            epoch: epoch to train, counted from 0
+
+        Returns:
+            the DataLoader of the training images and the number of micro-batches per
+            optimizer step
+        """
+        image_size = self.resolution_schedule.image_size(epoch)
+        batch_scale = self.resolution_schedule.batch_scale(epoch)
+        # Spread the batch evenly over the micro-batches, like plan_micro_batches
+        per_rank_batch_size = max(1, self.batch_size // self.world_size)
+        accumulation_steps = math.ceil(self.accumulation_steps / batch_scale)
+        micro_batch_size = math.ceil(per_rank_batch_size / accumulation_steps)
+        if epoch == 0 or image_size != self.resolution_schedule.image_size(epoch - 1):
+            logger.info(
+                f"Training at {image_size}x{image_size} from epoch {epoch+1} | Micro-batch size: {micro_batch_size} | Accumulation steps: {accumulation_steps}"
+            )
+        self.train_images.transform = transforms.Compose(
+            [transforms.Resize((image_size, image_size)), transforms.ToTensor()]
+        )
+        loader = self.create_dataloader(
+            self.train_loader.dataset,
+            micro_batch_size * self.world_size,
+            shuffle=True,
+        )
+        return loader, accumulation_steps
+
+    def save_checkpoint(self, model_path: str) -> None:
+        """Save the weights of the full model, also when only the head is trained.
+        Only the main process writes the checkpoint"""
+        if is_main_process():
+            torch.save(self.model.state_dict(), model_path)
+
+    def prepare_incremental(
+        self, dataset: SpeciesDataset, base_model_path: str, replay_fraction: float
+    ) -> dict:
+        """Give the classes of the base model their old class indices and append the new
+        classes, then select the images the base model has not seen plus a replay sample
+
+        Args:
+            dataset: dataset of the images
+            base_model_path: checkpoint to continue from, with its label sidecar
+            replay_fraction: fraction of the already seen images trained on again
+
+        Returns:
+            the base model info: model_path, num_classes, class_names, image_ids and the
+            dataset indices to train and validate on
+        """
+        if not BaseIO.is_path_file(base_model_path):
+            raise ValueError(f"Base model not found: {base_model_path}")
+        sidecar = load_label_sidecar(base_model_path)
+        if sidecar is None or sidecar.get("image_ids") is None:
+            raise ValueError(
+                f"Incremental training needs the label sidecar of the base model: {base_model_path}"
+            )
+        if not 0.0 <= replay_fraction <= 1.0:
+            raise ValueError(
+                f"Replay fraction must be in [0, 1], got: {replay_fraction}"
+            )
+
+        base_classes = sidecar["class_names"]
+        new_classes = sorted(set(dataset.label_names) - set(base_classes))
+        dataset.set_class_names(base_classes + new_classes)
+
+        # Only the training images of the base model count as seen, its validation images
+        # are new images for this run
+        seen = set(sidecar["image_ids"])
+        new_indices, seen_indices = [], []
+        for index in range(len(dataset)):
+            if dataset.get_image_id(index) in seen:
+                seen_indices.append(index)
+            else:
+                new_indices.append(index)
+        if not new_indices:
+            raise ValueError(
+                f"No images the base model has not seen: {base_model_path}"
+            )
+
+        replay_indices = random.Random(self.seed).sample(
+            seen_indices, int(replay_fraction * len(seen_indices))
+        )
+        logger.info(
+            f"Incremental training | New classes: {len(new_classes)} | New images: {len(new_indices)} | Replayed images: {len(replay_indices)}/{len(seen_indices)}"
+        )
+        return {
+            "model_path": base_model_path,
+            "num_classes": len(base_classes),
+            "class_names": base_classes,
+            "image_ids": seen,
+            "indices": sorted(new_indices + replay_indices),
+        }
+
+    def load_backbone(self, backbone_path: str) -> None:
+        """Load only the backbone weights of the input checkpoint, so a backbone trained on
+        another label set can be reused with a new head
+
+        Args:
+            backbone_path: path to a CNN checkpoint, None keeps the current backbone
+        """
+        if backbone_path is None:
+            if not BaseIO.is_path_file(self.model_path):
+                logger.warning(
+                    "Training the head on an untrained backbone, pass a backbone checkpoint"
+                )
+            return
+        if not BaseIO.is_path_file(backbone_path):
+            raise ValueError(f"Backbone checkpoint not found: {backbone_path}")
+
+        state_dict = torch.load(backbone_path, map_location=self.device)
+        backbone = {
+            name: value
+            for name, value in state_dict.items()
+            if name in self.model.backbone_state_dict()
+        }
+        self.model.load_state_dict(backbone, strict=False)
+        logger.info(f"Backbone loaded from: {backbone_path}")
+
+    def cache_features(self, dataset: SpeciesDataset, cache_dir: str) -> Dataset:
+        """Compute the backbone embeddings of the images that are not cached yet
+
+        Args:
+            dataset: dataset of the images
+            cache_dir: directory of the feature cache
+
+        Returns:
+            dataset of the cached embeddings and the labels, in the order of the input dataset
+        """
+        if cache_dir is None:
+            raise ValueError("Head-only training needs a feature cache directory")
+
+        cache = FeatureCache(cache_dir, self.model, self.device)
+        image_ids = [dataset.get_image_id(index) for index in range(len(dataset))]
+        labels = [dataset.get_label(index) for index in range(len(dataset))]
+
+        # The main process fills the cache, the other ranks only read it afterwards
+        if not is_main_process():
+            barrier()
+        with span("feature_cache"):
+            features, rows = cache.build(dataset, image_ids)
+        if is_main_process():
+            barrier()
+        return FeatureDataset(features, rows, labels)
+
+    def subsample_dataset(self, dataset: Dataset, fraction: float) -> Dataset:
+        """Get a fixed random subset of the input dataset to keep the per-epoch validation cheap
+
+        Args:
+            dataset: dataset to sample from
+            fraction: fraction of the dataset to keep, between 0 and 1. None keeps everything
+
+        Returns:
+            the subsampled dataset
+        """
+        if fraction is None or fraction >= 1.0:
+            return dataset
+        if fraction <= 0.0:
+            raise ValueError(f"Validation subsample must be in (0, 1], got: {fraction}")
+
+        sample_size = max(1, int(fraction * len(dataset)))
+        generator = torch.Generator().manual_seed(self.seed)
+        indices = torch.randperm(len(dataset), generator=generator)[:sample_size]
+        logger.debug(f"Validating every epoch on {sample_size}/{len(dataset)} samples")
+        return Subset(dataset, indices.tolist())
+
     def evaluate_model(
-        self, model, dataloader: DataLoader, criterion: nn.Module, output_path: str
+        self,
+        model,
+        dataloader: DataLoader,
+        criterion: nn.Module,
+        output_path: str = None,
     ):
-        """Evaluate the input model with the input data"""
+        """Evaluate the input model with the input data. The metrics are accumulated on the
+        device and the per-class results are written to output_path as JSON"""
         model.eval()
-        running_loss = 0.0
-        correct_predictions = 0
-        total_predictions = 0
+        accumulator = MetricsAccumulator(
+            self.num_classes, self.device, class_names=self.class_names
+        )
 
         with torch.no_grad():
-            for inputs, labels in tqdm(dataloader):
+            for inputs, labels in tqdm(dataloader, disable=not is_main_process()):
                 inputs, labels = inputs.to(self.device), labels.to(self.device)
 
                 outputs = model(inputs)
                 loss = criterion(outputs, labels)
-                running_loss += loss.item() * inputs.size(0)
-
-                _, predicted = torch.max(outputs, 1)
-                _, labels_max = torch.max(labels, 1)
-                correct_predictions += (predicted == labels_max).sum().item()
-                total_predictions += labels.size(0)
+                accumulator.update(loss, outputs, labels)
 
-        avg_loss = running_loss / len(dataloader.dataset)
-        accuracy = correct_predictions / total_predictions
+        # Every rank evaluates its own shard, compute() combines the totals of all ranks
+        results = accumulator.compute()
+        avg_loss = results["loss"]
+        accuracy = results["accuracy"]
 
         logger.info(f"Evaluation Loss: {avg_loss:.4f}, Accuracy: {accuracy:.4f}")
+        if output_path is None:
+            return avg_loss, accuracy
 
-        with open(output_path, "a") as f:
-            f.write(f"Evaluation Loss: {avg_loss:.4f}, Accuracy: {accuracy:.4f}")
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=4)
 
         logger.debug(f"Output saved to: {output_path}")
 
@@ -0,0 +1,153 @@
+from library.resource_usage import get_peak_rss_bytes
+
+import json
+import logging
+import time
+import torch
+from torch.profiler import ProfilerActivity, profile, schedule
+
+logger = logging.getLogger(__name__)
+
+STEP_PHASES = ["data_wait", "host_to_device", "forward", "backward", "optimizer"]
+
+
+class TrainingMetrics:
+    """Times every phase of a training step and writes the results as JSON lines
+
+    * metrics_path: JSONL file to append the step and epoch records to. None disables the timing
+    * device: device the model runs on, CUDA is synchronized before every reading
+    * run_info: extra fields to write in the first record of the run
+    """
+
+    def __init__(self, metrics_path: str, device: torch.device, run_info: dict = None):
+        self.metrics_path = metrics_path
+        self.enabled = metrics_path is not None
+        self.synchronize = device.type == "cuda"
+        self.file = None
+        self.step = 0
+        self.phase_start = None
+        self.step_times = {}
+        self.epoch_times = {phase: 0.0 for phase in STEP_PHASES}
+
+        if self.enabled:
+            self.file = open(self.metrics_path, "a")
+            self.write_record({"type": "run", **(run_info or {})})
+            logger.info(f"Writing training metrics to: {self.metrics_path}")
+
+    def write_record(self, record: dict) -> None:
+        """Write the input record as one line of the metrics file"""
+        record["time"] = time.time()
+        self.file.write(json.dumps(record) + "\n")
+
+    def now(self) -> float:
+        """Get the current time, once all the queued device work finished"""
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def start_data_wait(self) -> None:
+        """Mark the point from which the next batch is awaited"""
+        if self.enabled:
+            self.phase_start = self.now()
+
+    def lap(self, phase: str) -> None:
+        """Record the time spent in the input phase since the previous lap"""
+        if not self.enabled:
+            return
+        now = self.now()
+        self.step_times[phase] = now - self.phase_start
+        self.phase_start = now
+
+    def end_step(self, epoch: int, batch_size: int) -> None:
+        """Write the record for the finished step and start waiting for the next batch"""
+        if not self.enabled:
+            return
+        step_time = sum(self.step_times.values())
+        for phase, duration in self.step_times.items():
+            self.epoch_times[phase] += duration
+
+        self.write_record(
+            {
+                "type": "step",
+                "epoch": epoch,
+                "step": self.step,
+                "batch_size": batch_size,
+                **self.step_times,
+                "step_time": step_time,
+                "images_per_sec": batch_size / step_time if step_time else None,
+            }
+        )
+        self.step += 1
+        self.step_times = {}
+        self.phase_start = self.now()
+
+    def end_epoch(
+        self, epoch: int, loss: float, num_samples: int, epoch_time: float
+    ) -> None:
+        """Write the summary record of the finished epoch"""
+        if not self.enabled:
+            return
+        self.write_record(
+            {
+                "type": "epoch",
+                "epoch": epoch,
+                "loss": loss,
+                "num_samples": num_samples,
+                "epoch_time": epoch_time,
+                "images_per_sec": num_samples / epoch_time if epoch_time else None,
+                **self.epoch_times,
+                "peak_rss_bytes": get_peak_rss_bytes(),
+            }
+        )
+        self.file.flush()
+        self.epoch_times = {phase: 0.0 for phase in STEP_PHASES}
+
+    def close(self) -> None:
+        """Close the metrics file"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def create_step_profiler(
+    start_step: int, end_step: int, trace_path: str, device: torch.device
+) -> profile:
+    """Create a torch profiler that captures the training steps in [start_step, end_step)
+    and exports them as a chrome trace. profiler.step() has to be called after every step.
+
+    Args:
+        start_step: first training step to capture, counted across epochs
+        end_step: training step at which the capture stops
+        trace_path: path of the chrome trace to export
+        device: device the model runs on
+
+    Returns:
+        the profiler, not started yet
+    """
+    if start_step < 0 or end_step <= start_step:
+        raise ValueError(
+            f"Profiler steps must satisfy 0 <= start < end, got: {start_step}, {end_step}"
+        )
+
+    activities = [ProfilerActivity.CPU]
+    if device.type == "cuda":
+        activities.append(ProfilerActivity.CUDA)
+
+    def export_trace(profiler: profile) -> None:
+        profiler.export_chrome_trace(trace_path)
+        logger.info(f"Profiler trace saved to: {trace_path}")
+
+    # The step before the capture window warms the profiler up
+    warmup = 1 if start_step > 0 else 0
+    return profile(
+        activities=activities,
+        schedule=schedule(
+            wait=start_step - warmup,
+            warmup=warmup,
+            active=end_step - start_step,
+            repeat=1,
+        ),
+        on_trace_ready=export_trace,
+        record_shapes=True,
+        profile_memory=True,
+    )